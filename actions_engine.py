@@ -3,10 +3,10 @@
 import os
 import subprocess
 import re
-import threading
 import time
 import json
 import shutil
+import trace_engine
 from screeninfo import get_monitors
 
 try:
@@ -27,7 +27,8 @@ def find_app_with_powershell(app_name):
         ps_cmd = f"Get-StartApps | Where-Object {{ $_.Name -match '{app_name}' }} | Select-Object -First 1 Name, AppID | ConvertTo-Json"
         full_cmd = ["powershell", "-Command", ps_cmd]
         
-        output = subprocess.check_output(full_cmd, stderr=subprocess.STDOUT).decode('utf-8').strip()
+        with trace_engine.span("action.find_app", app=app_name):
+            output = subprocess.check_output(full_cmd, stderr=subprocess.STDOUT).decode('utf-8').strip()
         if output:
             data = json.loads(output)
             if isinstance(data, dict):
@@ -51,14 +52,15 @@ def get_monitor_bounds(monitor_index):
 def move_window_to_monitor(app_name, monitor_index):
     """
     Polls for a window associated with app_name and moves it to the target monitor.
+    Returns True once it was moved, False if it never appeared (None: can't move windows here).
     """
     if not win32gui:
         print("⚠️ win32gui not available. Skipping window move.")
-        return
+        return None
 
     bounds = get_monitor_bounds(monitor_index)
     if not bounds:
-        return
+        return None
 
     target_x, target_y, target_w, target_h = bounds
     app_name_lower = app_name.lower()
@@ -110,6 +112,7 @@ def move_window_to_monitor(app_name, monitor_index):
 
     if not found:
         print(f"⏳ Timeout: Could not find main window for '{app_name}' within 20 seconds.")
+    return found
 
 SOFTWARE_MAPPING = {
     "autocad": r"C:\Program Files\Autodesk\AutoCAD 2026\acad.exe",
@@ -138,6 +141,9 @@ SOFTWARE_MAPPING = {
 def open_software(app_name, monitor=None):
     """
     Attempts to open a software application with robust Windows discovery.
+    With a monitor, waits until the app's window is up and moved there (actions
+    run on their own pool, so this doesn't hold up the reply).
+    Returns False if the launch failed, None if the window never appeared.
     """
     app_name_lower = app_name.lower().strip()
     target_data = SOFTWARE_MAPPING.get(app_name_lower, app_name_lower)
@@ -146,8 +152,8 @@ def open_software(app_name, monitor=None):
     if isinstance(target_data, str) and target_data.endswith(":"):
         try:
             os.system(f'start {target_data}')
-            if monitor:
-                threading.Thread(target=move_window_to_monitor, args=(app_name, monitor), daemon=True).start()
+            if monitor and move_window_to_monitor(app_name, monitor) is False:
+                return None
             return True
         except: pass
 
@@ -191,8 +197,8 @@ def open_software(app_name, monitor=None):
             print(f"  - Launch failed: {e}")
 
     if success:
-        if monitor:
-            threading.Thread(target=move_window_to_monitor, args=(app_name, monitor), daemon=True).start()
+        if monitor and move_window_to_monitor(app_name, monitor) is False:
+            return None
         return True
 
     return False
@@ -205,11 +211,20 @@ def execute_action(action_string):
     params_str = match.group(2)
     params = [p.strip().strip('"\'') for p in params_str.split(',') if p.strip()]
 
+    with trace_engine.span(f"action.{action_type.lower()}", params=params) as span:
+        span["result"] = result = run_action(action_type, params)
+    return result
+
+def run_action(action_type, params):
+    """Carry out a parsed action; returns what to report back"""
     if action_type == "OPEN_APP":
         param = params[0] if params else ""
         monitor = int(params[1]) if len(params) > 1 and params[1].isdigit() else None
-        if open_software(param, monitor):
-            return f"Opening {param}" + (f" on monitor {monitor}." if monitor else ".")
+        opened = open_software(param, monitor)
+        if opened:
+            return f"Opened {param}" + (f" on monitor {monitor}." if monitor else ".")
+        if opened is None:
+            return f"Started {param}, but its window didn't show up on monitor {monitor}."
         return f"Could not open {param}."
     
     elif action_type == "CALL":
@@ -4,7 +4,10 @@ import google.generativeai as genai
 import config
 import requests
 import json
+import metrics_engine
+import trace_engine
 from memory_engine import memory_context
+from turn_pipeline import cancel_requested
 
 # ---- System Prompt ----
 SYSTEM_PROMPT = """
@@ -43,17 +46,30 @@ except Exception as e:
     print(f"⚠️ Gemini Initialization Error: {e}")
     gemini_model = None
 
-def query_gemini(prompt):
+_gemini_models = {}
+
+def _gemini_for(system_prompt):
+    """Gemini model for a non-default system prompt (cached)"""
+    if system_prompt not in _gemini_models:
+        _gemini_models[system_prompt] = genai.GenerativeModel(
+            model_name='gemini-2.0-flash',
+            system_instruction=system_prompt
+        )
+    return _gemini_models[system_prompt]
+
+def query_gemini(prompt, system_prompt=None):
     if not gemini_model: return None
     try:
-        response = gemini_model.generate_content(prompt)
+        model = gemini_model if system_prompt is None else _gemini_for(system_prompt)
+        response = model.generate_content(prompt)
         return response.text.strip()
     except Exception as e:
         print(f"⚠️ Gemini Error: {e}")
         return None
 
-def query_gemma(prompt):
+def query_gemma(prompt, system_prompt=None):
     if not config.GEMMA_API_KEY: return None
+    system_prompt = system_prompt or SYSTEM_PROMPT
     try:
         # Check if the key is an OpenRouter key
         if config.GEMMA_API_KEY.startswith("sk-or-"):
@@ -67,7 +83,7 @@ def query_gemma(prompt):
             data = {
                 "model": config.GEMMA_MODEL,
                 "messages": [
-                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prompt}
                 ]
             }
@@ -77,6 +93,7 @@ def query_gemma(prompt):
             url = f"https://generativelanguage.googleapis.com/v1beta/models/{config.GEMMA_MODEL}:generateContent?key={config.GEMMA_API_KEY}"
             headers = {"Content-Type": "application/json"}
             data = {
+                "systemInstruction": {"parts": [{"text": system_prompt}]},
                 "contents": [{"parts": [{"text": prompt}]}],
                 "generationConfig": {"temperature": 0.7, "maxOutputTokens": 800}
             }
@@ -93,7 +110,7 @@ def query_gemma(prompt):
         print(f"⚠️ Gemma Exception: {repr(e)}")
         return None
 
-def query_openai(prompt):
+def query_openai(prompt, system_prompt=None):
     if config.OPENAI_API_KEY == "YOUR_OPENAI_API_KEY": return None
     
     # Use OpenRouter if configured, otherwise default to OpenAI
@@ -113,7 +130,7 @@ def query_openai(prompt):
     data = {
         "model": model,
         "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": system_prompt or SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ]
     }
@@ -128,7 +145,7 @@ def query_openai(prompt):
         print(f"⚠️ OpenAI/OpenRouter Exception: {repr(e)}")
         return None
 
-def query_anthropic(prompt):
+def query_anthropic(prompt, system_prompt=None):
     if config.ANTHROPIC_API_KEY == "YOUR_ANTHROPIC_API_KEY": return None
     url = "https://api.anthropic.com/v1/messages"
     headers = {
@@ -139,7 +156,7 @@ def query_anthropic(prompt):
     data = {
         "model": "claude-3-haiku-20240307",
         "max_tokens": 1024,
-        "system": SYSTEM_PROMPT,
+        "system": system_prompt or SYSTEM_PROMPT,
         "messages": [{"role": "user", "content": prompt}]
     }
     try:
@@ -153,7 +170,7 @@ def query_anthropic(prompt):
         print(f"⚠️ Claude Exception: {repr(e)}")
         return None
 
-def query_xai(prompt):
+def query_xai(prompt, system_prompt=None):
     if config.XAI_API_KEY == "YOUR_XAI_API_KEY": return None
     url = "https://api.x.ai/v1/chat/completions"
     headers = {
@@ -163,7 +180,7 @@ def query_xai(prompt):
     data = {
         "model": "grok-beta",
         "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": system_prompt or SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ]
     }
@@ -178,11 +195,11 @@ def query_xai(prompt):
         print(f"⚠️ Grok Exception: {repr(e)}")
         return None
 
-def query_ollama(prompt):
+def query_ollama(prompt, system_prompt=None):
     url = config.OLLAMA_URL
     data = {
         "model": config.OLLAMA_MODEL,
-        "prompt": f"{SYSTEM_PROMPT}\n\nUser: {prompt}",
+        "prompt": f"{system_prompt or SYSTEM_PROMPT}\n\nUser: {prompt}",
         "stream": False
     }
     try:
@@ -194,43 +211,71 @@ def query_ollama(prompt):
         print(f"⚠️ Ollama Error: {e}")
         return None
 
-def format_session_history(session_history, max_exchanges=5):
-    """Format recent conversation history for AI context"""
-    if not session_history:
+# Rough relative cost, cheapest first - used for background work like summaries
+PROVIDER_COST_RANK = {'ollama': 0, 'gemma': 1, 'gemini': 2, 'openai': 3, 'grok': 4, 'claude': 5}
+
+def provider_map():
+    return {
+        'gemini': query_gemini,
+        'gemma': query_gemma,
+        'openai': query_openai,
+        'claude': query_anthropic,
+        'grok': query_xai,
+        'ollama': query_ollama
+    }
+
+def query_cheapest(prompt, system_prompt=None):
+    """
+    Run a background prompt on the configured providers, cheapest first.
+    Returns None if every provider fails.
+    """
+    providers = provider_map()
+    order = sorted(config.AI_FALLBACK_ORDER, key=lambda p: PROVIDER_COST_RANK.get(p, 99))
+    for provider in order:
+        if provider in providers:
+            with trace_engine.span(f"llm.{provider}") as span:
+                response = metrics_engine.call_provider("llm", provider, providers[provider], prompt, system_prompt)
+                span["ok"] = bool(response)
+            if response:
+                return response
+    return None
+
+def format_session_history(session_history, max_exchanges=5, summary=""):
+    """Format recent conversation history (plus a summary of older turns) for AI context"""
+    if not session_history and not summary:
         return ""
     
     # Get the last N exchanges (each exchange is 2 entries: user + jarvis)
-    recent = session_history[-(max_exchanges * 2):]
+    recent = (session_history or [])[-(max_exchanges * 2):]
     formatted = "\n".join([f"{role}: {text}" for role, text in recent])
-    return f"\n[Current Session]\n{formatted}\n"
+    earlier = f"\n[Earlier This Session]\n{summary}\n" if summary else ""
+    return f"{earlier}\n[Current Session]\n{formatted}\n"
 
-def get_ai_response(user_input, session_history=None):
+def get_ai_response(user_input, session_history=None, session_summary=""):
     """
     Tries each provider in the fallback order defined in config.py
     session_history: list of tuples [(role, text), ...] for conversation context
+    session_summary: running summary of turns that have left the session window
     """
-    context = memory_context(user_input)
+    with metrics_engine.timer("memory_context_seconds"), trace_engine.span("llm.memory_context"):
+        context = memory_context(user_input)
     
     # Add session history for context
-    session_context = format_session_history(session_history) if session_history else ""
+    session_context = format_session_history(session_history, summary=session_summary)
     
     full_prompt = f"{context}{session_context}\n\nUser: {user_input}"
     
-    provider_map = {
-        'gemini': query_gemini,
-        'gemma': query_gemma,
-        'openai': query_openai,
-        'claude': query_anthropic,
-        'grok': query_xai,
-        'ollama': query_ollama
-    }
+    providers = provider_map()
     
     for provider in config.AI_FALLBACK_ORDER:
-        if provider in provider_map:
+        if cancel_requested():
+            return None  # The turn was superseded while an earlier provider was failing
+        if provider in providers:
             print(f"🤖 Attempting with {provider.capitalize()}...")
-            response = provider_map[provider](full_prompt)
+            with trace_engine.span(f"llm.{provider}") as span:
+                response = metrics_engine.call_provider("llm", provider, providers[provider], full_prompt)
+                span["ok"] = bool(response)
             if response:
                 return response
                 
     return "I apologize, sir. All my sub-processors are currently unresponsive. I am unable to process your request."
-
@@ -0,0 +1,245 @@
+# background_writer.py
+"""
+Single background writer for log, session and other append-only files.
+Callers enqueue work and return immediately; the writer thread batches
+appends per file and flushes every FLUSH_EVERY_RECORDS records or every
+FLUSH_EVERY_MS milliseconds, whichever comes first. Pending data is
+flushed on shutdown. Other background work (embedding, database updates)
+goes to a separate job thread through run(), so it never holds up a flush.
+When the queue is full producers wait; whole-file writes to the same path
+and repeated run_coalesced() jobs collapse into the newest one.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics_engine
+
+# Flush policy
+FLUSH_EVERY_RECORDS = 50
+FLUSH_EVERY_MS = 200
+FSYNC_ON_FLUSH = False  # True trades some latency on the writer thread for durability
+
+# Bound on queued operations; when full, producers wait (backpressure, counted in
+# background_writer_waits_total) - appends and calls are never dropped
+MAX_QUEUE = 10000
+
+
+class BackgroundWriter:
+    """Batches file appends on one daemon thread"""
+
+    def __init__(self, flush_records=FLUSH_EVERY_RECORDS, flush_ms=FLUSH_EVERY_MS,
+                 fsync=FSYNC_ON_FLUSH, max_queue=MAX_QUEUE):
+        self.flush_records = flush_records
+        self.flush_interval = flush_ms / 1000.0
+        self.fsync = fsync
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.pending = {}       # path -> [text, ...] not yet written
+        self.pending_count = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        self.closed = False
+        self.writes = {}        # path -> newest text of a queued whole-file write
+        self.waits = 0
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="background-writer", daemon=True)
+                self.thread.start()
+
+    # ---- Producer API ----
+    def append(self, path, text):
+        """Append text to a file (batched)"""
+        self._put(("append", path, text))
+
+    def write(self, path, text):
+        """Replace a whole file atomically; a newer write to a still-queued path replaces it"""
+        with self.lock:
+            queued = path in self.writes
+            self.writes[path] = text
+        if not queued:
+            self._put(("write", path, None))
+
+    def submit(self, func, *args):
+        """Run func(*args) on the writer thread (file I/O only; other work goes to run())"""
+        self._put(("call", func, args))
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far is on disk"""
+        done = threading.Event()
+        self._put(("flush", done, None))
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Flush and stop the writer thread"""
+        if self.closed:
+            return
+        if self.thread is not None and self.thread.is_alive():
+            self.flush(timeout)
+            self.queue.put(("stop", None, None))
+            self.thread.join(timeout)
+        self.closed = True
+
+    def _put(self, item):
+        if self.closed:
+            self._run_now(item)  # Late writes during shutdown go straight to disk
+            return
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # The disk can't keep up: wait for room rather than lose data
+            self.waits += 1
+            metrics_engine.inc('background_writer_waits_total', kind=item[0])
+            if self.waits == 1 or self.waits % 1000 == 0:
+                print(f"⚠️ Background writer queue full, producers waited {self.waits} times")
+            self.queue.put(item)
+
+    # ---- Writer thread ----
+    def _run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                kind, target, data = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush_pending()
+                deadline = None
+                continue
+
+            if kind == "append":
+                self.pending.setdefault(target, []).append(data)
+                self.pending_count += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if self.pending_count >= self.flush_records:
+                    self._flush_pending()
+                    deadline = None
+            elif kind == "flush":
+                self._flush_pending()
+                deadline = None
+                target.set()
+            elif kind == "stop":
+                self._flush_pending()
+                return
+            else:
+                self._run_now((kind, target, data))
+
+    def _run_now(self, item):
+        kind, target, data = item
+        try:
+            if kind == "append":
+                self._write_batch(target, [data])
+            elif kind == "write":
+                with self.lock:
+                    data = self.writes.pop(target)
+                directory = os.path.dirname(target)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp = target + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(data)
+                    self._sync(f)
+                os.replace(tmp, target)
+            elif kind == "call":
+                target(*data)
+            elif kind == "flush":
+                target.set()
+        except Exception as e:
+            print(f"❌ Background write failed ({kind}): {e}")
+
+    def _flush_pending(self):
+        pending, self.pending, self.pending_count = self.pending, {}, 0
+        for path, chunks in pending.items():
+            try:
+                self._write_batch(path, chunks)
+            except Exception as e:
+                print(f"❌ Background write to {path} failed: {e}")
+
+    def _write_batch(self, path, chunks):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(chunks))
+            self._sync(f)
+
+    def _sync(self, f):
+        if self.fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+writer = BackgroundWriter()
+
+# Non-file background work, one job at a time in submission order
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="background-job")
+
+
+def _report_job(future):
+    error = future.exception()
+    if error is not None:
+        print(f"❌ Background job failed: {error}")
+
+
+def run(func, *args):
+    """Run func(*args) on the job thread, away from both the caller and the file writer"""
+    try:
+        JOB_EXECUTOR.submit(func, *args).add_done_callback(_report_job)
+    except RuntimeError:
+        func(*args)  # Executor already shut down (exiting): run it here
+
+
+_waiting = set()          # Coalesced jobs queued but not yet started
+_waiting_lock = threading.Lock()
+
+
+def _run_waiting(func):
+    with _waiting_lock:
+        _waiting.discard(func)  # A request made from here on queues one more run
+    func()
+
+
+def run_coalesced(func):
+    """Like run(func), but at most one call waits at a time; requests made while one
+    waits share it. For jobs that catch up on everything pending (index refreshes)"""
+    with _waiting_lock:
+        if func in _waiting:
+            metrics_engine.inc('background_jobs_coalesced_total')
+            return
+        _waiting.add(func)
+    run(_run_waiting, func)
+
+
+def _shutdown():
+    JOB_EXECUTOR.shutdown(wait=True)  # Jobs may still queue writes
+    writer.close()
+
+
+atexit.register(_shutdown)
+
+
+def append(path, text):
+    writer.append(path, text)
+
+
+def write(path, text):
+    writer.write(path, text)
+
+
+def submit(func, *args):
+    writer.submit(func, *args)
+
+
+def flush(timeout=5.0):
+    return writer.flush(timeout)
+
+
+def close(timeout=5.0):
+    JOB_EXECUTOR.shutdown(wait=True)
+    writer.close(timeout)
@@ -0,0 +1,145 @@
+# command_scheduler.py
+"""
+Scheduling of conversation commands.
+Each session's commands wait in a CommandQueue, served by priority (system >
+voice > typed) and in arrival order within a priority. A command identical to
+one already waiting or running is coalesced into it. A new command supersedes
+the session's older commands of the same or lower priority: waiting ones are
+dropped and the running one is cancelled (its task, plus its cancel flag, which
+the stage calls check - see turn_pipeline.cancel_requested).
+The turn slots shared by all sessions are handed out by priority as well.
+"""
+
+import asyncio
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+import metrics_engine
+
+PRIORITIES = {'system': 0, 'voice': 1, 'typed': 2}
+
+# False: commands queue up behind the running one instead of replacing it
+SUPERSEDE = True
+
+_sequence = itertools.count()
+
+
+class Command:
+    """A typed command, an utterance (pcm, sample_rate) to transcribe, or a control command"""
+
+    def __init__(self, kind, text=None, audio=None):
+        self.kind = kind
+        self.priority = PRIORITIES[kind]
+        self.text = text
+        self.audio = audio
+        self.seq = next(_sequence)
+        self.queued = time.perf_counter()
+        self.key = " ".join(text.lower().split()) if text else None  # Audio is never coalesced
+        self.cancelled = threading.Event()
+        self.task = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.task is not None:
+            self.task.cancel()
+
+
+class CommandQueue:
+    """A session's waiting commands and the one it is running"""
+
+    def __init__(self):
+        self._heap = []
+        self._ready = asyncio.Event()
+        self.running = None
+
+    def qsize(self):
+        return len(self._heap)
+
+    def put(self, command):
+        """Queue a command; returns the commands it superseded (None if it was coalesced)"""
+        for other in self._heap + [self.running]:
+            if other is not None and command.key and other.key == command.key and not other.cancelled.is_set():
+                metrics_engine.inc('commands_total', kind=command.kind, result='coalesced')
+                return None
+        superseded = []
+        if SUPERSEDE:
+            superseded = [c for c in self._heap if c.priority >= command.priority]
+            if superseded:
+                self._heap = [c for c in self._heap if c.priority < command.priority]
+                heapq.heapify(self._heap)
+            running = self.running
+            if running is not None and running.priority >= command.priority and not running.cancelled.is_set():
+                superseded.append(running)
+            for other in superseded:
+                other.cancel()
+                metrics_engine.inc('commands_superseded_total', kind=other.kind)
+        heapq.heappush(self._heap, command)
+        self._ready.set()
+        metrics_engine.inc('commands_total', kind=command.kind, result='queued')
+        return superseded
+
+    def cancel_all(self):
+        """Drop the waiting commands and cancel the running one; returns them"""
+        running = self.running
+        cancelled = self._heap + ([running] if running and not running.cancelled.is_set() else [])
+        self._heap = []
+        for command in cancelled:
+            command.cancel()
+        return cancelled
+
+    async def get(self):
+        """Wait for the next command; it becomes the running one"""
+        while not self._heap:
+            self._ready.clear()
+            await self._ready.wait()
+        command = heapq.heappop(self._heap)
+        metrics_engine.observe('command_wait_seconds', time.perf_counter() - command.queued, kind=command.kind)
+        self.running = command
+        return command
+
+    def done(self, command):
+        if self.running is command:
+            self.running = None
+
+
+class TurnSlots:
+    """A semaphore whose waiters get the next free slot by priority, then in arrival order"""
+
+    def __init__(self, size):
+        self.free = size
+        self._waiters = []  # (priority, seq, future)
+
+    def waiting(self):
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority):
+        if self.free > 0 and not self.waiting():
+            self.free -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(_sequence), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()  # Given a slot just as we were cancelled: pass it on
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
@@ -0,0 +1,256 @@
+# fact_store.py
+"""
+Ranked, deduplicated access to the facts in memory.json.
+memory.json stays the list of record; this keeps an embedding matrix of it
+(hashed n-grams from semantic_memory) plus per-fact usage and recency stats
+in the history database. New facts that restate an existing one are merged
+instead of appended, and memory_context gets the facts that score best on
+relevance to the query, recency and usage, within a character budget.
+"""
+
+import math
+import re
+import threading
+import time
+
+import background_writer
+import history_store
+import semantic_memory
+
+np = semantic_memory.np  # Optional; ranking falls back to word overlap without it
+
+# Cosine similarity above which a new fact restates an existing one
+DUPLICATE_SCORE = 0.88
+
+# Context selection
+FACT_LIMIT = 6
+FACT_BUDGET_CHARS = 600
+
+# Score = relevance + RECENCY_WEIGHT * recency + USAGE_WEIGHT * log(1 + uses)
+RECENCY_WEIGHT = 0.15
+RECENCY_HALF_LIFE_DAYS = 30
+USAGE_WEIGHT = 0.05
+
+# Only facts at least this relevant count as "used" when selected
+USED_SCORE = semantic_memory.MIN_SCORE
+
+PUNCT_RE = re.compile(r"[^\w\s']")
+
+
+def normalize(fact):
+    return " ".join(PUNCT_RE.sub(" ", fact.lower()).split())
+
+
+class FactStore:
+    """Index over a facts list; call sync() with the current list before use"""
+
+    def __init__(self, store=None):
+        self.store = store
+        self.lock = threading.Lock()
+        self.facts = []
+        self.rows = {}          # normalized text -> row
+        self.positions = {}     # exact text -> row
+        self.matrix = None
+        self.stats = None       # fact -> [added, uses, last_used]
+        self.stat_matrix = None # row -> (added, uses, last_used), for vectorised ranking
+
+    def _history(self):
+        return self.store or history_store.get_store()
+
+    def sync(self, facts):
+        """Bring the index in line with memory.json (cheap when nothing changed)"""
+        with self.lock:
+            if self.stats is None:
+                self.stats = {f: list(s) for f, s in self._history().fact_stats().items()}
+            if facts == self.facts:
+                return
+            old = {f: i for i, f in enumerate(self.facts)}
+            if np is not None:
+                matrix = np.zeros((max(len(facts), 1), semantic_memory.EMBED_DIM), dtype=np.float32)
+                for i, fact in enumerate(facts):
+                    j = old.get(fact)
+                    matrix[i] = self.matrix[j] if j is not None else semantic_memory.embed(fact)
+                self.matrix = matrix
+            self.facts = list(facts)
+            self.rows = {}
+            self.positions = {}
+            for i, fact in enumerate(self.facts):
+                self.rows.setdefault(normalize(fact), i)
+                self.positions[fact] = i
+
+            now = time.time()
+            unseen = [f for f in self.facts if f not in self.stats]
+            if unseen:
+                for fact in unseen:
+                    self.stats[fact] = [now, 0, 0.0]
+                background_writer.run(self._history().record_facts, unseen, now)
+            if np is not None:
+                self.stat_matrix = np.array([self.stats[f] for f in self.facts], dtype=np.float64).reshape(-1, 3)
+
+    def _set_stat(self, fact, stat):
+        self.stats[fact] = stat
+        row = self.positions.get(fact)
+        if row is not None and self.stat_matrix is not None:
+            self.stat_matrix[row] = stat
+
+    # ---- Inserting ----
+    def nearest(self, fact):
+        """(similarity, existing fact) of the closest stored fact"""
+        with self.lock:
+            row = self.rows.get(normalize(fact))
+            if row is not None:
+                return 1.0, self.facts[row]
+            if not self.facts:
+                return 0.0, None
+            if np is None:
+                words = set(history_store.tokenize(fact))
+                best = max(self.facts, key=lambda f: len(words & set(history_store.tokenize(f))))
+                overlap = words & set(history_store.tokenize(best))
+                union = words | set(history_store.tokenize(best))
+                return (len(overlap) / len(union) if union else 0.0), best
+            scores = self.matrix[:len(self.facts)] @ semantic_memory.embed(fact)
+            row = int(np.argmax(scores))
+            return float(scores[row]), self.facts[row]
+
+    def classify(self, fact):
+        """
+        Decide how a new fact lands: ("new", None), ("duplicate", existing) when
+        an existing fact already says it, or ("reword", existing) when the new
+        text restates an existing fact with more detail and should replace it.
+        """
+        score, existing = self.nearest(fact)
+        if existing is None or score < DUPLICATE_SCORE:
+            return "new", None
+        if len(normalize(fact)) > len(normalize(existing)):
+            return "reword", existing
+        return "duplicate", existing
+
+    def note_duplicate(self, existing):
+        self.touch([existing])
+
+    def note_reword(self, old, new):
+        now = time.time()
+        with self.lock:
+            added, uses, _ = self.stats.pop(old, [now, 0, 0.0])
+            self._set_stat(new, [added, uses + 1, now])
+        background_writer.run(self._history().rename_fact, old, new, now)
+
+    # ---- Ranking ----
+    def touch(self, facts):
+        now = time.time()
+        with self.lock:
+            for fact in facts:
+                added, uses, _ = self.stats.get(fact, (now, 0, 0.0))
+                self._set_stat(fact, [added, uses + 1, now])
+        background_writer.run(self._history().touch_facts, list(facts), now)
+
+    def _relevance(self, query):
+        if not query.strip():
+            return [0.0] * len(self.facts)
+        if np is None:
+            words = set(history_store.tokenize(query))
+            return [len(words & set(history_store.tokenize(f))) / (len(words) or 1) for f in self.facts]
+        return self.matrix[:len(self.facts)] @ semantic_memory.embed(query)
+
+    def rank(self, query, limit=None, now=None):
+        """(score, relevance, fact) for the best `limit` facts (all if None), best first"""
+        now = now or time.time()
+        with self.lock:
+            if not self.facts:
+                return []
+            relevance = self._relevance(query)
+            half_life = RECENCY_HALF_LIFE_DAYS * 86400
+            if np is not None:
+                added, uses, last_used = self.stat_matrix.T
+                age = np.maximum(0.0, now - np.maximum(added, last_used))
+                scores = relevance + RECENCY_WEIGHT * 0.5 ** (age / half_life) + USAGE_WEIGHT * np.log1p(uses)
+                if limit and limit < len(scores):
+                    order = np.argpartition(-scores, limit - 1)[:limit]
+                    order = order[np.argsort(-scores[order])]
+                else:
+                    order = np.argsort(-scores)
+                return [(float(scores[i]), float(relevance[i]), self.facts[i]) for i in order]
+            scored = []
+            for r, fact in zip(relevance, self.facts):
+                added, uses, last_used = self.stats.get(fact, (0.0, 0, 0.0))
+                age = max(0.0, now - max(added, last_used))
+                scored.append((r + RECENCY_WEIGHT * 0.5 ** (age / half_life) + USAGE_WEIGHT * math.log1p(uses), r, fact))
+            scored.sort(key=lambda item: item[0], reverse=True)
+            return scored[:limit] if limit else scored
+
+    def select(self, query, limit=FACT_LIMIT, budget=FACT_BUDGET_CHARS):
+        """Best facts for the prompt, within limit and a character budget"""
+        chosen, used, size = [], [], 0
+        seen = set()
+        for score, relevance, fact in self.rank(query, limit * 8):  # Headroom for budget skips
+            key = normalize(fact)
+            if key in seen or size + len(fact) > budget:
+                continue
+            seen.add(key)
+            chosen.append(fact)
+            size += len(fact) + 2
+            if relevance >= USED_SCORE:
+                used.append(fact)
+            if len(chosen) >= limit:
+                break
+        if used:
+            self.touch(used)
+        return chosen
+
+    def deduplicate(self):
+        """
+        Facts list with near-duplicates folded into their longest wording, kept
+        at the position of the first. A one-off clean-up: the similarity pass is
+        quadratic, done in chunks so memory stays bounded.
+        """
+        with self.lock:
+            facts = list(self.facts)
+            matrix = self.matrix[:len(facts)] if np is not None else None
+        group = list(range(len(facts)))  # Each fact's representative (an earlier fact)
+        keys = {}
+        for i, fact in enumerate(facts):
+            group[i] = keys.setdefault(normalize(fact), i)
+        if matrix is not None:
+            for start in range(0, len(facts), 256):
+                sims = matrix[start:start + 256] @ matrix.T
+                for offset, row in enumerate(sims):
+                    i = start + offset
+                    if group[i] != i:
+                        continue
+                    row[i:] = -1.0  # Compare with earlier facts only
+                    j = int(np.argmax(row))
+                    if row[j] >= DUPLICATE_SCORE:
+                        group[i] = group[j]
+        best = {}
+        for i, fact in enumerate(facts):
+            root = group[i]
+            if root not in best or len(normalize(fact)) > len(normalize(best[root])):
+                best[root] = fact
+        return [best[i] for i in range(len(facts)) if group[i] == i]
+
+
+_facts = FactStore()
+
+
+def get_fact_store():
+    return _facts
+
+
+if __name__ == "__main__":
+    import sys
+    from memory_engine import load_memory, store
+
+    facts = get_fact_store()
+    facts.sync(load_memory().get("facts", []))
+    if len(sys.argv) > 1 and sys.argv[1] == "dedupe":
+        kept = facts.deduplicate()
+        print(f"🧹 {len(facts.facts)} facts → {len(kept)} after folding near-duplicates")
+        store.set_facts(kept)
+        store.flush()
+    else:
+        query = " ".join(sys.argv[1:])
+        start = time.perf_counter()
+        ranked = facts.rank(query, FACT_LIMIT)
+        print(f"🔍 '{query}': ranked {len(facts.facts)} facts in {(time.perf_counter() - start) * 1000:.2f} ms")
+        for score, relevance, fact in ranked:
+            print(f"   {score:.2f} (rel {relevance:.2f}) {fact[:80]}")
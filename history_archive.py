@@ -0,0 +1,320 @@
+# history_archive.py
+"""
+Cold storage for conversation history.
+Closed months are moved out of memory/history.db into monthly segments under
+memory/archive/. A segment is a gzip file built from independently
+compressed blocks (each block is its own gzip member, so `zcat` still reads
+the whole file), and a small sidecar index records each block's offset,
+length and id/timestamp range. Archived rows stay in history_store's FTS5
+index, so a search finds their ids there; range reads, tail reads and search
+hits only decompress the blocks whose ranges they need. The current month
+stays hot in SQLite.
+"""
+
+import gzip
+import json
+import os
+import re
+import threading
+import time
+
+import history_store
+
+ARCHIVE_DIR = os.path.join(history_store.MEMORY_DIR, "archive")
+
+# Uncompressed bytes per block: smaller blocks mean finer seeks, larger ones compress better
+BLOCK_BYTES = 64 * 1024
+COMPRESS_LEVEL = 9
+
+# Months kept hot in SQLite (1 = the current month only)
+HOT_MONTHS = 1
+
+SEGMENT_RE = re.compile(r"^history-(\d{4}-\d{2})\.idx\.json$")
+
+
+def month_of(timestamp):
+    return f"{timestamp[:4]}-{timestamp[4:6]}"
+
+
+def month_start(months_back=0):
+    """Timestamp at the start of the month `months_back` months before this one"""
+    now = time.localtime()
+    year, month = now.tm_year, now.tm_mon - months_back
+    while month < 1:
+        year, month = year - 1, month + 12
+    return f"{year:04d}{month:02d}01-000000"
+
+
+def _matches(entry, terms):
+    """Every query term present; the last one may be a prefix (as history_store.fts_filter)"""
+    if not terms:
+        return True
+    words = set(history_store.TOKEN_RE.findall(entry["text"].lower()))
+    *whole, last = terms
+    return all(t in words for t in whole) and any(w.startswith(last) for w in words)
+
+
+def _position(entry):
+    """Sort key of page order: timestamp, then id"""
+    return entry["timestamp"], entry["id"]
+
+
+class HistoryArchive:
+    """Monthly compressed segments with block indexes"""
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self._indexes = None
+
+    # ---- Index ----
+    def _segment_paths(self, month):
+        base = os.path.join(self.directory, f"history-{month}")
+        return base + ".jsonl.gz", base + ".idx.json"
+
+    def segments(self):
+        """Segment indexes, oldest month first"""
+        with self.lock:
+            if self._indexes is None:
+                indexes = []
+                if os.path.isdir(self.directory):
+                    for name in sorted(os.listdir(self.directory)):
+                        if SEGMENT_RE.match(name):
+                            with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                                indexes.append(json.load(f))
+                self._indexes = indexes
+            return list(self._indexes)
+
+    def _save_index(self, index):
+        _, idx_path = self._segment_paths(index["month"])
+        tmp = idx_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, idx_path)
+        with self.lock:
+            self._indexes = None
+
+    # ---- Reading ----
+    def _read_block(self, index, block):
+        data_path, _ = self._segment_paths(index["month"])
+        with open(data_path, "rb") as f:
+            f.seek(block["offset"])
+            raw = gzip.decompress(f.read(block["length"]))
+        return [json.loads(line) for line in raw.decode("utf-8").splitlines() if line]
+
+    def _blocks(self, since=None, until=None, newest_first=False):
+        """(index, block) pairs overlapping the timestamp range"""
+        pairs = []
+        for index in self.segments():
+            if since and index["last_ts"] < since or until and index["first_ts"] > until:
+                continue
+            for block in index["blocks"]:
+                if since and block["last_ts"] < since or until and block["first_ts"] > until:
+                    continue
+                pairs.append((index, block))
+        if newest_first:
+            pairs.sort(key=lambda pair: (pair[1]["last_ts"], pair[1]["last_id"]), reverse=True)
+        return pairs
+
+    def range(self, since=None, until=None):
+        """Archived entries with since <= timestamp <= until, oldest month first"""
+        since = history_store.normalize_timestamp(since)
+        until = history_store.normalize_timestamp(until, end_of_day=True)
+        for index, block in self._blocks(since, until):
+            for entry in self._read_block(index, block):
+                if (not since or entry["timestamp"] >= since) and (not until or entry["timestamp"] <= until):
+                    yield entry
+
+    def before(self, cursor=None, limit=50, since=None, until=None, query=None):
+        """Up to `limit` archived entries ordered before cursor, a (timestamp, id) pair; newest first"""
+        since = history_store.normalize_timestamp(since)
+        until = history_store.normalize_timestamp(until, end_of_day=True)
+        terms = list(dict.fromkeys(history_store.TOKEN_RE.findall(query.lower()))) if query else []
+        found = []
+        for index, block in self._blocks(since, until, newest_first=True):
+            # Every entry in a block sorts between (first_ts, first_id) and (last_ts, last_id)
+            if cursor and (block["first_ts"], block["first_id"]) >= cursor:
+                continue
+            # Blocks may overlap when late rows were archived: stop only once the
+            # collected entries are all newer than everything left
+            if len(found) >= limit and (block["last_ts"], block["last_id"]) < _position(found[limit - 1]):
+                break
+            for entry in self._read_block(index, block):
+                if cursor and _position(entry) >= cursor:
+                    continue
+                if since and entry["timestamp"] < since or until and entry["timestamp"] > until:
+                    continue
+                if _matches(entry, terms):
+                    found.append(entry)
+            found.sort(key=_position, reverse=True)
+        return found[:limit]
+
+    def after(self, after_id, limit=1000):
+        """Up to `limit` archived entries with id > after_id, oldest first"""
+        pairs = sorted(
+            ((index, block) for index, block in self._blocks() if block["last_id"] > after_id),
+            key=lambda pair: pair[1]["first_id"],
+        )
+        found = []
+        for index, block in pairs:
+            if len(found) >= limit and block["first_id"] > found[limit - 1]["id"]:
+                break
+            found.extend(e for e in self._read_block(index, block) if e["id"] > after_id)
+            found.sort(key=lambda e: e["id"])
+        return found[:limit]
+
+    def tail(self, limit=50):
+        return self.before(None, limit)
+
+    def entries_by_ids(self, ids):
+        wanted = set(ids)
+        found = []
+        for index, block in self._blocks():
+            if any(block["first_id"] <= i <= block["last_id"] for i in wanted):
+                found.extend(e for e in self._read_block(index, block) if e["id"] in wanted)
+        return found
+
+    def disk_usage(self):
+        total = 0
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                total += os.path.getsize(os.path.join(self.directory, name))
+        return total
+
+    # ---- Writing ----
+    def write_segment(self, month, entries):
+        """Append entries (id-ordered dicts) to a month's segment as new blocks"""
+        if not entries:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, idx_path = self._segment_paths(month)
+        index = {"month": month, "count": 0, "blocks": [], "hashed": True, "indexed": True}
+        if os.path.exists(idx_path):
+            with open(idx_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        end = sum(block["length"] for block in index["blocks"])
+
+        blocks = []
+        with open(data_path, "ab") as f:
+            f.truncate(end)  # Drop bytes from an append that never made it into the index
+            f.seek(end)
+            lines, size = [], 0
+            for i, entry in enumerate(entries):
+                line = json.dumps(entry, ensure_ascii=False) + "\n"
+                lines.append((entry, line))
+                size += len(line)
+                if size >= BLOCK_BYTES or i == len(entries) - 1:
+                    raw = "".join(l for _, l in lines).encode("utf-8")
+                    member = gzip.compress(raw, compresslevel=COMPRESS_LEVEL, mtime=0)
+                    f.write(member)
+                    block_entries = [e for e, _ in lines]
+                    blocks.append({
+                        "offset": end,
+                        "length": len(member),
+                        "count": len(block_entries),
+                        "first_id": block_entries[0]["id"],
+                        "last_id": block_entries[-1]["id"],
+                        "first_ts": min(e["timestamp"] for e in block_entries),
+                        "last_ts": max(e["timestamp"] for e in block_entries),
+                    })
+                    end += len(member)
+                    lines, size = [], 0
+            f.flush()
+            os.fsync(f.fileno())
+
+        index["blocks"].extend(blocks)
+        index["count"] += len(entries)
+        index["first_ts"] = min(b["first_ts"] for b in index["blocks"])
+        index["last_ts"] = max(b["last_ts"] for b in index["blocks"])
+        index["first_id"] = min(b["first_id"] for b in index["blocks"])
+        index["last_id"] = max(b["last_id"] for b in index["blocks"])
+        self._save_index(index)
+
+    def hash_segments(self, store):
+        """
+        Record content hashes for segments archived before rows were hashed on
+        the way out, so merges and syncs still see those entries (once per segment)
+        """
+        for index in self.segments():
+            if index.get("hashed"):
+                continue
+            store.hash_entries(e for block in index["blocks"] for e in self._read_block(index, block))
+            index["hashed"] = True
+            self._save_index(index)
+
+    def index_segments(self, store):
+        """
+        Put segments archived while the search index still dropped archived rows
+        back into it (once per segment)
+        """
+        for index in self.segments():
+            if index.get("indexed"):
+                continue
+            added = store.index_entries(e for block in index["blocks"] for e in self._read_block(index, block))
+            print(f"🔎 Indexed {added} archived entries from {index['month']} for search")
+            index["indexed"] = True
+            self._save_index(index)
+
+    def archive_closed(self, store=None, hot_months=HOT_MONTHS, vacuum=True):
+        """Move dated rows older than the hot window out of SQLite; returns rows moved"""
+        store = store or history_store.get_store()
+        # Hash every row before it leaves: merge and sync dedupe against history_hashes only
+        store.backfill_hashes()
+        self.hash_segments(store)
+        self.index_segments(store)
+        cutoff = month_start(hot_months - 1)
+        conn = store.conn()
+        # The newest row always stays hot: SQLite would otherwise hand out its id again
+        newest = store.last_id()
+        months = [r[0] for r in conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 6) FROM history WHERE timestamp != '' AND timestamp < ? AND id < ?",
+            (cutoff, newest),
+        )]
+        if not months:
+            return 0
+
+        before = store.disk_usage() + self.disk_usage()
+        moved = 0
+        for yyyymm in months:
+            rows = conn.execute(
+                f"SELECT {history_store.COLUMNS} FROM history "
+                f"WHERE timestamp >= ? AND timestamp < ? AND id < ? ORDER BY id",
+                (f"{yyyymm}01-000000", f"{yyyymm}99", newest),
+            ).fetchall()
+            entries = [history_store.row_to_entry(r) for r in rows]
+            # Segment first, then delete: a crash in between leaves the rows hot, never lost
+            self.write_segment(month_of(yyyymm), entries)
+            store.delete_ids([e["id"] for e in entries])
+            moved += len(entries)
+            print(f"🧊 Archived {len(entries)} entries from {month_of(yyyymm)}")
+
+        if vacuum:
+            store.vacuum()
+        after = store.disk_usage() + self.disk_usage()
+        print(f"🧊 History on disk: {before / 1024:.0f} KB → {after / 1024:.0f} KB")
+        return moved
+
+
+_archive = HistoryArchive()
+
+
+def get_archive():
+    return _archive
+
+
+if __name__ == "__main__":
+    import sys
+
+    archive = get_archive()
+    if len(sys.argv) > 1 and sys.argv[1] == "archive":
+        archive.archive_closed()
+    elif len(sys.argv) > 1 and sys.argv[1] == "tail":
+        for entry in reversed(archive.tail(int(sys.argv[2]) if len(sys.argv) > 2 else 10)):
+            print(f"[{entry['timestamp']}] {entry['role']}: {entry['text'][:80]}")
+    else:
+        query = " ".join(sys.argv[1:]) or "location"
+        start = time.perf_counter()
+        hits = history_store.get_store().search(query)  # One index covers both tiers
+        print(f"🔍 '{query}': {len(hits)} hits in {(time.perf_counter() - start) * 1000:.2f} ms")
+        for score, entry in hits:
+            print(f"   {score:.2f} [{entry['timestamp']}] {entry['role']}: {entry['text'][:80]}")
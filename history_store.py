@@ -0,0 +1,755 @@
+# history_store.py
+"""
+Conversation history in an embedded SQLite database (memory/history.db).
+Runs in WAL mode so the UI can read while the conversation thread writes,
+with indexes on timestamp, role and session and one FTS5 index for
+full-text search, ranked by its bm25(). Replaces the append-only
+memory/history.jsonl: its files are migrated once on first use, and the
+inverted index kept beside them (memory/history_index.json) is deleted, as
+FTS5 now does that job. Closed months are moved to compressed segments by
+history_archive; their rows stay in the FTS5 index, and pages and search
+hits are read back in transparently.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEMORY_DIR = os.path.join(BASE_DIR, "memory")
+DB_FILE = os.path.join(MEMORY_DIR, "history.db")
+
+# JSONL files imported by the one-shot migration
+LEGACY_PATTERNS = ["history.jsonl", "history-*.jsonl"]
+# The inverted index that searched history.jsonl before this store existed
+LEGACY_INDEX = os.path.join(MEMORY_DIR, "history_index.json")
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "for",
+    "from", "have", "how", "i", "if", "in", "is", "it", "its", "me", "my", "of",
+    "on", "or", "so", "that", "the", "this", "to", "was", "what", "with", "you",
+    "your", "i'm", "it's", "sir",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id        INTEGER PRIMARY KEY,
+    role      TEXT NOT NULL,
+    text      TEXT NOT NULL,
+    timestamp TEXT NOT NULL DEFAULT '',
+    session   TEXT,
+    source    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_role ON history(role);
+CREATE INDEX IF NOT EXISTS idx_history_session ON history(session);
+
+-- Contentless: the text lives in history or, once archived, in history_archive
+-- segments. Rows leave history only to be archived, so deletes keep them indexed
+-- and one bm25() ranks both tiers.
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(text, content='');
+CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS history_au AFTER UPDATE OF text ON history BEGIN
+    INSERT INTO history_fts(history_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO history_fts(rowid, text) VALUES (new.id, new.text);
+END;
+
+CREATE TABLE IF NOT EXISTS session_digests (
+    session TEXT PRIMARY KEY,
+    started TEXT NOT NULL DEFAULT '',
+    ended   TEXT NOT NULL DEFAULT '',
+    digest  TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS digest_fts USING fts5(
+    digest, content='session_digests', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS digest_ai AFTER INSERT ON session_digests BEGIN
+    INSERT INTO digest_fts(rowid, digest) VALUES (new.rowid, new.digest);
+END;
+CREATE TRIGGER IF NOT EXISTS digest_ad AFTER DELETE ON session_digests BEGIN
+    INSERT INTO digest_fts(digest_fts, rowid, digest) VALUES ('delete', old.rowid, old.digest);
+END;
+CREATE TRIGGER IF NOT EXISTS digest_au AFTER UPDATE OF digest ON session_digests BEGIN
+    INSERT INTO digest_fts(digest_fts, rowid, digest) VALUES ('delete', old.rowid, old.digest);
+    INSERT INTO digest_fts(rowid, digest) VALUES (new.rowid, new.digest);
+END;
+
+CREATE TABLE IF NOT EXISTS migrations (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    rows INTEGER NOT NULL
+);
+
+-- On-disk hash set of entry contents, so merges never insert the same entry twice
+CREATE TABLE IF NOT EXISTS history_hashes (
+    hash TEXT PRIMARY KEY,
+    id   INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_history_hashes_id ON history_hashes(id);
+
+CREATE TABLE IF NOT EXISTS merge_sources (
+    path        TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    rows        INTEGER NOT NULL
+);
+
+-- Usage and recency of memory.json facts (see fact_store.py)
+CREATE TABLE IF NOT EXISTS fact_stats (
+    fact      TEXT PRIMARY KEY,
+    added     REAL NOT NULL,
+    uses      INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS imports (
+    source      TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    position    INTEGER NOT NULL DEFAULT 0,
+    entries     INTEGER NOT NULL DEFAULT 0,
+    done        INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+COLUMNS = "id, role, text, timestamp, session"
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords"""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 OR-query of quoted terms (no syntax errors on user input)"""
+    terms = dict.fromkeys(tokenize(text))
+    return " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def fts_filter(text):
+    """FTS5 query requiring every term, with prefix matching on the last one (search-as-you-type)"""
+    terms = list(dict.fromkeys(TOKEN_RE.findall(text.lower())))
+    if not terms:
+        return ""
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+EPOCH_RE = re.compile(r"^\d{9,13}(\.\d+)?$")
+
+
+def normalize_timestamp(value, end_of_day=False):
+    """
+    Accept 2025-11-26, 2025-11-26T14:06:28, 20251126-140628 or Unix epoch
+    seconds/milliseconds and return the stored YYYYmmdd-HHMMSS form (None if
+    it can't be parsed).
+    """
+    if not value:
+        return None
+    if isinstance(value, (int, float)) or EPOCH_RE.match(str(value)):
+        seconds = float(value)
+        if seconds > 1e11:
+            seconds /= 1000.0
+        try:
+            return time.strftime("%Y%m%d-%H%M%S", time.localtime(seconds))
+        except (OverflowError, OSError, ValueError):
+            return None
+    digits = re.sub(r"\D", "", str(value))
+    if len(digits) < 8:
+        return None
+    date, clock = digits[:8], digits[8:14]
+    if not clock:
+        clock = "235959" if end_of_day else "000000"
+    return f"{date}-{clock.ljust(6, '0')}"
+
+
+def parse_cursor(cursor):
+    """(timestamp, id) from a page() cursor, None if it isn't one"""
+    timestamp, sep, row_id = str(cursor or "").rpartition(":")
+    if not sep or not row_id.isdigit():
+        return None
+    return timestamp, int(row_id)
+
+
+def content_hash(role, text, timestamp="", sequence=None):
+    """
+    Identity of an entry across machines and exports: role, normalized
+    timestamp and whitespace-collapsed text. Entries without a timestamp
+    only match on role and text unless a sequence (where the entry sits in
+    its source, e.g. "history.html#12") tells repeated messages apart.
+    """
+    parts = [
+        (role or "unknown").strip().lower(),
+        normalize_timestamp(timestamp) or "",
+        " ".join((text or "").split()),
+    ]
+    if sequence is not None and not parts[1]:
+        parts.append(str(sequence))
+    key = "\x1f".join(parts)
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def row_to_entry(row):
+    entry = {"id": row[0], "role": row[1], "text": row[2], "timestamp": row[3]}
+    if row[4]:
+        entry["session"] = row[4]
+    return entry
+
+
+class HistoryStore:
+    """Thread-safe wrapper around the history database"""
+
+    def __init__(self, db_file=DB_FILE, archive=None):
+        self.db_file = db_file
+        self.archive = archive  # history_archive.HistoryArchive for closed months, if any
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        conn = self.conn()
+        self._migrate_fts(conn)
+        conn.executescript(SCHEMA)
+
+    def _migrate_fts(self, conn):
+        """
+        Replace the external-content history_fts (which dropped rows as they were
+        archived) with the contentless one, reindexing the hot rows; archived
+        segments are indexed again by history_archive.index_segments
+        """
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'history_fts'").fetchone()
+        if not row or "content='history'" not in row[0]:
+            return
+        # One transaction: a crash part-way must not leave an empty index behind
+        conn.executescript(
+            "BEGIN;"
+            "DROP TRIGGER IF EXISTS history_ai;"
+            "DROP TRIGGER IF EXISTS history_ad;"
+            "DROP TRIGGER IF EXISTS history_au;"
+            "DROP TABLE history_fts;"
+            + SCHEMA +
+            "INSERT INTO history_fts(rowid, text) SELECT id, text FROM history;"
+            "COMMIT;"
+        )
+        print("🔄 Rebuilt the history search index to cover archived months")
+
+    def conn(self):
+        """One connection per thread; SQLite connections are not shareable"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    # ---- Writing ----
+    def append(self, role, text, timestamp="", session=None, source=None):
+        """Insert one entry and return its id"""
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO history(role, text, timestamp, session, source) VALUES (?, ?, ?, ?, ?)",
+                    (role, text, timestamp or "", session, source),
+                )
+            return cur.lastrowid
+
+    def append_many(self, entries, source=None, progress=None, dedupe=False):
+        """
+        Insert dicts with role/text/timestamp[/session/source] in one transaction
+        and return how many were inserted.
+        progress=(import_source, fingerprint, position) records how far an
+        import got in the same transaction, so a resumed import never
+        re-inserts a committed batch. dedupe=True skips entries whose content
+        hash (see content_hash, or an entry's precomputed "hash") is already stored.
+        """
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                if dedupe:
+                    self._backfill_hashes(conn)
+                inserted = 0
+                for e in entries:
+                    role, text, timestamp = e.get("role", "unknown"), e.get("text", ""), e.get("timestamp") or ""
+                    digest = None
+                    if dedupe:
+                        digest = e.get("hash") or content_hash(role, text, timestamp)
+                        if conn.execute("SELECT 1 FROM history_hashes WHERE hash = ?", (digest,)).fetchone():
+                            continue
+                    cur = conn.execute(
+                        "INSERT INTO history(role, text, timestamp, session, source) VALUES (?, ?, ?, ?, ?)",
+                        (role, text, timestamp, e.get("session"), e.get("source", source)),
+                    )
+                    if digest:
+                        conn.execute("INSERT INTO history_hashes(hash, id) VALUES (?, ?)", (digest, cur.lastrowid))
+                    inserted += 1
+                if progress:
+                    name, fingerprint, position = progress
+                    conn.execute(
+                        "INSERT INTO imports(source, fingerprint, position, entries) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(source) DO UPDATE SET fingerprint = excluded.fingerprint, "
+                        "position = excluded.position, entries = imports.entries + excluded.entries",
+                        (name, fingerprint, position, inserted),
+                    )
+        return inserted
+
+    def _backfill_hashes(self, conn):
+        """Hash rows added without dedupe (live turns, legacy migration) since the last backfill"""
+        hashed = conn.execute("SELECT COALESCE(MAX(id), 0) FROM history_hashes").fetchone()[0]
+        rows = conn.execute(
+            "SELECT id, role, text, timestamp FROM history WHERE id > ? ORDER BY id", (hashed,)
+        ).fetchall()
+        conn.executemany(
+            "INSERT OR IGNORE INTO history_hashes(hash, id) VALUES (?, ?)",
+            ((content_hash(role, text, timestamp), row_id) for row_id, role, text, timestamp in rows),
+        )
+        return len(rows)
+
+    def backfill_hashes(self):
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                return self._backfill_hashes(conn)
+
+    def hash_entries(self, entries):
+        """Record content hashes for entries stored outside this table (archived rows)"""
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO history_hashes(hash, id) VALUES (?, ?)",
+                    ((content_hash(e["role"], e["text"], e["timestamp"]), e["id"]) for e in entries),
+                )
+
+    def index_entries(self, entries):
+        """Add entries stored outside this table (archived rows) to the search index; returns how many"""
+        added = 0
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                for e in entries:
+                    if not conn.execute("SELECT 1 FROM history_fts WHERE rowid = ?", (e["id"],)).fetchone():
+                        conn.execute("INSERT INTO history_fts(rowid, text) VALUES (?, ?)", (e["id"], e["text"]))
+                        added += 1
+        return added
+
+    def content_hashes(self):
+        """Every content hash in the store (see backfill_hashes for rows added without one)"""
+        return [r[0] for r in self.conn().execute("SELECT hash FROM history_hashes")]
+
+    def entries_for_hashes(self, hashes):
+        """Entries (with their "hash") for the given content hashes"""
+        entries = []
+        hashes = list(hashes)
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            rows = self.conn().execute(
+                f"SELECT h.id, h.role, h.text, h.timestamp, h.session, x.hash FROM history_hashes x "
+                f"JOIN history h ON h.id = x.id WHERE x.hash IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            for row in rows:
+                entry = row_to_entry(row)
+                entry["hash"] = row[5]
+                entries.append(entry)
+            if len(rows) < len(chunk) and self.archive:
+                # Hashes of archived rows still point at their ids
+                found = {r[5] for r in rows}
+                missing = dict(self.conn().execute(
+                    f"SELECT id, hash FROM history_hashes WHERE hash IN ({', '.join('?' * len(chunk))})", chunk
+                ).fetchall())
+                for entry in self.archive.entries_by_ids(missing):
+                    if missing[entry["id"]] not in found:
+                        entries.append(dict(entry, hash=missing[entry["id"]]))
+        return entries
+
+    # ---- Fact stats ----
+    def fact_stats(self):
+        """fact -> (added, uses, last_used)"""
+        return {r[0]: (r[1], r[2], r[3]) for r in self.conn().execute("SELECT fact, added, uses, last_used FROM fact_stats")}
+
+    def record_facts(self, facts, added):
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO fact_stats(fact, added) VALUES (?, ?)", ((f, added) for f in facts)
+                )
+
+    def touch_facts(self, facts, used_at):
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.executemany(
+                    "UPDATE fact_stats SET uses = uses + 1, last_used = ? WHERE fact = ?",
+                    ((used_at, f) for f in facts),
+                )
+
+    def rename_fact(self, old, new, when):
+        """Carry a fact's stats over to its reworded version"""
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.execute(
+                    "INSERT INTO fact_stats(fact, added, uses, last_used) "
+                    "SELECT ?, added, uses + 1, ? FROM fact_stats WHERE fact = ? "
+                    "ON CONFLICT(fact) DO UPDATE SET uses = fact_stats.uses + excluded.uses, last_used = excluded.last_used",
+                    (new, when, old),
+                )
+                conn.execute("DELETE FROM fact_stats WHERE fact = ?", (old,))
+
+    # ---- Merge bookkeeping ----
+    def merge_source(self, path):
+        """(fingerprint, rows) recorded by the last merge of a source, or None"""
+        return self.conn().execute(
+            "SELECT fingerprint, rows FROM merge_sources WHERE path = ?", (path,)
+        ).fetchone()
+
+    def record_merge_source(self, path, fingerprint, rows):
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.execute(
+                    "INSERT INTO merge_sources(path, fingerprint, rows) VALUES (?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET fingerprint = excluded.fingerprint, rows = excluded.rows",
+                    (path, fingerprint, rows),
+                )
+
+    # ---- Import progress ----
+    def import_progress(self, source):
+        """(fingerprint, position, entries, done) of an earlier import, or None"""
+        return self.conn().execute(
+            "SELECT fingerprint, position, entries, done FROM imports WHERE source = ?", (source,)
+        ).fetchone()
+
+    def finish_import(self, source, fingerprint):
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.execute(
+                    "INSERT INTO imports(source, fingerprint, done) VALUES (?, ?, 1) "
+                    "ON CONFLICT(source) DO UPDATE SET fingerprint = excluded.fingerprint, done = 1",
+                    (source, fingerprint),
+                )
+
+    def reset_import(self, source):
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.execute("DELETE FROM imports WHERE source = ?", (source,))
+
+    def delete_ids(self, ids):
+        """Remove rows that moved to the archive (they stay in the search index)"""
+        ids = list(ids)
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    conn.execute(f"DELETE FROM history WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+
+    def vacuum(self):
+        """Give freed pages back to the filesystem"""
+        with self.write_lock:
+            conn = self.conn()
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def disk_usage(self):
+        """Bytes used by the database, including its write-ahead log"""
+        return sum(
+            os.path.getsize(path) for path in (self.db_file, self.db_file + "-wal")
+            if os.path.exists(path)
+        )
+
+    # ---- Reading ----
+    def count(self):
+        return self.conn().execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def last_id(self):
+        return self.conn().execute("SELECT COALESCE(MAX(id), 0) FROM history").fetchone()[0]
+
+    def entries(self, limit=None):
+        """All entries (or the newest `limit`), oldest first"""
+        if limit is None:
+            rows = self.conn().execute(f"SELECT {COLUMNS} FROM history ORDER BY id").fetchall()
+        else:
+            rows = self.conn().execute(
+                f"SELECT {COLUMNS} FROM history ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()[::-1]
+        return [row_to_entry(r) for r in rows]
+
+    def entries_after(self, after_id, limit=1000):
+        """Entries with id > after_id, oldest first"""
+        rows = self.conn().execute(
+            f"SELECT {COLUMNS} FROM history WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+        entries = [row_to_entry(r) for r in rows]
+        if self.archive:
+            # Only blocks with ids past after_id are read, so recent cursors cost nothing here
+            archived = self.archive.after(after_id, limit)
+            if archived:
+                entries = sorted(entries + archived, key=lambda e: e["id"])[:limit]
+        return entries
+
+    def session_entries(self, session):
+        rows = self.conn().execute(
+            f"SELECT {COLUMNS} FROM history WHERE session = ? ORDER BY id", (session,)
+        ).fetchall()
+        return [row_to_entry(r) for r in rows]
+
+    def page(self, cursor=None, limit=50, since=None, until=None, query=None):
+        """
+        One page of history, newest first by timestamp (then id, so merged
+        imports land at their own time rather than on top).
+        cursor is the next_cursor of the previous page ("timestamp:id" of the
+        last entry already seen, exclusive); since/until bound the timestamp;
+        query keeps entries containing every word.
+        Returns (entries, next_cursor) with next_cursor None on the last page.
+        """
+        where, params = [], []
+        position = parse_cursor(cursor)
+        if position:
+            where.append("(h.timestamp < ? OR h.timestamp = ? AND h.id < ?)")
+            params.extend([position[0], position[0], position[1]])
+        since = normalize_timestamp(since)
+        until = normalize_timestamp(until, end_of_day=True)
+        if since:
+            where.append("h.timestamp >= ?")
+            params.append(since)
+        if until:
+            where.append("h.timestamp <= ? AND h.timestamp != ''")
+            params.append(until)
+
+        source = "history h"
+        if query:
+            match = fts_filter(query)
+            if match:
+                source = "history_fts JOIN history h ON h.id = history_fts.rowid"
+                where.append("history_fts MATCH ?")
+                params.append(match)
+            else:
+                where.append("h.text LIKE ? ESCAPE '\\'")
+                params.append("%" + re.sub(r"([%_\\])", r"\\\1", query) + "%")
+
+        sql = f"SELECT h.id, h.role, h.text, h.timestamp, h.session FROM {source}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY h.timestamp DESC, h.id DESC LIMIT ?"
+        params.append(limit + 1)  # One extra row tells us whether there is another page
+
+        entries = [row_to_entry(r) for r in self.conn().execute(sql, params).fetchall()]
+        if self.archive and self.archive.segments():
+            # Closed months live in the archive; rows merged since the last archive pass are still hot,
+            # so the two tiers interleave by timestamp
+            entries += self.archive.before(position, limit + 1, since, until, query)
+            entries.sort(key=lambda e: (e["timestamp"], e["id"]), reverse=True)
+        next_cursor = None
+        if len(entries) > limit:
+            last = entries[limit - 1]
+            next_cursor = f"{last['timestamp']}:{last['id']}"
+        return entries[:limit], next_cursor
+
+    def search(self, query, limit=5, role=None):
+        """
+        Full-text search ranked by FTS5 bm25(), skipping repeated texts.
+        Archived rows stay in the index, so both tiers rank together; archived
+        hits are read back from just the blocks that hold them.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        sql = (
+            "SELECT history_fts.rowid, h.role, h.text, h.timestamp, h.session, bm25(history_fts) AS score "
+            "FROM history_fts LEFT JOIN history h ON h.id = history_fts.rowid "
+            "WHERE history_fts MATCH ?"
+        )
+        params = [match]
+        if role:
+            sql += " AND (h.id IS NULL OR h.role = ?)"  # Archived roles are checked once read
+            params.append(role)
+        sql += " ORDER BY score LIMIT ? OFFSET ?"
+        batch = limit * 3  # Over-fetch so duplicates can be dropped
+
+        results = []
+        seen = set()
+        offset = 0
+        while len(results) < limit:
+            rows = self.conn().execute(sql, params + [batch, offset]).fetchall()
+            archived = [r[0] for r in rows if r[2] is None]
+            if archived and self.archive:
+                found = {e["id"]: e for e in self.archive.entries_by_ids(archived)}
+            else:
+                found = {}
+            for row in rows:
+                entry = row_to_entry(row) if row[2] is not None else found.get(row[0])
+                if entry is None or role and entry["role"] != role:
+                    continue
+                key = entry["text"].strip().lower()
+                if key in seen:
+                    continue
+                seen.add(key)
+                results.append((-row[5], entry))  # bm25() is lower-is-better
+                if len(results) >= limit:
+                    break
+            if len(rows) < batch:
+                break
+            offset += batch
+        return results
+
+    # ---- Session digests ----
+    def save_digest(self, session, digest, started="", ended=""):
+        """Store (or replace) the compact digest of one conversation session"""
+        with self.write_lock:
+            conn = self.conn()
+            with conn:
+                conn.execute(
+                    "INSERT INTO session_digests(session, started, ended, digest) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session) DO UPDATE SET ended = excluded.ended, digest = excluded.digest",
+                    (session, started or "", ended or "", digest),
+                )
+
+    def search_digests(self, query, limit=2):
+        """Session digests matching the query, best first"""
+        match = fts_query(query)
+        if not match:
+            return []
+        rows = self.conn().execute(
+            "SELECT d.session, d.started, d.ended, d.digest FROM digest_fts "
+            "JOIN session_digests d ON d.rowid = digest_fts.rowid "
+            "WHERE digest_fts MATCH ? ORDER BY bm25(digest_fts) LIMIT ?",
+            (match, limit),
+        ).fetchall()
+        return [{"session": r[0], "started": r[1], "ended": r[2], "digest": r[3]} for r in rows]
+
+    # ---- Migration ----
+    def migrate_jsonl(self, paths=None):
+        """
+        One-shot import of the legacy JSONL history files.
+        Each file is recorded in the migrations table and skipped afterwards;
+        entries already present (same role, timestamp and text) are not duplicated,
+        since history-<machine>.jsonl files are copies of history.jsonl.
+        """
+        if paths is None:
+            paths = []
+            for pattern in LEGACY_PATTERNS:
+                paths.extend(sorted(glob.glob(os.path.join(MEMORY_DIR, pattern))))
+
+        total = 0
+        conn = self.conn()
+        for path in paths:
+            name = os.path.basename(path)
+            if conn.execute("SELECT 1 FROM migrations WHERE path = ?", (name,)).fetchone():
+                continue
+
+            rows = []
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    rows.append((entry.get("role", "unknown"), entry.get("text", ""), entry.get("timestamp") or "", name))
+
+            with self.write_lock, conn:
+                added = 0
+                for role, text, timestamp, source in rows:
+                    exists = conn.execute(
+                        "SELECT 1 FROM history WHERE timestamp = ? AND role = ? AND text = ? LIMIT 1",
+                        (timestamp, role, text),
+                    ).fetchone()
+                    if exists:
+                        continue
+                    conn.execute(
+                        "INSERT INTO history(role, text, timestamp, source) VALUES (?, ?, ?, ?)",
+                        (role, text, timestamp, source),
+                    )
+                    added += 1
+                conn.execute(
+                    "INSERT INTO migrations(path, size, rows) VALUES (?, ?, ?)",
+                    (name, os.path.getsize(path), added),
+                )
+                self._backfill_hashes(conn)  # Before archive_closed can move them out of reach
+            print(f"📦 Migrated {added} of {len(rows)} entries from {name}")
+            total += added
+        return total
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Shared store for memory/history.db, migrating legacy JSONL on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            import history_archive  # Imports this module; loaded lazily to avoid the cycle
+            archive = history_archive.get_archive()
+            _store = HistoryStore(archive=archive)
+            try:
+                _store.migrate_jsonl()
+                if os.path.exists(LEGACY_INDEX):
+                    os.remove(LEGACY_INDEX)
+                    print("🧹 Removed the old history_index.json (search uses FTS5 now)")
+            except Exception as e:
+                print(f"❌ Error migrating history: {e}")
+            try:
+                archive.archive_closed(_store)
+            except Exception as e:
+                print(f"❌ Error archiving history: {e}")
+        return _store
+
+
+def use_scratch_copy(db_file):
+    """
+    Make the shared store a copy of history.db at db_file, with a copy of the
+    archive beside it (load tests: real pages to read, but neither writes nor
+    archive rotation ever reach the real history)
+    """
+    global _store
+    import history_archive
+    source = sqlite3.connect(DB_FILE) if os.path.exists(DB_FILE) else None
+    target = sqlite3.connect(db_file)
+    if source is not None:
+        source.backup(target)
+        source.close()
+    target.close()
+    archive_dir = os.path.join(os.path.dirname(db_file), "archive")
+    if os.path.isdir(history_archive.ARCHIVE_DIR):
+        shutil.copytree(history_archive.ARCHIVE_DIR, archive_dir, dirs_exist_ok=True)
+    with _store_lock:
+        _store = HistoryStore(db_file, archive=history_archive.HistoryArchive(archive_dir))
+    return _store
+
+
+def append(role, text, timestamp="", session=None):
+    return get_store().append(role, text, timestamp, session)
+
+
+def search(query, limit=5):
+    return get_store().search(query, limit)
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = get_store()
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        print(f"📦 Migrated {store.migrate_jsonl(sys.argv[2:] or None)} entries")
+    query = " ".join(a for a in sys.argv[1:] if a != "migrate") or "location"
+    start = time.perf_counter()
+    hits = store.search(query)
+    print(f"🔍 '{query}': {len(hits)} of {store.count()} entries in {(time.perf_counter() - start) * 1000:.2f} ms")
+    for score, entry in hits:
+        print(f"   {score:.2f} [{entry['timestamp']}] {entry['role']}: {entry['text'][:80]}")
@@ -1,96 +1,349 @@
 import os
 import json
-from bs4 import BeautifulSoup
+import re
 import sys
+import time
+import zlib
+from html.parser import HTMLParser
+import history_store
 
 # Configuration
 IMPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import")
-OUTPUT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory", "history.jsonl")
 INPUT_FILE = os.path.join(IMPORT_DIR, "history.html")
+JSON_FILE = os.path.join(IMPORT_DIR, "conversations.json")
 
-def parse_history():
-    if not os.path.exists(INPUT_FILE):
-        print(f"File not found: {INPUT_FILE}")
-        print("Please place 'history.html' in the 'import' folder.")
+# Streaming settings - memory stays around CHUNK_SIZE plus one batch / one conversation
+CHUNK_SIZE = 1 << 20      # Bytes read per step
+BATCH_SIZE = 500          # Entries per database transaction
+REPORT_EVERY = 2.0        # Seconds between throughput lines
+
+USER_MARKERS = {"user", "you"}
+ASSISTANT_MARKERS = {"chatgpt", "assistant", "model", "ai"}
+
+
+def fingerprint(path):
+    """Cheap identity of an export file: size plus a CRC of its first chunk"""
+    with open(path, "rb") as f:
+        head = f.read(65536)
+    return f"{os.path.getsize(path)}:{zlib.crc32(head):08x}"
+
+
+def undated_hash(entry, sequence):
+    """Content hash of an entry, told apart by its place in the export when it has no time"""
+    return history_store.content_hash(entry["role"], entry["text"], entry["timestamp"], sequence)
+
+
+def format_time(epoch):
+    try:
+        return time.strftime("%Y%m%d-%H%M%S", time.localtime(float(epoch)))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return ""
+
+
+# ---- HTML export ----
+class TextLineParser(HTMLParser):
+    """Incremental HTML parser collecting visible text lines"""
+
+    SKIP_TAGS = {"script", "style", "head", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skip = 0
+        self.text = []   # Data since the last tag; a text node can arrive over several feeds
+        self.lines = []
+
+    def handle_starttag(self, tag, attrs):
+        self.end_text()
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        self.end_text()
+        if tag in self.SKIP_TAGS and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.text.append(data)
+
+    def end_text(self):
+        if not self.text:
+            return
+        for line in "".join(self.text).split("\n"):
+            line = line.strip()
+            if line:
+                self.lines.append(line)
+        self.text = []
+
+    def close(self):
+        super().close()
+        self.end_text()
+
+
+def iter_html_entries(path, progress):
+    """
+    Yield (entries, position) from an HTML export, one entry at a time.
+    Roles are inferred from "User"/"ChatGPT" marker lines; position is the
+    number of entries produced so far. HTML exports carry no times, so each
+    entry is hashed with the file name and its ordinal: a repeated "ok" is
+    kept, while importing the same file again still adds nothing.
+    """
+    name = os.path.basename(path)
+    parser = TextLineParser()
+    current_role = "unknown"
+    buffer = []
+    count = 0
+
+    def take():
+        nonlocal buffer, count
+        entry = {"role": current_role, "text": "\n".join(buffer), "timestamp": ""}
+        buffer = []
+        count += 1
+        entry["hash"] = undated_hash(entry, f"{name}#{count}")
+        return [entry], count
+
+    def consume(lines):
+        nonlocal current_role
+        for line in lines:
+            lowered = line.lower()
+            if lowered in USER_MARKERS or lowered in ASSISTANT_MARKERS:
+                if buffer:
+                    yield take()
+                current_role = "user" if lowered in USER_MARKERS else "assistant"
+            else:
+                buffer.append(line)
+
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            progress.bytes_read = f.buffer.tell()
+            lines, parser.lines = parser.lines, []
+            yield from consume(lines)
+    parser.close()
+    yield from consume(parser.lines)
+    if buffer:
+        yield take()
+
+
+# ---- conversations.json export ----
+SCAN_RE = re.compile(rb'["\\\[\]{}]')
+
+
+def iter_json_array(path, start=0, progress=None):
+    """
+    Yield (element, end_offset) for each object in a top-level JSON array
+    without loading the file: a byte scanner tracks strings and nesting and
+    only the current element is buffered and decoded. start is an offset
+    inside the array (an earlier end_offset) to resume from.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        buf = bytearray()
+        buf_start = start             # File offset of buf[0]
+        depth = 1 if start else 0
+        in_string = False
+        skip_byte = False             # Backslash was the last byte of the previous chunk
+        element_start = None
+        i = 0
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            buf += chunk
+            if progress:
+                progress.bytes_read = buf_start + len(buf)
+            if skip_byte:
+                i += 1
+                skip_byte = False
+            while True:
+                m = SCAN_RE.search(buf, i)
+                if not m:
+                    i = len(buf)
+                    break
+                j = m.start()
+                c = buf[j]
+                i = j + 1
+                if in_string:
+                    if c == 0x5C:  # Backslash escapes the next byte
+                        if j + 1 >= len(buf):
+                            skip_byte = True
+                            break
+                        i = j + 2
+                    elif c == 0x22:
+                        in_string = False
+                elif c == 0x22:
+                    in_string = True
+                elif c in b"[{":
+                    if depth == 1 and element_start is None:
+                        element_start = j
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        return  # End of the top-level array
+                    if depth == 1 and element_start is not None:
+                        element = json.loads(bytes(buf[element_start:i]))
+                        element_start = None
+                        yield element, buf_start + i
+
+            # Keep only the unfinished element (or nothing) in memory
+            keep = element_start if element_start is not None else i
+            del buf[:keep]
+            buf_start += keep
+            i -= keep
+            if element_start is not None:
+                element_start = 0
+
+
+def message_text(message):
+    content = message.get("content") or {}
+    parts = content.get("parts") or []
+    if not parts and content.get("text"):
+        parts = [content["text"]]
+    return "\n".join(p for p in parts if isinstance(p, str)).strip()
+
+
+def conversation_entries(conversation):
+    """Turns of one exported conversation along the branch that was last shown"""
+    mapping = conversation.get("mapping") or {}
+    chain = []
+    node_id, seen = conversation.get("current_node"), set()
+    while node_id in mapping and node_id not in seen:
+        seen.add(node_id)
+        chain.append(mapping[node_id])
+        node_id = mapping[node_id].get("parent")
+    if chain:
+        chain.reverse()
+    else:
+        chain = sorted(mapping.values(), key=lambda n: (n.get("message") or {}).get("create_time") or 0)
+
+    session = "chatgpt-" + str(conversation.get("conversation_id") or conversation.get("id") or conversation.get("create_time") or "")
+    entries = []
+    for node in chain:
+        message = node.get("message") or {}
+        role = (message.get("author") or {}).get("role")
+        if role not in ("user", "assistant"):
+            continue
+        if (message.get("metadata") or {}).get("is_visually_hidden_from_conversation"):
+            continue
+        text = message_text(message)
+        if not text:
+            continue
+        entry = {
+            "role": role,
+            "text": text,
+            "timestamp": format_time(message.get("create_time") or conversation.get("create_time")),
+            "session": session,
+        }
+        if not entry["timestamp"]:
+            entry["hash"] = undated_hash(entry, f"{session}#{len(entries)}")
+        entries.append(entry)
+    return entries
+
+
+def iter_json_entries(path, start, progress):
+    """Yield (entries, position) per conversation; position is the byte offset after it"""
+    for conversation, offset in iter_json_array(path, start, progress):
+        if isinstance(conversation, dict):
+            yield conversation_entries(conversation), offset
+
+
+# ---- Import driver ----
+class Progress:
+    """Periodic throughput report"""
+
+    def __init__(self, total_bytes, start_bytes=0):
+        self.total = total_bytes or 1
+        self.start_bytes = start_bytes
+        self.bytes_read = start_bytes
+        self.entries = 0
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def maybe_report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_report < REPORT_EVERY:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        mb = (self.bytes_read - self.start_bytes) / 1e6
+        print(
+            f"⏱️ {self.bytes_read / 1e6:.1f} MB ({min(self.bytes_read / self.total, 1):.0%}) · "
+            f"{self.entries} entries · {mb / elapsed:.1f} MB/s · {self.entries / elapsed:.0f} entries/s"
+        )
+
+
+def parse_history(path=None, restart=False):
+    if path is None:
+        path = JSON_FILE if os.path.exists(JSON_FILE) else INPUT_FILE
+    if not os.path.exists(path):
+        print(f"File not found: {path}")
+        print("Please place 'conversations.json' or 'history.html' in the 'import' folder.")
         return
 
-    print(f"Reading {INPUT_FILE}...")
+    store = history_store.get_store()
+    source = os.path.abspath(path)
+    print_name = os.path.basename(path)
     try:
-        with open(INPUT_FILE, "r", encoding="utf-8") as f:
-            soup = BeautifulSoup(f, "html.parser")
+        mark = fingerprint(path)
     except Exception as e:
         print(f"Error reading file: {e}")
         return
 
-    print("Parsing HTML content...")
-    
-    # This selector depends on the export format (ChatGPT usually uses specific classes)
-    # We'll try a generic approach finding conversation containers
-    # Adjust selectors based on actual HTML structure if needed
-    
-    messages = []
-    
-    # Common structure for ChatGPT exports
-    # Usually divs with classes like "group w-full..." or specific role attributes
-    # Or just simple p tags if it's a basic export
-    
-    # Let's try to find all text elements and infer structure
-    # Or look for standard conversation markers
-    
-    # Strategy: Look for "User" and "ChatGPT" or "Assistant" headers
-    # This is a heuristic.
-    
-    # Better strategy: Just extract all text and save chunks?
-    # No, we want structure.
-    
-    # Let's try to find divs that look like messages
-    # Assuming standard ChatGPT export
-    
-    conversations = soup.find_all("div", class_="conversation-item") # Hypothetical
-    
-    if not conversations:
-        # Fallback: Extract all text and split by newlines, trying to identify speakers
-        print("Structured parsing failed. Falling back to text extraction.")
-        text = soup.get_text(separator="\n")
-        lines = text.split("\n")
-        
-        current_role = "unknown"
-        buffer = []
-        
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as out:
-            for line in lines:
-                line = line.strip()
-                if not line: continue
-                
-                # Heuristic for roles
-                if line.lower() in ["user", "you"]:
-                    if buffer:
-                        entry = {"role": current_role, "text": "\n".join(buffer), "timestamp": ""}
-                        out.write(json.dumps(entry) + "\n")
-                        buffer = []
-                    current_role = "user"
-                elif line.lower() in ["chatgpt", "assistant", "model", "ai"]:
-                    if buffer:
-                        entry = {"role": current_role, "text": "\n".join(buffer), "timestamp": ""}
-                        out.write(json.dumps(entry) + "\n")
-                        buffer = []
-                    current_role = "assistant"
-                else:
-                    buffer.append(line)
-            
-            # Save last buffer
-            if buffer:
-                entry = {"role": current_role, "text": "\n".join(buffer), "timestamp": ""}
-                out.write(json.dumps(entry) + "\n")
-                
+    if restart:
+        store.reset_import(source)
+    saved = store.import_progress(source)
+    position = 0
+    if saved and saved[0] == mark:
+        if saved[3]:
+            print(f"✅ {print_name} was already imported ({saved[2]} entries). Use --restart to import it again.")
+            return
+        position = saved[1]
+        print(f"↩️ Resuming {print_name} after {saved[2]} entries")
+    elif saved:
+        print(f"🔄 {print_name} changed since the last attempt, starting over")
+        store.reset_import(source)
+
+    is_json = path.lower().endswith(".json")
+    progress = Progress(os.path.getsize(path), position if is_json else 0)
+    print(f"Reading {path}...")
+
+    if is_json:
+        units = iter_json_entries(path, position, progress)
     else:
-        # If we had correct selectors, we'd do it here.
-        # Since I don't know the exact format of the user's file, text extraction is safer.
-        pass
+        units = iter_html_entries(path, progress)
+
+    batch = []
+    skip = 0 if is_json else position  # HTML resumes by entry count, JSON by byte offset
+    try:
+        for entries, unit_position in units:
+            if skip:
+                skip -= len(entries)
+                continue
+            batch.extend(entries)
+            if len(batch) >= BATCH_SIZE:
+                progress.entries += store.append_many(batch, source="import", progress=(source, mark, unit_position), dedupe=True)
+                batch = []
+            progress.maybe_report()
+            position = unit_position
+        if batch:
+            progress.entries += store.append_many(batch, source="import", progress=(source, mark, position), dedupe=True)
+        store.finish_import(source, mark)
+    except KeyboardInterrupt:
+        print(f"\n⏸️ Interrupted - {progress.entries} entries saved, run again to resume")
+        return
+    except Exception as e:
+        print(f"Error importing {print_name}: {e}")
+        print("Entries committed so far are kept; run again to resume.")
+        return
+
+    progress.maybe_report(force=True)
+    print(f"History imported to {history_store.DB_FILE} ({progress.entries} entries)")
 
-    print(f"History imported to {OUTPUT_FILE}")
 
 if __name__ == "__main__":
-    # Ensure memory dir exists
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    parse_history()
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    parse_history(args[0] if args else None, restart="--restart" in sys.argv)
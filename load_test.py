@@ -0,0 +1,376 @@
+# load_test.py
+"""
+Load and soak test for the WebSocket server.
+Opens --clients connections to a server started with
+`python websocket_server.py --fake-ai [reply ms]` (canned replies, no mic,
+scratch copy of the history) and has each client send text_command,
+get_status and get_history at random intervals averaging the given per-client
+rates. Every --report seconds it prints throughput, request → reply latency
+percentiles and event loop lag on both sides, plus the server's RSS (read with
+get_metrics on one extra connection), so a long run shows whether latency or
+memory creeps up.
+
+    python load_test.py [--url ws://localhost:8765] [--clients 20] [--duration 60]
+                        [--commands 0.2] [--status 1] [--history 0.1]
+                        [--history-limit 100] [--subscribe] [--encoding json]
+                        [--ramp 5] [--report 10] [--drain 10] [--seed 7]
+                        [--json results.json]
+
+Rates are messages per second per client (0 turns a type off). A
+text_command's latency runs until its jarvis_response (each client has its own
+session, so replies come back in order); commands get a unique suffix so none
+are coalesced, and one superseded by the client's next command is counted as
+cancelled. Status replies are coalesced, so one reply answers every
+get_status sent before it.
+"""
+
+import asyncio
+import collections
+import json
+import random
+import sys
+import time
+
+import websockets
+
+import wire_codec
+
+DEFAULT_URL = "ws://localhost:8765"
+
+# Request type -> the reply that answers it
+REPLIES = {'text_command': 'jarvis_response', 'get_status': 'status', 'get_history': 'history_data'}
+
+# Typed commands (no exit words: they would end the client's session)
+COMMANDS = [
+    "what time is it", "open notepad", "tell me a joke", "what's the weather like",
+    "remind me to call mom", "play some music", "how far away is the moon",
+    "summarize my day", "what did we talk about yesterday", "search for python tutorials",
+]
+
+LOOP_LAG_INTERVAL = 0.1
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+class Stats:
+    """Counts and latencies of the current report interval"""
+
+    def __init__(self):
+        self.sent = collections.Counter()
+        self.received = collections.Counter()
+        self.bytes_received = 0
+        self.latencies = collections.defaultdict(list)  # request type -> seconds
+        self.loop_lag = []
+        self.errors = collections.Counter()
+
+    def reply(self, request_type, seconds):
+        self.latencies[request_type].append(seconds)
+
+    def take(self):
+        """This interval's numbers, starting a new interval"""
+        interval = {
+            'sent': dict(self.sent), 'received': dict(self.received),
+            'bytes_received': self.bytes_received,
+            'latencies': dict(self.latencies), 'loop_lag': self.loop_lag,
+            'errors': dict(self.errors),
+        }
+        self.sent, self.received = collections.Counter(), collections.Counter()
+        self.bytes_received = 0
+        self.latencies, self.loop_lag = collections.defaultdict(list), []
+        self.errors = collections.Counter()
+        return interval
+
+
+class LoadClient:
+    """One connection sending a random mix of requests and timing the replies"""
+
+    def __init__(self, number, url, rates, stats, rng, history_limit=100,
+                 subscribe=False, encoding="json"):
+        self.number = number
+        self.url = url
+        self.rates = rates
+        self.stats = stats
+        self.rng = rng
+        self.history_limit = history_limit
+        self.subscribe = subscribe
+        self.encoding = encoding
+        self.session = f"load-{number}"
+        self.pending = {kind: collections.deque() for kind in REPLIES}  # (send time, text)
+        self.sent_commands = 0
+
+    def outstanding(self):
+        return sum(len(times) for times in self.pending.values())
+
+    async def run(self, stop_at, drain):
+        try:
+            async with websockets.connect(self.url, max_size=None) as ws:
+                if self.encoding != "json":
+                    await ws.send(json.dumps({'type': 'hello', 'payload': {'encodings': [self.encoding]}}))
+                if self.subscribe:
+                    await ws.send(json.dumps({'type': 'subscribe_history', 'payload': {}}))
+                reader = asyncio.create_task(self.read(ws))
+                await asyncio.gather(*(
+                    self.send_loop(ws, kind, rate, stop_at)
+                    for kind, rate in self.rates.items() if rate > 0
+                ))
+                # Give the server a moment to answer what is still outstanding
+                give_up = time.perf_counter() + drain
+                while self.outstanding() and time.perf_counter() < give_up and not reader.done():
+                    await asyncio.sleep(0.05)
+                reader.cancel()
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            self.stats.errors[type(e).__name__] += 1
+            print(f"⚠️ Client {self.number}: {e}")
+
+    async def send_loop(self, ws, kind, rate, stop_at):
+        loop = asyncio.get_running_loop()
+        while True:
+            wake_at = loop.time() + self.rng.expovariate(rate)
+            if wake_at >= stop_at:
+                await asyncio.sleep(max(0.0, stop_at - loop.time()))
+                return
+            await asyncio.sleep(wake_at - loop.time())
+            payload, text = {}, None
+            if kind == 'text_command':
+                self.sent_commands += 1
+                text = f"{self.rng.choice(COMMANDS)} #{self.sent_commands}"
+                payload = {'text': text, 'session': self.session}
+            elif kind == 'get_history':
+                payload = {'limit': self.history_limit}
+            self.pending[kind].append((time.perf_counter(), text))
+            await ws.send(json.dumps({'type': kind, 'payload': payload}))
+            self.stats.sent[kind] += 1
+
+    async def read(self, ws):
+        try:
+            async for frame in ws:
+                now = time.perf_counter()
+                self.stats.bytes_received += len(frame)
+                if not wire_codec.is_message_frame(frame):
+                    self.stats.received['audio'] += 1
+                    continue
+                message = wire_codec.decode(frame)
+                kind = message.get('type')
+                self.stats.received[kind] += 1
+                if kind == 'status':
+                    while self.pending['get_status']:
+                        self.stats.reply('get_status', now - self.pending['get_status'].popleft()[0])
+                elif kind == 'turn_cancelled':
+                    text = (message.get('payload') or {}).get('text')
+                    commands = self.pending['text_command']
+                    for entry in list(commands):
+                        if entry[1] == text:
+                            commands.remove(entry)
+                            self.stats.errors['superseded'] += 1
+                            break
+                elif kind in ('jarvis_response', 'history_data'):
+                    request = 'text_command' if kind == 'jarvis_response' else 'get_history'
+                    if self.pending[request]:
+                        self.stats.reply(request, now - self.pending[request].popleft()[0])
+        except websockets.exceptions.ConnectionClosed as e:
+            self.stats.errors['closed'] += 1
+            print(f"⚠️ Client {self.number} disconnected: {e}")
+
+
+async def monitor_loop_lag(stats):
+    """How late this process's event loop wakes (if it lags, the latencies are ours, not the server's)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        stats.loop_lag.append(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+async def server_metrics(ws):
+    """The server's get_metrics snapshot"""
+    await ws.send(json.dumps({'type': 'get_metrics'}))
+    async for frame in ws:
+        if wire_codec.is_message_frame(frame):
+            data = wire_codec.decode(frame)
+            if data.get('type') == 'metrics':
+                return data['payload']
+
+
+def server_sample(metrics, previous=None):
+    """RSS, loop lag (mean since the last sample, overall p95/max) and queue gauges"""
+    gauges = metrics.get('gauges', {})
+    lag = metrics.get('histograms', {}).get('event_loop_lag_seconds') or {}
+    sample = {
+        'rss_bytes': gauges.get('process_rss_bytes'),
+        'sessions': gauges.get('sessions'),
+        'commands_queued': gauges.get('session_commands_queued'),
+        'send_queue_max': gauges.get('ws_send_queue_depth_max'),
+        'lag_count': lag.get('count', 0), 'lag_sum': lag.get('sum', 0.0),
+        'lag_p95': lag.get('p95'), 'lag_max': lag.get('max'),
+    }
+    count = sample['lag_count'] - (previous['lag_count'] if previous else 0)
+    total = sample['lag_sum'] - (previous['lag_sum'] if previous else 0.0)
+    sample['lag_mean'] = total / count if count > 0 else None
+    return sample
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.0f}" if seconds is not None else "-"
+
+
+def summarize_interval(interval, seconds):
+    summary = {
+        'sent_per_s': round(sum(interval['sent'].values()) / seconds, 1),
+        'received_per_s': round(sum(interval['received'].values()) / seconds, 1),
+        'kb_per_s': round(interval['bytes_received'] / 1024 / seconds, 1),
+        'errors': interval['errors'],
+    }
+    for kind, values in interval['latencies'].items():
+        summary[kind] = {'count': len(values), 'p50': pct(values, 0.5),
+                         'p95': pct(values, 0.95), 'p99': pct(values, 0.99), 'max': max(values)}
+    summary['loop_lag'] = {'p95': pct(interval['loop_lag'], 0.95), 'max': max(interval['loop_lag'], default=0.0)}
+    return summary
+
+
+def print_interval(elapsed, summary, sample):
+    parts = [f"⏱️ {int(elapsed) // 60:02d}:{int(elapsed) % 60:02d}",
+             f"sent {summary['sent_per_s']}/s", f"recv {summary['received_per_s']}/s ({summary['kb_per_s']} KB/s)"]
+    for kind in REPLIES:
+        if kind in summary:
+            s = summary[kind]
+            parts.append(f"{kind} {_ms(s['p50'])}/{_ms(s['p95'])}/{_ms(s['p99'])} ms")
+    parts.append(f"lag here {_ms(summary['loop_lag']['p95'])} ms")
+    if sample:
+        parts.append(f"server lag {_ms(sample['lag_mean'])} mean / {_ms(sample['lag_max'])} max ms")
+        if sample['rss_bytes']:
+            parts.append(f"rss {sample['rss_bytes'] / 2**20:.1f} MB")
+        parts.append(f"queued {sample['commands_queued']}")
+    if summary['errors']:
+        parts.append(f"errors {summary['errors']}")
+    print("  ".join(parts))
+
+
+async def run_load(url, clients, rates, duration, ramp=5.0, report=10.0, drain=10.0,
+                   history_limit=100, subscribe=False, encoding="json", seed=7):
+    """Run the load; returns {'intervals': [...], 'summary': {...}}"""
+    loop = asyncio.get_running_loop()
+    stats = Stats()
+    rng = random.Random(seed)
+    start = loop.time()
+    stop_at = start + duration
+    load_clients = [
+        LoadClient(n, url, rates, stats, random.Random(rng.random()), history_limit, subscribe, encoding)
+        for n in range(clients)
+    ]
+
+    async def start_client(client):
+        await asyncio.sleep(ramp * client.number / max(1, clients))
+        await client.run(stop_at, drain)
+
+    lag_task = asyncio.create_task(monitor_loop_lag(stats))
+    tasks = [asyncio.create_task(start_client(c)) for c in load_clients]
+    intervals, samples, all_latencies = [], [], collections.defaultdict(list)
+    all_lag, totals_sent, totals_received = [], collections.Counter(), collections.Counter()
+    errors = collections.Counter()
+    async with websockets.connect(url, max_size=None) as monitor:
+        sample = server_sample(await server_metrics(monitor))
+        samples.append(sample)
+        last = loop.time()
+        while not all(t.done() for t in tasks):
+            await asyncio.wait(tasks, timeout=max(0.0, last + report - loop.time()))
+            now = loop.time()
+            interval = stats.take()
+            for kind, values in interval['latencies'].items():
+                all_latencies[kind].extend(values)
+            all_lag.extend(interval['loop_lag'])
+            totals_sent.update(interval['sent'])
+            totals_received.update(interval['received'])
+            errors.update(interval['errors'])
+            sample = server_sample(await server_metrics(monitor), samples[-1])
+            samples.append(sample)
+            summary = summarize_interval(interval, max(now - last, 1e-3))
+            summary.update(elapsed=round(now - start, 1), server=sample)
+            intervals.append(summary)
+            print_interval(now - start, summary, sample)
+            last = now
+    lag_task.cancel()
+
+    elapsed = loop.time() - start
+    rss = [s['rss_bytes'] for s in samples if s['rss_bytes']]
+    summary = {
+        'clients': clients, 'rates': rates, 'seconds': round(elapsed, 1),
+        'sent': dict(totals_sent), 'received': dict(totals_received), 'errors': dict(errors),
+        'unanswered': sum(c.outstanding() for c in load_clients),
+        'sent_per_s': round(sum(totals_sent.values()) / elapsed, 1),
+        'received_per_s': round(sum(totals_received.values()) / elapsed, 1),
+        'loop_lag_p95': pct(all_lag, 0.95), 'loop_lag_max': max(all_lag, default=0.0),
+        'server_lag_p95': samples[-1]['lag_p95'], 'server_lag_max': samples[-1]['lag_max'],
+        'rss_start': rss[0] if rss else None, 'rss_end': rss[-1] if rss else None,
+        'rss_peak': max(rss) if rss else None,
+    }
+    for kind, values in all_latencies.items():
+        summary[kind] = {'count': len(values), 'p50': pct(values, 0.5), 'p95': pct(values, 0.95),
+                         'p99': pct(values, 0.99), 'max': max(values)}
+    return {'intervals': intervals, 'summary': summary}
+
+
+def print_summary(summary):
+    print(f"\n📊 {summary['clients']} clients for {summary['seconds']}s: "
+          f"sent {summary['sent_per_s']}/s, received {summary['received_per_s']}/s")
+    for kind in REPLIES:
+        if kind in summary:
+            s = summary[kind]
+            print(f"   {kind:<14} {s['count']:>7}  p50 {_ms(s['p50']):>5} ms  p95 {_ms(s['p95']):>5} ms  "
+                  f"p99 {_ms(s['p99']):>5} ms  max {_ms(s['max']):>5} ms")
+    print(f"   event loop lag: here p95 {_ms(summary['loop_lag_p95'])} ms, "
+          f"server p95 {_ms(summary['server_lag_p95'])} ms / max {_ms(summary['server_lag_max'])} ms")
+    if summary['rss_start']:
+        print(f"   server RSS: {summary['rss_start'] / 2**20:.1f} → {summary['rss_end'] / 2**20:.1f} MB "
+              f"(peak {summary['rss_peak'] / 2**20:.1f} MB)")
+    if summary['unanswered'] or summary['errors']:
+        print(f"   ⚠️ {summary['unanswered']} requests unanswered, errors: {summary['errors'] or 'none'}")
+
+
+def _option(args, flag, default=None):
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 < len(args):
+            return args[i + 1]
+    return default
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print(__doc__)
+        sys.exit(0)
+
+    url = _option(args, "--url", DEFAULT_URL)
+    clients = int(_option(args, "--clients", 20))
+    duration = float(_option(args, "--duration", 60))
+    rates = {
+        'text_command': float(_option(args, "--commands", 0.2)),
+        'get_status': float(_option(args, "--status", 1)),
+        'get_history': float(_option(args, "--history", 0.1)),
+    }
+    print(f"🔥 {clients} clients → {url} for {duration:g}s "
+          f"({', '.join(f'{kind} {rate:g}/s' for kind, rate in rates.items())} per client)")
+    try:
+        result = asyncio.run(run_load(
+            url, clients, rates, duration,
+            ramp=float(_option(args, "--ramp", 5)),
+            report=float(_option(args, "--report", 10)),
+            drain=float(_option(args, "--drain", 10)),
+            history_limit=int(_option(args, "--history-limit", 100)),
+            subscribe="--subscribe" in args,
+            encoding=_option(args, "--encoding", "json"),
+            seed=int(_option(args, "--seed", 7)),
+        ))
+    except (OSError, websockets.exceptions.WebSocketException) as e:
+        print(f"❌ Can't reach the server at {url}: {e}")
+        sys.exit(1)
+    print_summary(result['summary'])
+
+    out = _option(args, "--json")
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump({"args": args, **result}, f, indent=2)
+        print(f"💾 Results written to {out}")
@@ -6,6 +6,9 @@ from wake_engine import listen_for_wake_word
 from speech_engine import listen_for_command, tts_speak, play_audio_blocking
 from ai_engine import get_ai_response
 from actions_engine import execute_action
+from summary_engine import SessionSummarizer
+from turn_pipeline import executor
+import background_writer
 import re
 
 # ---- Folder setup ----
@@ -22,9 +25,21 @@ for folder in [LOGS_DIR, AUDIO_DIR]:
 def log_interaction(user_text, ai_text):
     timestamp = time.strftime("%Y%m%d-%H%M%S")
     log_file = os.path.join(LOGS_DIR, "jarvis_logs.txt")
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] You: {user_text}\n")
-        f.write(f"[{timestamp}] Jarvis: {ai_text}\n\n")
+    background_writer.append(log_file, f"[{timestamp}] You: {user_text}\n[{timestamp}] Jarvis: {ai_text}\n\n")
+
+# ---- Actions ----
+def dispatch_action(action):
+    """Run an action on the actions pool; its result and duration are printed when it finishes"""
+    start = time.perf_counter()
+
+    def report(done):
+        try:
+            result = done.result()
+        except Exception as e:
+            result = f"Action failed: {e}"
+        print(f"⚙️ Action: {result} ({time.perf_counter() - start:.1f}s)")
+
+    executor("actions").submit(execute_action, action).add_done_callback(report)
 
 # ---- Main loop ----
 def main():
@@ -36,6 +51,7 @@ def main():
             print("🟢 Entering conversation mode...")
             session_start_time = time.strftime("%Y%m%d-%H%M%S")
             session_history = []  # Initialize session context
+            summarizer = SessionSummarizer(session_start_time)
             
             while True:
                 timestamp = time.strftime("%Y%m%d-%H%M%S")
@@ -55,17 +71,18 @@ def main():
                     # Save session to file before exiting
                     from memory_engine import save_session_history
                     save_session_history(session_history, session_start_time)
+                    summarizer.finish(session_history, session_start_time)
                     break
                 
                 # Get AI response with session context
-                ai_text = get_ai_response(user_text, session_history)
+                ai_text = get_ai_response(user_text, session_history, summarizer.summary)
                 
                 # Check for action triggers
                 if "[[" in ai_text and "]]" in ai_text:
                     actions = re.findall(r'\[\[ACTION:.*?\]\]', ai_text)
+                    # All actions start at once on the actions pool; the reply is spoken meanwhile
                     for action in actions:
-                        action_result = execute_action(action)
-                        print(f"⚙️ Action: {action_result}")
+                        dispatch_action(action)
                     # Clean up the spoken text by removing all action tags
                     ai_text = re.sub(r'\[\[ACTION:.*?\]\]', '', ai_text).strip()
 
@@ -74,6 +91,7 @@ def main():
                 # Update session history
                 session_history.append(("User", user_text))
                 session_history.append(("Jarvis", ai_text))
+                summarizer.update(session_history)
                 
                 # Convert AI response to speech
                 response_audio = os.path.join(AUDIO_DIR, f"response_{timestamp}.mp3")
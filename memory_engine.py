@@ -1,5 +1,12 @@
 import json, os
 import glob
+import atexit
+import copy
+import tempfile
+import threading
+import time
+
+import metrics_engine
 
 # Ensure dirs exist
 os.makedirs("log", exist_ok=True)
@@ -8,63 +15,246 @@ os.makedirs("memory", exist_ok=True)
 
 PROFILE_FILE = "profile.json"
 MEMORY_FILE = "memory.json"
-HISTORY_FILE = os.path.join("memory", "history.jsonl")
+
+DEFAULT_PROFILE = {"name": "Manan", "timezone": "America/Regina", "study": "", "location": ""}
+DEFAULT_MEMORY = {"facts": []}
+
+# How often cached files are checked for outside edits, and how long writes are batched
+REVALIDATE_SECONDS = 2.0
+FLUSH_DELAY = 0.5
+
+
+class _CachedJson:
+    """One JSON file held in memory, plus the edits not yet written back"""
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+        self.data = None
+        self.mtime = None
+        self.checked_at = 0.0
+        self.pending = []  # Edits to re-apply if the file changes on disk before we flush
+
+
+class MemoryStore:
+    """
+    In-process cache for profile.json and memory.json.
+    Reads come from memory and are revalidated against the file mtime at most
+    every REVALIDATE_SECONDS. Writes are applied in memory straight away and
+    written back by a background flusher, atomically via temp file + rename.
+    """
+
+    def __init__(self, profile_file=PROFILE_FILE, memory_file=MEMORY_FILE):
+        self.lock = threading.RLock()
+        self.profile_doc = _CachedJson(profile_file, DEFAULT_PROFILE)
+        self.memory_doc = _CachedJson(memory_file, DEFAULT_MEMORY)
+        self.dirty = threading.Event()
+        self.flusher = None
+        atexit.register(self.flush)
+
+    # ---- Reading ----
+    def _revalidate(self, doc, force=False):
+        now = time.monotonic()
+        if doc.data is not None and not force and now - doc.checked_at < REVALIDATE_SECONDS:
+            metrics_engine.inc("cache_requests_total", cache="memory_store", result="hit")
+            return
+        doc.checked_at = now
+        try:
+            mtime = os.stat(doc.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is None:
+            if doc.data is None:
+                doc.data = copy.deepcopy(doc.default)
+                self._schedule_flush(doc)  # Create the file, as before
+            return
+        if mtime == doc.mtime and doc.data is not None:
+            metrics_engine.inc("cache_requests_total", cache="memory_store", result="hit")
+            return
+        metrics_engine.inc("cache_requests_total", cache="memory_store", result="miss")
+
+        try:
+            with open(doc.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"⚠️ Could not read {doc.path}: {e}")
+            if doc.data is None:
+                doc.data = copy.deepcopy(doc.default)
+            return
+        for edit in doc.pending:
+            edit(data)
+        doc.data = data
+        doc.mtime = mtime
+
+    def profile(self):
+        with self.lock:
+            self._revalidate(self.profile_doc)
+            return dict(self.profile_doc.data)
+
+    def memory(self):
+        with self.lock:
+            self._revalidate(self.memory_doc)
+            data = dict(self.memory_doc.data)
+            data["facts"] = list(data.get("facts", []))
+            return data
+
+    # ---- Writing ----
+    def _edit(self, doc, edit):
+        with self.lock:
+            self._revalidate(doc)
+            edit(doc.data)
+            doc.pending.append(edit)
+            self._schedule_flush(doc)
+
+    def update_profile(self, key, value):
+        def edit(data):
+            data[key] = value
+        self._edit(self.profile_doc, edit)
+
+    def add_fact(self, fact):
+        def edit(data):
+            data.setdefault("facts", []).append(fact)
+        self._edit(self.memory_doc, edit)
+
+    def replace_fact(self, old, new):
+        def edit(data):
+            facts = data.setdefault("facts", [])
+            data["facts"] = [new if f == old else f for f in facts] if old in facts else facts + [new]
+        self._edit(self.memory_doc, edit)
+
+    def set_facts(self, facts):
+        def edit(data):
+            data["facts"] = list(facts)
+        self._edit(self.memory_doc, edit)
+
+    def _schedule_flush(self, doc):
+        if not doc.pending:
+            doc.pending.append(lambda data: None)  # Mark as needing a write
+        if self.flusher is None or not self.flusher.is_alive():
+            self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flusher.start()
+        self.dirty.set()
+
+    def _flush_loop(self):
+        while True:
+            self.dirty.wait()
+            time.sleep(FLUSH_DELAY)  # Let a burst of edits land in one write
+            self.dirty.clear()
+            self.flush()
+
+    def _write(self, doc):
+        directory = os.path.dirname(os.path.abspath(doc.path))
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(doc.path), suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(doc.data, f, indent=2)
+            os.replace(tmp, doc.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        doc.mtime = os.stat(doc.path).st_mtime_ns
+        doc.pending = []
+
+    def flush(self):
+        """Write any pending edits now"""
+        with self.lock:
+            for doc in (self.profile_doc, self.memory_doc):
+                if doc.pending:
+                    try:
+                        # Pick up outside edits first; pending edits are replayed on top
+                        self._revalidate(doc, force=True)
+                        self._write(doc)
+                    except Exception as e:
+                        print(f"❌ Error saving {doc.path}: {e}")
+
+
+store = MemoryStore()
 
 def load_profile():
-    if not os.path.exists(PROFILE_FILE):
-        default = {"name": "Manan", "timezone": "America/Regina", "study": "", "location": ""}
-        with open(PROFILE_FILE, "w", encoding="utf-8") as f:
-            json.dump(default, f, indent=2)
-        return default
-    with open(PROFILE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return store.profile()
 
 def update_profile(key: str, value: str):
-    data = load_profile()
-    data[key] = value
-    with open(PROFILE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    store.update_profile(key, value)
     return f"Updated {key} to {value}"
 
 def load_memory():
-    if not os.path.exists(MEMORY_FILE):
-        with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-            json.dump({"facts": []}, f, indent=2)
-        return {"facts": []}
-    with open(MEMORY_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return store.memory()
 
 def save_memory(fact: str):
-    data = load_memory()
-    data["facts"].append(fact)
-    with open(MEMORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    """Remember a fact, folding it into an existing one that says the same thing"""
+    from fact_store import get_fact_store
+
+    fact = fact.strip()
+    if not fact:
+        return
+    facts = get_fact_store()
+    try:
+        facts.sync(store.memory().get("facts", []))
+        action, existing = facts.classify(fact)
+    except Exception as e:
+        print(f"Error checking facts: {e}")
+        action, existing = "new", None
+    if action == "duplicate":
+        facts.note_duplicate(existing)
+    elif action == "reword":
+        store.replace_fact(existing, fact)
+        facts.note_reword(existing, fact)
+    else:
+        store.add_fact(fact)
 
 def search_history(query: str, limit=5):
-    """Search imported history for keywords"""
+    """Search conversation history, best BM25 matches first"""
+    import history_store
+
     results = []
-    if not os.path.exists(HISTORY_FILE):
-        return results
-        
-    query = query.lower()
     try:
-        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-            # Read file in reverse or just scan all? 25MB is scanable.
-            # Let's just scan all for now, maybe optimize later.
-            for line in f:
-                if query in line.lower():
-                    try:
-                        entry = json.loads(line)
-                        results.append(f"[{entry['timestamp']}] {entry['role']}: {entry['text']}")
-                        if len(results) >= limit:
-                            break
-                    except:
-                        continue
+        for score, entry in history_store.search(query, limit=limit):
+            results.append(f"[{entry.get('timestamp', '')}] {entry.get('role', '')}: {entry.get('text', '')}")
     except Exception as e:
         print(f"Error searching history: {e}")
-        
+
     return results
 
+def relevant_history(user_query: str, limit=3, max_chars=300):
+    """Past exchanges related to the query, excluding the query itself"""
+    import history_store
+    import semantic_memory
+
+    hits = []
+    query_key = user_query.strip().lower()
+    try:
+        # Keyword matches first, then semantic neighbours for paraphrased questions
+        candidates = [entry for score, entry in history_store.search(user_query, limit=limit + 1)]
+        candidates += [item for score, item in semantic_memory.recall(user_query, k=limit + 1, kind="history")]
+        seen = {query_key}  # The current turn is already saved before we get here
+        for entry in candidates:
+            text = entry.get("text", "").strip()
+            if not text or text.lower() in seen:
+                continue
+            seen.add(text.lower())
+            if len(text) > max_chars:
+                text = text[:max_chars].rstrip() + "..."
+            hits.append(f"{entry.get('role', '')}: {text}")
+            if len(hits) >= limit:
+                break
+    except Exception as e:
+        print(f"Error searching history: {e}")
+    return hits
+
+def relevant_facts(user_query: str, facts, limit=6):
+    """Facts ranked by relevance to the query, recency and usage, within a size budget"""
+    from fact_store import get_fact_store
+
+    try:
+        ranker = get_fact_store()
+        ranker.sync(facts)
+        return ranker.select(user_query, limit=limit)
+    except Exception as e:
+        print(f"Error ranking facts: {e}")
+        return facts[-5:]
+
 def memory_context(user_query: str = "") -> str:
     """Combine profile + remembered facts + relevant history into one context string"""
     profile = load_profile()
@@ -86,41 +276,45 @@ def memory_context(user_query: str = "") -> str:
 
     # Facts Section - Only if there are facts
     if mem.get("facts") and len(mem["facts"]) > 0:
-        context.append("Known facts: " + "; ".join(mem["facts"][-5:])) # Last 5 facts only
+        facts = relevant_facts(user_query, mem["facts"])
+        context.append("Known facts: " + "; ".join(facts))
+
+    # History Search Section - indexed, so cheap enough for every prompt
+    if user_query:
+        history_hits = relevant_history(user_query, limit=3)
+        if history_hits:
+            context.append("Relevant past exchanges:\n" + "\n".join(history_hits))
 
-    # History Search Section - Disabled by default to reduce verbosity
-    # Uncomment if you want history search enabled
-    # if user_query:
-    #     history_hits = search_history(user_query, limit=3)
-    #     if history_hits:
-    #         context.append("Relevant past exchanges:\n" + "\n".join(history_hits))
+    # Digests of earlier sessions on the same topic
+    if user_query:
+        from summary_engine import relevant_digests
+        digests = relevant_digests(user_query, limit=2)
+        if digests:
+            context.append("Earlier sessions:\n" + "\n".join(digests))
 
     return "\n".join(context) if context else ""
 
 def save_session_history(session_history, session_start_time):
-    """Save the current session conversation to a timestamped file"""
-    import time
+    """Save the current session conversation to a timestamped file (written in the background)"""
+    import background_writer
     
     if not session_history:
         return
     
     sessions_dir = os.path.join("memory", "sessions")
-    os.makedirs(sessions_dir, exist_ok=True)
     
     filename = f"session_{session_start_time}.txt"
     filepath = os.path.join(sessions_dir, filename)
     
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(f"JARVIS Conversation Session\n")
-        f.write(f"Started: {session_start_time}\n")
-        f.write("=" * 60 + "\n\n")
-        
-        for role, text in session_history:
-            f.write(f"{role}: {text}\n\n")
-        
-        f.write("=" * 60 + "\n")
-        f.write(f"Session ended: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    lines = [
+        "JARVIS Conversation Session\n",
+        f"Started: {session_start_time}\n",
+        "=" * 60 + "\n\n",
+    ]
+    for role, text in session_history:
+        lines.append(f"{role}: {text}\n\n")
+    lines.append("=" * 60 + "\n")
+    lines.append(f"Session ended: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
     
+    background_writer.write(filepath, "".join(lines))
     print(f"💾 Session saved to: {filepath}")
-
-
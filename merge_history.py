@@ -0,0 +1,155 @@
+# merge_history.py
+"""
+Merge history from many sources into memory/history.db.
+Each source (per-machine history*.jsonl copies, conversations.json or
+history.html exports) is parsed and hashed in its own worker process. Entries
+are deduplicated by content hash against the hash set kept in the database
+and inserted in timestamp order. Sources whose fingerprint hasn't changed
+since the last merge are skipped, so repeated merges only do new work.
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import history_store
+import import_history
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATTERNS = [
+    os.path.join(history_store.MEMORY_DIR, "history.jsonl"),
+    os.path.join(history_store.MEMORY_DIR, "history-*.jsonl"),
+    os.path.join(import_history.IMPORT_DIR, "*.jsonl"),
+    os.path.join(import_history.IMPORT_DIR, "*.json"),
+    os.path.join(import_history.IMPORT_DIR, "*.html"),
+]
+
+# Entries per insert transaction
+BATCH_SIZE = 1000
+
+
+def default_sources():
+    paths = []
+    for pattern in DEFAULT_PATTERNS:
+        for path in sorted(glob.glob(pattern)):
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(entry, dict):
+                yield entry
+
+
+def _iter_source(path):
+    lowered = path.lower()
+    if lowered.endswith(".jsonl"):
+        yield from _iter_jsonl(path)
+        return
+    progress = import_history.Progress(0)
+    if lowered.endswith(".json"):
+        units = import_history.iter_json_entries(path, 0, progress)
+    else:
+        units = import_history.iter_html_entries(path, progress)
+    for entries, _ in units:
+        yield from entries
+
+
+def read_source(path):
+    """
+    Worker: parse one source into normalized, hashed entries.
+    Returns (path, fingerprint, entries) with duplicates inside the source removed.
+    """
+    name = os.path.basename(path)
+    seen = set()
+    entries = []
+    for entry in _iter_source(path):
+        role = entry.get("role") or "unknown"
+        text = (entry.get("text") or "").strip()
+        if not text:
+            continue
+        timestamp = history_store.normalize_timestamp(entry.get("timestamp")) or ""
+        digest = history_store.content_hash(role, text, timestamp)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        merged = {"hash": digest, "role": role, "text": text, "timestamp": timestamp, "source": name}
+        if entry.get("session"):
+            merged["session"] = entry["session"]
+        entries.append(merged)
+    return path, import_history.fingerprint(path), entries
+
+
+def merge(paths=None, workers=None, force=False):
+    """Merge the given sources (default: memory/ and import/) and return the number of new entries"""
+    store = history_store.get_store()
+    paths = [os.path.abspath(p) for p in (paths or default_sources())]
+
+    todo = []
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"⚠️ Skipping missing source {path}")
+            continue
+        saved = store.merge_source(path)
+        if saved and not force and saved[0] == import_history.fingerprint(path):
+            print(f"⏭️ {os.path.basename(path)} unchanged since the last merge")
+            continue
+        todo.append(path)
+    if not todo:
+        print("✅ History is up to date")
+        return 0
+
+    start = time.perf_counter()
+    workers = workers or min(len(todo), os.cpu_count() or 1)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(read_source, path): path for path in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                _, fingerprint, entries = future.result()
+            except Exception as e:
+                print(f"❌ Error reading {path}: {e}")
+                continue
+            results[path] = (fingerprint, entries)
+            print(f"📄 {os.path.basename(path)}: {len(entries)} unique entries")
+    read_ms = (time.perf_counter() - start) * 1000
+
+    # Cross-source dedupe (first source in the given order wins), then time order.
+    # Entries without a timestamp keep their source order after the dated ones.
+    merged = {}
+    for path in todo:
+        if path not in results:
+            continue
+        for entry in results[path][1]:
+            merged.setdefault(entry["hash"], entry)
+    ordered = sorted(merged.values(), key=lambda e: (e["timestamp"] == "", e["timestamp"]))
+
+    added = 0
+    for i in range(0, len(ordered), BATCH_SIZE):
+        added += store.append_many(ordered[i:i + BATCH_SIZE], dedupe=True)
+    for path, (fingerprint, entries) in results.items():
+        store.record_merge_source(path, fingerprint, len(entries))
+
+    total_ms = (time.perf_counter() - start) * 1000
+    print(f"🔀 Merged {len(results)} sources: {len(ordered)} distinct entries, {added} new "
+          f"(read {read_ms:.0f} ms, total {total_ms:.0f} ms)")
+    return added
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    merge(args or None, force="--force" in sys.argv)
@@ -0,0 +1,240 @@
+# metrics_engine.py
+"""
+In-process metrics: counters, gauges and latency histograms keyed by name and
+labels. Updates are a dict operation under a lock, cheap enough for hot paths.
+Gauges can also be callbacks, read when a snapshot is taken.
+Histograms use fixed buckets (no samples are kept), so percentiles are
+estimates within a bucket. The registry can be read as a dict (snapshot) or
+as Prometheus text (prometheus_text, or serve() over HTTP on localhost).
+
+    python metrics_engine.py [http://localhost:8766/metrics]
+"""
+
+import bisect
+import contextlib
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Upper bounds in seconds: wake/STT/LLM/TTS stages take 50 ms to tens of seconds,
+# the small ones (memory context, encoding, queue waits) land in the first buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+METRICS_PATH = "/metrics"
+DEFAULT_PORT = 8766
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_gauges = {}      # (name, labels) -> value
+_gauge_fns = {}   # (name, labels) -> fn returning a value
+_histograms = {}  # (name, labels) -> [count per bucket..., count above the last, sum, max]
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def gauge_fn(name, fn, **labels):
+    """Register a gauge computed on demand (e.g. a queue length)"""
+    with _lock:
+        _gauge_fns[_key(name, labels)] = fn
+
+
+def observe(name, seconds, **labels):
+    """Record one duration in a histogram"""
+    key = _key(name, labels)
+    slot = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0.0]
+        hist[slot] += 1
+        hist[-2] += seconds
+        hist[-1] = max(hist[-1], seconds)
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """Time a block into a histogram (recorded even if the block raises)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def call_provider(kind, provider, fn, *args):
+    """
+    Call one provider of a fallback chain, counting the attempt and timing it.
+    A falsy result or an exception counts as a failure (exceptions propagate).
+    """
+    inc("provider_attempts_total", kind=kind, provider=provider)
+    start = time.perf_counter()
+    result = None
+    try:
+        result = fn(*args)
+        return result
+    finally:
+        observe("provider_seconds", time.perf_counter() - start, kind=kind, provider=provider)
+        if not result:
+            inc("provider_failures_total", kind=kind, provider=provider)
+
+
+def process_rss_bytes():
+    """Resident memory of this process (psutil, else /proc; None if neither is there)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+gauge_fn("process_rss_bytes", process_rss_bytes)
+
+
+def _quantile(counts, q, largest):
+    """Estimate a quantile from bucket counts, interpolating inside the bucket"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for slot, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if slot == len(BUCKETS):
+                return largest  # Beyond the last bound
+            low = BUCKETS[slot - 1] if slot else 0.0
+            return min(low + (BUCKETS[slot] - low) * (rank - seen) / count, largest)
+        seen += count
+    return largest
+
+
+def _format(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _read():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        fns = dict(_gauge_fns)
+        histograms = {key: list(hist) for key, hist in _histograms.items()}
+    for key, fn in fns.items():
+        try:
+            gauges[key] = fn()
+        except Exception as e:
+            print(f"⚠️ Metric {_format(*key)} failed: {e}")
+    return counters, gauges, histograms
+
+
+def snapshot():
+    """
+    {'counters': {...}, 'gauges': {...}, 'histograms': {...}} with names like
+    name{label="value"}. Each histogram has count, sum, mean, max and p50/p95/p99.
+    """
+    counters, gauges, histograms = _read()
+    summaries = {}
+    for (name, labels), hist in sorted(histograms.items()):
+        counts, total, largest = hist[:-2], hist[-2], hist[-1]
+        count = sum(counts)
+        summary = {
+            'count': count,
+            'sum': round(total, 6),
+            'mean': round(total / count, 6) if count else None,
+            'max': round(largest, 6),
+        }
+        for q in QUANTILES:
+            value = _quantile(counts, q, largest)
+            summary[f"p{int(q * 100)}"] = round(value, 6) if value is not None else None
+        summaries[_format(name, labels)] = summary
+    return {
+        'counters': {_format(n, l): v for (n, l), v in sorted(counters.items())},
+        'gauges': {_format(n, l): v for (n, l), v in sorted(gauges.items())},
+        'histograms': summaries,
+    }
+
+
+def prometheus_text():
+    """The registry in the Prometheus text exposition format"""
+    counters, gauges, histograms = _read()
+    lines = []
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        typed = set()
+        for (name, labels), value in sorted(values.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            lines.append(f"{_format(name, labels)} {value}")
+    typed = set()
+    for (name, labels), hist in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), hist[:-2]):
+            cumulative += count
+            lines.append(f"{_format(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{_format(name + '_sum', labels)} {hist[-2]}")
+        lines.append(f"{_format(name + '_count', labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != METRICS_PATH:
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scraped every few seconds; don't flood the console
+
+
+def serve(host="localhost", port=DEFAULT_PORT):
+    """Serve METRICS_PATH from a daemon thread; returns the server (None if the port is taken)"""
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"⚠️ Metrics endpoint not started: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    print(f"📊 Metrics on http://{host}:{port}{METRICS_PATH}")
+    return server
+
+
+if __name__ == "__main__":
+    # Print a running server's metrics
+    import urllib.request
+    url = sys.argv[1] if len(sys.argv) > 1 else f"http://localhost:{DEFAULT_PORT}{METRICS_PATH}"
+    with urllib.request.urlopen(url, timeout=5) as response:
+        print(response.read().decode())
@@ -0,0 +1,398 @@
+# replay_harness.py
+"""
+Replay the recorded audio corpus through the turn pipeline, offline and
+repeatably.
+Each audio/command_*.wav is fed to the capture stage as if it were spoken into
+the mic (at real time or faster); STT, LLM, actions, TTS and playback are fake
+backends with configurable latencies, so runs compare pipeline and endpointing
+changes rather than provider weather. Any of stt/llm/tts can be switched to
+the real engine with --real.
+
+Endpointing follows speech_recognition: speech is audio above an energy
+threshold, and the capture ends after --endpoint seconds of silence. The key
+number is response latency: end of the user's speech → first reply audio.
+
+    python replay_harness.py [--speed 10] [--turns 56] [--concurrency 1] [--stream]
+                             [--endpoint 0.8] [--threshold 300] [--jitter 0.25]
+                             [--stt-ms 400] [--llm-ms 900] [--tts-ms 350]
+                             [--tts-first-ms 250] [--act-ms 100] [--action-rate 0.2]
+                             [--real stt,llm,tts] [--seed 7] [--json results.json]
+
+Durations are reported in real-time seconds (wall time × speed).
+"""
+
+import array
+import asyncio
+import contextvars
+import glob
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import wave
+
+import metrics_engine
+from turn_pipeline import TurnPipeline
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AUDIO_DIR = os.path.join(BASE_DIR, "audio")
+
+# speech_recognition defaults: energy_threshold, pause_threshold, listen(timeout=10)
+ENERGY_THRESHOLD = 300
+PAUSE_THRESHOLD = 0.8
+LISTEN_TIMEOUT = 10
+FRAME_SECONDS = 0.032
+
+# Fake provider latencies in seconds (median; each call varies by ±JITTER)
+DEFAULT_LATENCIES = {
+    "stt": 0.4,
+    "llm": 0.9,
+    "tts": 0.35,       # whole clip
+    "tts_first": 0.25,  # first streamed chunk
+    "act": 0.1,
+}
+JITTER = 0.25
+STREAM_CHUNK_BYTES = 4096
+
+FAKE_REPLIES = [
+    "Certainly, sir.",
+    "It is currently twenty past four in the afternoon.",
+    "Right away. I have pulled up the latest figures for you.",
+    "The weather in Regina is clear with a light breeze, sir.",
+    "Done. Is there anything else you need?",
+]
+FAKE_ACTION = '[[ACTION: OPEN_APP, "notepad", 1]]'
+
+# MPEG audio bitrates in kbps by bitrate index (layer III)
+MP3_BITRATES = {
+    "mpeg1": (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    "mpeg2": (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+_turn = contextvars.ContextVar("replay_turn")
+
+
+class Recording:
+    """One command WAV: 16-bit mono PCM and where the speech in it ends"""
+
+    def __init__(self, path, threshold=ENERGY_THRESHOLD):
+        self.path = path
+        self.name = os.path.basename(path)
+        with wave.open(path, "rb") as w:
+            self.rate = w.getframerate()
+            self.pcm = w.readframes(w.getnframes())
+        self.duration = len(self.pcm) / 2 / self.rate
+        self.speech_end = speech_end(self.pcm, self.rate, threshold)
+
+
+def speech_end(pcm, rate, threshold):
+    """Seconds into the clip where the last frame above the energy threshold ends (None if silent)"""
+    samples = array.array("h", pcm)
+    n = int(rate * FRAME_SECONDS)
+    end = None
+    for frame, start in enumerate(range(0, len(samples) - n + 1, n)):
+        chunk = samples[start:start + n]
+        if math.sqrt(sum(x * x for x in chunk) / n) > threshold:
+            end = (frame + 1) * FRAME_SECONDS
+    return end
+
+
+def mp3_duration(path):
+    """Length of a constant-bitrate MP3, from the first frame header"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(8192)
+    offset = 0
+    if head[:3] == b"ID3":
+        offset = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9])
+        with open(path, "rb") as f:
+            f.seek(offset)
+            head = f.read(4096)
+        size -= offset
+    kbps = 128
+    for i in range(len(head) - 2):
+        if head[i] == 0xFF and head[i + 1] & 0xE0 == 0xE0:
+            version = "mpeg1" if head[i + 1] & 0x18 == 0x18 else "mpeg2"
+            kbps = MP3_BITRATES[version][head[i + 2] >> 4] or kbps
+            break
+    return size * 8 / (kbps * 1000)
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+class ReplayBackends:
+    """
+    TurnPipeline backends that replay recordings and simulate providers.
+    Timings go into the current replay turn (a ContextVar; run_stage copies
+    the context into its worker threads).
+    """
+
+    def __init__(self, responses, speed=1.0, latencies=None, jitter=JITTER,
+                 endpoint=PAUSE_THRESHOLD, action_rate=0.0, seed=7, real=()):
+        self.responses = responses
+        self.speed = speed
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.jitter = jitter
+        self.endpoint = endpoint
+        self.action_rate = action_rate
+        self.rng = random.Random(seed)
+        self.next_response = 0
+        self.audio_dir = tempfile.mkdtemp(prefix="jarvis-replay-")
+        self.real = set(real)
+        self.speech = None
+        if self.real & {"stt", "tts"}:
+            import speech_engine  # Fail now, not mid-run, if the SDKs are missing
+            self.speech = speech_engine
+        if "stt" in self.real:
+            self.transcribe = self._timed("stt", self._real_transcribe)
+        if "llm" in self.real:
+            from ai_engine import get_ai_response
+            self.respond = self._timed("llm", get_ai_response)
+        if "tts" in self.real:
+            self.synthesize = self._timed("tts", self.speech.tts_speak)
+            self.synthesize_stream = self.speech.tts_stream
+
+    # ---- Simulated time ----
+    def wait(self, seconds):
+        time.sleep(seconds / self.speed)
+
+    def elapsed(self, start):
+        """Real-time seconds since a perf_counter() reading"""
+        return (time.perf_counter() - start) * self.speed
+
+    def latency(self, stage):
+        return max(0.0, self.latencies[stage] * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+    def _timed(self, stage, func):
+        def call(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                _turn.get()["stages"][stage] = self.elapsed(start)
+        return call
+
+    # ---- Stages ----
+    def capture(self):
+        turn = _turn.get()
+        recording = turn["recording"]
+        start = time.perf_counter()
+        if recording.speech_end is None:
+            self.wait(LISTEN_TIMEOUT)  # Nobody spoke: listen() times out
+            turn["stages"]["capture"] = self.elapsed(start)
+            return None
+        self.wait(recording.speech_end)
+        turn["speech_end"] = time.perf_counter()
+        self.wait(self.endpoint)  # Silence until the recognizer decides the phrase is over
+        turn["stages"]["capture"] = self.elapsed(start)
+        return recording
+
+    def transcribe(self, recording):
+        start = time.perf_counter()
+        self.wait(self.latency("stt"))
+        _turn.get()["stages"]["stt"] = self.elapsed(start)
+        return f"replayed {recording.name}"
+
+    def _real_transcribe(self, recording):
+        end = int((recording.speech_end + self.endpoint) * recording.rate) * 2
+        return self.speech.transcribe_pcm(recording.pcm[:end], recording.rate)
+
+    def transcribe_pcm(self, pcm, sample_rate):
+        return self.transcribe(_turn.get()["recording"])
+
+    def respond(self, user_text, session_history=None, session_summary=""):
+        start = time.perf_counter()
+        self.wait(self.latency("llm"))
+        reply = self.rng.choice(FAKE_REPLIES)
+        if self.rng.random() < self.action_rate:
+            reply += " " + FAKE_ACTION
+        _turn.get()["stages"]["llm"] = self.elapsed(start)
+        return reply
+
+    def act(self, action):
+        start = time.perf_counter()
+        self.wait(self.latency("act"))
+        _turn.get()["stages"]["act"] = self.elapsed(start)
+        return f"Replayed {action}"
+
+    def _response_clip(self):
+        path = self.responses[self.next_response % len(self.responses)]
+        self.next_response += 1
+        return path
+
+    def synthesize(self, text, filename):
+        start = time.perf_counter()
+        self.wait(self.latency("tts"))
+        _turn.get()["stages"]["tts"] = self.elapsed(start)
+        return self._response_clip()
+
+    def synthesize_stream(self, text):
+        with open(self._response_clip(), "rb") as f:
+            audio = f.read()
+        first = self.latency("tts_first")
+        rest = max(0.0, self.latency("tts") - first)
+        chunks = max(1, math.ceil(len(audio) / STREAM_CHUNK_BYTES))
+        stages = _turn.get()["stages"]
+        start = time.perf_counter()
+        self.wait(first)
+        stages["tts_first"] = self.elapsed(start)
+        for i in range(chunks):
+            if i:
+                self.wait(rest / chunks)
+            yield audio[i * STREAM_CHUNK_BYTES:(i + 1) * STREAM_CHUNK_BYTES]
+        stages["tts"] = self.elapsed(start)
+
+    def play(self, path):
+        turn = _turn.get()
+        turn["speech_start"] = time.perf_counter()
+        self.wait(mp3_duration(path))
+        turn["stages"]["playback"] = self.elapsed(turn["speech_start"])
+
+
+async def replay_turn(pipeline, backends, recording, stream=False):
+    """One recorded command through listen → think → speak/act; returns its timings"""
+    turn = {"recording": recording, "stages": {}}
+    _turn.set(turn)
+    start = time.perf_counter()
+    text = await pipeline.listen()
+    if text:
+        reply, actions = await pipeline.think(text, [], "")
+        if stream:
+            def on_chunk(chunk):
+                turn.setdefault("speech_start", time.perf_counter())
+            speech = pipeline.stream_speech(reply, on_chunk)
+        else:
+            speech = pipeline.speak(reply, os.path.join(backends.audio_dir, f"{recording.name}.mp3"))
+        tasks = [speech] + ([pipeline.act(actions)] if actions else [])
+        await asyncio.gather(*tasks)
+
+    result = {"recording": recording.name, "understood": bool(text), "stages": turn["stages"]}
+    result["total"] = backends.elapsed(start)
+    if "speech_end" in turn and "speech_start" in turn:
+        result["response"] = (turn["speech_start"] - turn["speech_end"]) * backends.speed
+    return result
+
+
+async def replay(recordings, backends, turns=None, concurrency=1, stream=False):
+    """Replay `turns` commands (cycling through the corpus), `concurrency` at a time"""
+    pipeline = TurnPipeline(backends)
+    queue = asyncio.Queue()
+    for i in range(turns or len(recordings)):
+        queue.put_nowait(recordings[i % len(recordings)])
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            recording = queue.get_nowait()
+            # Each turn runs in its own context so its timings don't mix with others
+            results.append(await asyncio.create_task(replay_turn(pipeline, backends, recording, stream)))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def summarize(results, speed=1.0):
+    """{metric: {n, mean, p50, p95, p99, max}} in milliseconds"""
+    samples = {"response": [], "total": []}
+    for result in results:
+        for key in ("response", "total"):
+            if key in result:
+                samples[key].append(result[key])
+        for stage, seconds in result["stages"].items():
+            samples.setdefault(stage, []).append(seconds)
+    summary = {}
+    for key, values in samples.items():
+        if values:
+            summary[key] = {
+                "n": len(values),
+                "mean": 1000 * sum(values) / len(values),
+                "p50": 1000 * pct(values, 0.5),
+                "p95": 1000 * pct(values, 0.95),
+                "p99": 1000 * pct(values, 0.99),
+                "max": 1000 * max(values),
+            }
+    # Queue waits in front of each stage pool, from the pipeline's own histograms
+    for name, hist in metrics_engine.snapshot()["histograms"].items():
+        if name.startswith("stage_queue_seconds") and hist["count"]:
+            stage = name.split('"')[1]
+            summary[f"queue:{stage}"] = {
+                "n": hist["count"], "mean": 1000 * hist["mean"] * speed,
+                "p50": 1000 * hist["p50"] * speed, "p95": 1000 * hist["p95"] * speed,
+                "p99": 1000 * hist["p99"] * speed, "max": 1000 * hist["max"] * speed,
+            }
+    return summary
+
+
+def print_report(summary, results, elapsed):
+    understood = sum(r["understood"] for r in results)
+    print(f"🔁 {len(results)} turns replayed in {elapsed:.1f} s wall, {understood} understood")
+    print(f"{'':14}{'n':>5}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}   (ms)")
+    order = ["response", "total", "capture", "stt", "llm", "tts_first", "tts", "act", "playback"]
+    keys = [k for k in order if k in summary] + sorted(k for k in summary if k not in order)
+    for key in keys:
+        s = summary[key]
+        print(f"{key:14}{s['n']:>5}{s['mean']:>9.0f}{s['p50']:>9.0f}{s['p95']:>9.0f}{s['p99']:>9.0f}{s['max']:>9.0f}")
+    if any(k.startswith("queue:") for k in summary):
+        print("   queue: rows are waits for a stage worker; percentiles are histogram bucket estimates")
+
+
+def _option(args, flag, default=None):
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 < len(args):
+            return args[i + 1]
+    return default
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--help" in args or "-h" in args:
+        print(__doc__)
+        sys.exit(0)
+
+    real = [s for s in (_option(args, "--real", "") or "").split(",") if s]
+    speed = float(_option(args, "--speed", 1))
+    if real and speed != 1:
+        print("⚠️ Real backends run on the wall clock; replaying at --speed 1")
+        speed = 1.0
+    latencies = {
+        stage: float(_option(args, f"--{stage.replace('_', '-')}-ms")) / 1000
+        for stage in DEFAULT_LATENCIES if _option(args, f"--{stage.replace('_', '-')}-ms")
+    }
+    threshold = float(_option(args, "--threshold", ENERGY_THRESHOLD))
+
+    recordings = [Recording(p, threshold) for p in sorted(glob.glob(os.path.join(AUDIO_DIR, "command_*.wav")))]
+    responses = sorted(glob.glob(os.path.join(AUDIO_DIR, "response_*.mp3")))
+    if not recordings or not responses:
+        print(f"⚠️ Need command_*.wav and response_*.mp3 files in {AUDIO_DIR}")
+        sys.exit(1)
+    print(f"🎙️ {len(recordings)} recordings ({sum(r.speech_end is None for r in recordings)} silent), "
+          f"{len(responses)} response clips, speed x{speed:g}")
+
+    backends = ReplayBackends(
+        responses, speed=speed, latencies=latencies,
+        jitter=float(_option(args, "--jitter", JITTER)),
+        endpoint=float(_option(args, "--endpoint", PAUSE_THRESHOLD)),
+        action_rate=float(_option(args, "--action-rate", 0.0)),
+        seed=int(_option(args, "--seed", 7)), real=real,
+    )
+    turns = int(_option(args, "--turns", 0)) or None
+    start = time.perf_counter()
+    results = asyncio.run(replay(recordings, backends, turns=turns,
+                                 concurrency=int(_option(args, "--concurrency", 1)),
+                                 stream="--stream" in args))
+    elapsed = time.perf_counter() - start
+    summary = summarize(results, speed)
+    print_report(summary, results, elapsed)
+
+    out = _option(args, "--json")
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump({"args": args, "summary": summary, "turns": results}, f, indent=2)
+        print(f"💾 Results written to {out}")
@@ -0,0 +1,370 @@
+# semantic_memory.py
+"""
+Local semantic recall over memorized facts and conversation history.
+Texts are embedded on the CPU with a hashed word + character n-gram model
+(no downloads, no GPU) and kept in a NumPy matrix, so a query is a single
+matrix-vector product. Vectors are persisted append-only under memory/ and
+new history rows are embedded incrementally as they are saved.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+    print("⚠️ NumPy not available. Semantic recall disabled.")
+
+import history_store
+import metrics_engine
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEMORY_DIR = os.path.join(BASE_DIR, "memory")
+VECTORS_FILE = os.path.join(MEMORY_DIR, "semantic_vectors.f32")
+META_FILE = os.path.join(MEMORY_DIR, "semantic_meta.jsonl")
+STATE_FILE = os.path.join(MEMORY_DIR, "semantic_state.json")
+
+# Embedding settings - changing them invalidates the persisted vectors
+EMBED_DIM = 512
+CHAR_NGRAMS = (3, 4)
+WORD_WEIGHT = 2.0
+EMBED_VERSION = 2
+
+# Matches below this cosine similarity are treated as noise
+MIN_SCORE = 0.25
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+@functools.lru_cache(maxsize=200000)
+def _hash_feature(feature):
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % EMBED_DIM, 1.0 if (value >> 63) else -1.0
+
+
+metrics_engine.gauge_fn("semantic_feature_cache_hits", lambda: _hash_feature.cache_info().hits)
+metrics_engine.gauge_fn("semantic_feature_cache_misses", lambda: _hash_feature.cache_info().misses)
+
+
+def embed(text):
+    """Hashed bag of words + character n-grams, L2-normalised float32 vector"""
+    vec = np.zeros(EMBED_DIM, dtype=np.float32)
+    words = WORD_RE.findall(text.lower())
+    for word in words:
+        if word in history_store.STOPWORDS:
+            continue
+        idx, sign = _hash_feature("w:" + word)
+        vec[idx] += sign * WORD_WEIGHT
+        padded = f" {word} "
+        for n in CHAR_NGRAMS:
+            for i in range(len(padded) - n + 1):
+                idx, sign = _hash_feature(padded[i:i + n])
+                vec[idx] += sign
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+class SemanticMemory:
+    """Append-only vector store of facts and history turns"""
+
+    def __init__(self, store=None, vectors_file=VECTORS_FILE,
+                 meta_file=META_FILE, state_file=STATE_FILE, persist=True):
+        self.store = store
+        self.vectors_file = vectors_file
+        self.meta_file = meta_file
+        self.state_file = state_file
+        self.persist = persist
+        self.lock = threading.RLock()
+        self._reset()
+        if persist:
+            self._load()
+
+    def _reset(self):
+        self.matrix = np.zeros((0, EMBED_DIM), dtype=np.float32)
+        self.count = 0
+        self.meta = []            # row -> {"kind", "text", "role", "timestamp", "id"}
+        self.fact_texts = set()
+        self.history_id = 0       # Last history row embedded
+
+    # ---- Persistence ----
+    def _load(self):
+        try:
+            if not os.path.exists(self.state_file):
+                return
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") != EMBED_VERSION or state.get("dim") != EMBED_DIM:
+                print("🔄 Embedding settings changed, rebuilding semantic memory...")
+                self._clear_files()
+                return
+
+            meta = []
+            if os.path.exists(self.meta_file):
+                with open(self.meta_file, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.endswith("\n"):
+                            meta.append(json.loads(line))
+            vectors = np.fromfile(self.vectors_file, dtype=np.float32) if os.path.exists(self.vectors_file) else np.zeros(0, dtype=np.float32)
+            rows = min(len(meta), len(vectors) // EMBED_DIM)
+            # A crash between the two appends leaves them out of step - keep the common prefix
+            self._grow(rows)
+            self.matrix[:rows] = vectors[:rows * EMBED_DIM].reshape(rows, EMBED_DIM)
+            self.count = rows
+            self.meta = meta[:rows]
+            if rows != len(meta) or rows * EMBED_DIM != len(vectors):
+                self._rewrite_files()
+
+            # The state file is written last, so trust whichever records more progress
+            self.history_id = state.get("history_id", 0)
+            for item in self.meta:
+                if item["kind"] == "fact":
+                    self.fact_texts.add(item["text"])
+                elif item["kind"] == "history":
+                    self.history_id = max(self.history_id, item["id"])
+        except Exception as e:
+            print(f"⚠️ Semantic memory unreadable, rebuilding: {e}")
+            self._reset()
+            self._clear_files()
+
+    def _write_state(self):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": EMBED_VERSION,
+                "dim": EMBED_DIM,
+                "history_id": self.history_id,
+            }, f)
+        os.replace(tmp, self.state_file)
+
+    def _clear_files(self):
+        for path in (self.vectors_file, self.meta_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self._write_state()
+
+    def _rewrite_files(self):
+        self.matrix[:self.count].tofile(self.vectors_file)
+        with open(self.meta_file, "w", encoding="utf-8") as f:
+            for item in self.meta:
+                f.write(json.dumps(item) + "\n")
+
+    def _append_files(self, vectors, items):
+        os.makedirs(os.path.dirname(self.vectors_file), exist_ok=True)
+        with open(self.vectors_file, "ab") as f:
+            vectors.tofile(f)
+        with open(self.meta_file, "a", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item) + "\n")
+        self._write_state()
+
+    # ---- Adding ----
+    def _grow(self, needed):
+        if needed <= len(self.matrix):
+            return
+        capacity = max(needed, len(self.matrix) * 2, 256)
+        grown = np.zeros((capacity, EMBED_DIM), dtype=np.float32)
+        grown[:self.count] = self.matrix[:self.count]
+        self.matrix = grown
+
+    def _add(self, items):
+        if not items:
+            return 0
+        vectors = np.stack([embed(item["text"]) for item in items])
+        self._grow(self.count + len(items))
+        self.matrix[self.count:self.count + len(items)] = vectors
+        self.count += len(items)
+        self.meta.extend(items)
+        if self.persist:
+            self._append_files(vectors, items)
+        return len(items)
+
+    def add_facts(self, facts):
+        """Embed any facts not seen before"""
+        with self.lock:
+            items = []
+            for fact in facts:
+                if fact and fact not in self.fact_texts:
+                    self.fact_texts.add(fact)
+                    items.append({"kind": "fact", "text": fact})
+            return self._add(items)
+
+    def add_history_entries(self, entries):
+        """Embed history entries (dicts with id, role, text, timestamp)"""
+        items = []
+        for entry in entries:
+            text = (entry.get("text") or "").strip()
+            if text and entry.get("role") in ("user", "jarvis", "assistant"):
+                items.append({
+                    "kind": "history",
+                    "text": text,
+                    "role": entry.get("role"),
+                    "timestamp": entry.get("timestamp", ""),
+                    "id": entry.get("id", 0),
+                })
+        with self.lock:
+            return self._add(items)
+
+    def refresh(self):
+        """Embed history rows saved since the last refresh"""
+        with self.lock:
+            store = self.store or history_store.get_store()
+            last_id = store.last_id()
+            if last_id < self.history_id:
+                print("🔄 History database changed, rebuilding semantic memory...")
+                facts = [item["text"] for item in self.meta if item["kind"] == "fact"]
+                self._reset()
+                if self.persist:
+                    self._clear_files()
+                self.add_facts(facts)
+
+            added = 0
+            while self.history_id < last_id:
+                entries = store.entries_after(self.history_id, limit=2000)
+                if not entries:
+                    break
+                self.history_id = entries[-1]["id"]
+                added += self.add_history_entries(entries)
+            if not added and self.persist and self.history_id == last_id:
+                self._write_state()  # Only skipped rows - still record the progress
+            return added
+
+    # ---- Querying ----
+    def recall(self, query, k=5, kind=None, min_score=MIN_SCORE):
+        """Return up to k (score, meta) pairs by cosine similarity"""
+        with self.lock:
+            if not self.count or not query.strip():
+                return []
+            scores = self.matrix[:self.count] @ embed(query)
+            if kind:
+                mask = np.fromiter((item["kind"] == kind for item in self.meta), dtype=bool, count=self.count)
+                scores = np.where(mask, scores, -1.0)
+
+            fetch = min(self.count, k * 3)
+            top = np.argpartition(-scores, fetch - 1)[:fetch]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            seen = set()
+            for row in top:
+                score = float(scores[row])
+                if score < min_score:
+                    break
+                item = self.meta[row]
+                key = item["text"].lower()
+                if key in seen:
+                    continue
+                seen.add(key)
+                results.append((score, item))
+                if len(results) >= k:
+                    break
+            return results
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def get_memory():
+    """Shared semantic memory for the default history store (None without NumPy)"""
+    global _memory
+    if np is None:
+        return None
+    with _memory_lock:
+        if _memory is None:
+            _memory = SemanticMemory()
+        return _memory
+
+
+def refresh():
+    memory = get_memory()
+    return memory.refresh() if memory else 0
+
+
+def recall(query, k=5, kind=None):
+    memory = get_memory()
+    if not memory:
+        return []
+    memory.refresh()
+    return memory.recall(query, k=k, kind=kind)
+
+
+# ---- Benchmark ----
+def _perturb(text, rng):
+    """Paraphrase stand-in: drop a third of the words and swap letters in one"""
+    words = text.split()
+    kept = [w for w in words if rng.random() > 0.33] or words[:1]
+    i = rng.randrange(len(kept))
+    w = kept[i]
+    if len(w) > 3:
+        j = rng.randrange(len(w) - 1)
+        kept[i] = w[:j] + w[j + 1] + w[j] + w[j + 2:]
+    return " ".join(kept)
+
+
+def benchmark(k=5, seed=7):
+    """
+    Recall@k and latency on the real conversation history.
+    Each user turn is queried with a perturbed copy of itself; a hit means the
+    original turn comes back in the top k. FTS5 BM25 is measured on the same queries.
+    """
+    import random
+
+    history = history_store.get_store()
+
+    # Build into a throwaway matrix so the live vectors are untouched
+    store = SemanticMemory(store=history, persist=False)
+    start = time.perf_counter()
+    store.refresh()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    rng = random.Random(seed)
+    targets = sorted({item["text"] for item in store.meta if item["role"] == "user" and len(item["text"].split()) >= 3})
+    semantic_hits = bm25_hits = 0
+    semantic_times, bm25_times = [], []
+    for text in targets:
+        query = _perturb(text, rng)
+
+        start = time.perf_counter()
+        found = store.recall(query, k=k, min_score=-1.0)
+        semantic_times.append((time.perf_counter() - start) * 1000)
+        semantic_hits += any(item["text"] == text for _, item in found)
+
+        start = time.perf_counter()
+        found = history.search(query, limit=k)
+        bm25_times.append((time.perf_counter() - start) * 1000)
+        bm25_hits += any(entry.get("text") == text for _, entry in found)
+
+    def pct(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+    total = len(targets) or 1
+    print(f"📚 {history.count()} history rows, {store.count} turns embedded in {build_ms:.1f} ms")
+    print(f"🔍 {len(targets)} perturbed user queries, recall@{k}:")
+    print(f"   Semantic: {semantic_hits / total:.1%}  p50 {pct(semantic_times, 0.5):.2f} ms  p95 {pct(semantic_times, 0.95):.2f} ms")
+    print(f"   BM25:     {bm25_hits / total:.1%}  p50 {pct(bm25_times, 0.5):.2f} ms  p95 {pct(bm25_times, 0.95):.2f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if np is None:
+        sys.exit(1)
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        query = " ".join(sys.argv[1:]) or "where do I live"
+        start = time.perf_counter()
+        hits = recall(query)
+        print(f"🔍 '{query}': {len(hits)} hits in {(time.perf_counter() - start) * 1000:.2f} ms")
+        for score, item in hits:
+            print(f"   {score:.2f} [{item['kind']}] {item['text'][:80]}")
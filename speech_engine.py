@@ -1,6 +1,7 @@
 # speech_engine.py
 import os
 import platform
+import time
 import pyaudio
 import wave
 import speech_recognition as sr
@@ -14,6 +15,9 @@ from google.cloud import speech, texttospeech
 from google.oauth2 import service_account
 import config
 import requests
+import metrics_engine
+import trace_engine
+from turn_pipeline import cancel_requested
 
 # Initialize Google Cloud credentials
 credentials = service_account.Credentials.from_service_account_file(config.GOOGLE_KEY_PATH)
@@ -144,73 +148,185 @@ def tts_speak(text, filename="response.mp3"):
     }
     
     for provider in config.TTS_FALLBACK_ORDER:
+        if cancel_requested():
+            return None  # The turn was superseded; don't try the next provider
         if provider in provider_map:
             print(f"🗣 Attempting TTS with {provider.capitalize()}...")
-            result = provider_map[provider](text, filename)
+            with trace_engine.span(f"tts.{provider}") as span:
+                result = metrics_engine.call_provider("tts", provider, provider_map[provider], text, filename)
+                span["ok"] = bool(result)
             if result:
                 return result
                 
     print("⚠️ All TTS providers failed.")
     return None
 
+# ---- Streaming TTS (audio sent to clients, no files) ----
+STREAM_CHUNK_BYTES = 4096
+
+def stream_elevenlabs(text):
+    """Yield MP3 chunks from ElevenLabs' streaming endpoint as they arrive"""
+    if config.ELEVEN_LABS_API_KEY == "YOUR_ELEVEN_LABS_API_KEY": return
+    url = "https://api.elevenlabs.io/v1/text-to-speech/nPczCjzI2devNBz1zQrb/stream"  # Brian voice
+    headers = {
+        "Accept": "audio/mpeg",
+        "Content-Type": "application/json",
+        "xi-api-key": config.ELEVEN_LABS_API_KEY
+    }
+    data = {
+        "text": text,
+        "model_id": "eleven_multilingual_v2",
+        "voice_settings": {
+            "stability": 0.5,
+            "similarity_boost": 0.75
+        }
+    }
+    print("🗣 Streaming ElevenLabs Audio...")
+    with requests.post(url, json=data, headers=headers, timeout=10, stream=True) as response:
+        if response.status_code != 200:
+            print(f"⚠️ ElevenLabs API Error: {response.status_code}")
+            return
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES):
+            if chunk:
+                yield chunk
+
+def stream_google_tts(text):
+    """Google Cloud TTS returns the whole clip at once; yield it in chunks"""
+    response = tts_client.synthesize_speech(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=texttospeech.VoiceSelectionParams(
+            language_code="en-US",
+            ssml_gender=texttospeech.SsmlVoiceGender.MALE
+        ),
+        audio_config=texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3),
+    )
+    audio = response.audio_content
+    for start in range(0, len(audio), STREAM_CHUNK_BYTES):
+        yield audio[start:start + STREAM_CHUNK_BYTES]
+
+def tts_stream(text):
+    """
+    Yield MP3 chunks for text, following config.TTS_FALLBACK_ORDER.
+    A provider that fails before its first chunk falls through to the next one.
+    """
+    provider_map = {
+        'elevenlabs': stream_elevenlabs,
+        'google': stream_google_tts
+    }
+    
+    for provider in config.TTS_FALLBACK_ORDER:
+        if provider in provider_map:
+            print(f"🗣 Attempting TTS stream with {provider.capitalize()}...")
+            metrics_engine.inc("provider_attempts_total", kind="tts_stream", provider=provider)
+            start = time.perf_counter()
+            started = False
+            try:
+                with trace_engine.span(f"tts.stream.{provider}") as span:
+                    for chunk in provider_map[provider](text):
+                        if not started:
+                            metrics_engine.observe("provider_seconds", time.perf_counter() - start, kind="tts_stream", provider=provider)
+                            span["first_chunk_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                        started = True
+                        yield chunk
+            except Exception as e:
+                print(f"⚠️ {provider.capitalize()} TTS stream error: {e}")
+                if started:
+                    return  # Part of the clip already went out; don't start it over
+            if started:
+                return
+            metrics_engine.inc("provider_failures_total", kind="tts_stream", provider=provider)
+    
+    print("⚠️ All TTS providers failed.")
+
 def play_audio_blocking(file_path):
     """
     Play audio and wait until it finishes (Blocking)
     """
     try:
-        pygame.mixer.init()
-        pygame.mixer.music.load(file_path)
-        pygame.mixer.music.play()
-        while pygame.mixer.music.get_busy():
-            pygame.time.Clock().tick(10)
+        with trace_engine.span("playback.load"):
+            pygame.mixer.init()
+            pygame.mixer.music.load(file_path)
+        with trace_engine.span("playback.play"):
+            pygame.mixer.music.play()
+            while pygame.mixer.music.get_busy():
+                if cancel_requested():
+                    pygame.mixer.music.stop()  # A newer command took over
+                    break
+                pygame.time.Clock().tick(10)
     except Exception as e:
         print("⚠️ Could not play audio:", e)
 
-def listen_for_command():
+def capture_command():
     """
-    Listen for a command using SpeechRecognition (VAD)
-    Returns text directly. Falls back to Google Cloud STT if standard fails.
+    Capture one spoken command from the microphone (VAD: stops on silence).
+    Returns the recorded sr.AudioData, or None if nobody spoke.
     """
     recognizer = sr.Recognizer()
     with sr.Microphone() as source:
         print("🎤 Listening...")
-        recognizer.adjust_for_ambient_noise(source)
+        with trace_engine.span("stt.calibrate"):
+            recognizer.adjust_for_ambient_noise(source)
         try:
             # Listen indefinitely until silence is detected
-            audio = recognizer.listen(source, timeout=10, phrase_time_limit=None) 
-            print("⏳ Processing...")
-            
-            try:
-                # Primary: Standard Google Speech API (Free)
-                text = recognizer.recognize_google(audio)
-                return text
-            except Exception as e:
-                print(f"⚠️ Standard STT failed: {e}. Trying Google Cloud STT...")
-                
-                # Fallback: Google Cloud Speech-to-Text (Paid/Credentials)
-                try:
-                    content = audio.get_wav_data()
-                    audio_req = speech.RecognitionAudio(content=content)
-                    config_req = speech.RecognitionConfig(
-                        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                        sample_rate_hertz=config.SAMPLE_RATE,
-                        language_code="en-US",
-                    )
-                    response = speech_client.recognize(config=config_req, audio=audio_req)
-                    
-                    if response.results:
-                        text = response.results[0].alternatives[0].transcript
-                        print(f"✅ Google Cloud STT Success: {text}")
-                        return text
-                    return None
-                except Exception as e2:
-                    print(f"⚠️ Google Cloud STT failed: {e2}")
-                    return None
-                    
+            with trace_engine.span("stt.listen"):
+                return recognizer.listen(source, timeout=10, phrase_time_limit=None)
         except sr.WaitTimeoutError:
             return None
-        except sr.UnknownValueError:
-            return None
         except Exception as e:
             print(f"⚠️ Error listening: {e}")
-            return None
\ No newline at end of file
+            return None
+
+def transcribe(audio):
+    """
+    Speech-to-text for captured audio. Falls back to Google Cloud STT if standard fails.
+    """
+    if audio is None:
+        return None
+    print("⏳ Processing...")
+    recognizer = sr.Recognizer()
+    try:
+        # Primary: Standard Google Speech API (Free)
+        with trace_engine.span("stt.google"):
+            return metrics_engine.call_provider("stt", "google", recognizer.recognize_google, audio)
+    except Exception as e:
+        print(f"⚠️ Standard STT failed: {e}. Trying Google Cloud STT...")
+        
+    # Fallback: Google Cloud Speech-to-Text (Paid/Credentials)
+    try:
+        with trace_engine.span("stt.google_cloud"):
+            return metrics_engine.call_provider("stt", "google_cloud", _transcribe_cloud, audio)
+    except Exception as e2:
+        print(f"⚠️ Google Cloud STT failed: {e2}")
+        return None
+
+def _transcribe_cloud(audio):
+    """Google Cloud STT for captured audio; None if nothing was recognized"""
+    content = audio.get_wav_data()
+    audio_req = speech.RecognitionAudio(content=content)
+    config_req = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=audio.sample_rate,  # Browser audio isn't at config.SAMPLE_RATE
+        language_code="en-US",
+    )
+    response = speech_client.recognize(config=config_req, audio=audio_req)
+    
+    if response.results:
+        text = response.results[0].alternatives[0].transcript
+        print(f"✅ Google Cloud STT Success: {text}")
+        return text
+    return None
+
+def transcribe_pcm(pcm, sample_rate):
+    """
+    Speech-to-text for raw 16-bit mono PCM (audio streamed from a browser client).
+    """
+    if not pcm:
+        return None
+    return transcribe(sr.AudioData(pcm, sample_rate, 2))
+
+def listen_for_command():
+    """
+    Listen for a command using SpeechRecognition (VAD)
+    Returns text directly. Falls back to Google Cloud STT if standard fails.
+    """
+    return transcribe(capture_command())
@@ -0,0 +1,124 @@
+# summary_engine.py
+"""
+Rolling summary of a conversation session.
+The AI prompt only carries the last few exchanges verbatim. When older turns
+fall out of that window they are folded into a running summary, and when the
+session ends a compact digest is stored so memory_context can bring it back
+in later sessions. All summarization runs on one background thread using
+the cheapest configured provider, so it never delays a reply.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import history_store
+
+# Verbatim exchanges kept in the prompt (matches format_session_history)
+WINDOW_EXCHANGES = 5
+
+# Upper bound on the running summary, in characters
+MAX_SUMMARY_CHARS = 1200
+
+SUMMARY_SYSTEM_PROMPT = """
+You maintain a running summary of a conversation between a user and their assistant, Jarvis.
+Write plain sentences, no headings or bullet points, under 120 words.
+Keep names, decisions, requests, preferences, facts learned and anything left unresolved.
+Drop greetings, filler and wording details. Output only the summary.
+"""
+
+DIGEST_SYSTEM_PROMPT = """
+Write a compact digest of a finished conversation between a user and their assistant, Jarvis,
+to be recalled in future conversations. One or two plain sentences, under 60 words.
+Mention the topics, what was done and any facts about the user. Output only the digest.
+"""
+
+# False: always use the extractive fallback (load tests, no provider calls)
+USE_PROVIDERS = True
+
+# One worker: folds for a session must apply in order, and summaries are low priority
+SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+
+def _format_turns(turns):
+    return "\n".join(f"{role}: {text}" for role, text in turns)
+
+
+def _query(prompt, system_prompt):
+    if not USE_PROVIDERS:
+        return None
+    try:
+        # Imported lazily: ai_engine pulls in the provider SDKs
+        from ai_engine import query_cheapest
+        return query_cheapest(prompt, system_prompt)
+    except Exception as e:
+        print(f"⚠️ Summary provider error: {e}")
+        return None
+
+
+def _fallback_summary(summary, turns):
+    """Extractive stand-in when no provider answers: keep what the user asked"""
+    asked = [text.strip() for role, text in turns if role.lower() == "user"]
+    addition = "User asked: " + "; ".join(asked) + "." if asked else ""
+    return f"{summary} {addition}".strip()
+
+
+class SessionSummarizer:
+    """Running summary for one conversation session"""
+
+    def __init__(self, session_id, window_exchanges=WINDOW_EXCHANGES):
+        self.session_id = session_id
+        self.window = window_exchanges * 2  # (role, text) entries kept verbatim
+        self.summary = ""
+        self.folded = 0  # Entries of session_history already folded into the summary
+
+    def update(self, session_history):
+        """Fold any turns that just left the verbatim window (in the background)"""
+        aged_end = len(session_history) - self.window
+        if aged_end <= self.folded:
+            return
+        aged = list(session_history[self.folded:aged_end])
+        self.folded = aged_end
+        SUMMARY_EXECUTOR.submit(self._fold, aged)
+
+    def _fold(self, turns):
+        prompt = (
+            f"Summary so far:\n{self.summary or '(empty)'}\n\n"
+            f"Older turns to fold in:\n{_format_turns(turns)}\n\n"
+            f"Updated summary:"
+        )
+        summary = _query(prompt, SUMMARY_SYSTEM_PROMPT) or _fallback_summary(self.summary, turns)
+        self.summary = summary.strip()[-MAX_SUMMARY_CHARS:]
+
+    def finish(self, session_history, started=""):
+        """Store a digest of the whole session (in the background)"""
+        if not session_history:
+            return None
+        remaining = list(session_history[self.folded:])
+        return SUMMARY_EXECUTOR.submit(self._store_digest, remaining, started)
+
+    def _store_digest(self, remaining, started):
+        prompt = (
+            f"Summary of earlier turns:\n{self.summary or '(none)'}\n\n"
+            f"Final turns:\n{_format_turns(remaining)}\n\n"
+            f"Digest:"
+        )
+        digest = _query(prompt, DIGEST_SYSTEM_PROMPT) or _fallback_summary(self.summary, remaining)
+        digest = digest.strip()[:MAX_SUMMARY_CHARS]
+        try:
+            history_store.get_store().save_digest(
+                self.session_id, digest, started=started or self.session_id,
+                ended=time.strftime("%Y%m%d-%H%M%S")
+            )
+            print(f"🗜️ Session digest saved ({len(digest)} chars)")
+        except Exception as e:
+            print(f"❌ Error saving session digest: {e}")
+        return digest
+
+
+def relevant_digests(query, limit=2):
+    """Digests of past sessions related to the query"""
+    try:
+        return [d["digest"] for d in history_store.get_store().search_digests(query, limit)]
+    except Exception as e:
+        print(f"Error searching session digests: {e}")
+        return []
@@ -0,0 +1,460 @@
+# sync_engine.py
+"""
+Delta sync of history, session transcripts, profile.json and memory.json
+between machines running Jarvis.
+
+Every collection is a set of record hashes. Peers compare a hash tree keyed
+by hex prefix (XOR + count per prefix) from the root down, only descending
+into prefixes that differ, then exchange just the records the other side is
+missing. When nothing changed a sync is one round trip per collection.
+
+Profile keys and facts are last-writer-wins registers: local edits are
+stamped with the file's modification time when a sync notices them, and the
+newer stamp wins on both sides (ties go to the machine name), so peers
+converge. Clocks should be roughly in sync for edits on both sides to
+resolve the way you expect.
+
+    python sync_engine.py serve [--port 8770] [--dir PATH] [--token TOKEN]
+    python sync_engine.py sync http://other-machine:8770 [--dir PATH] [--token TOKEN]
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import history_archive
+import history_store
+
+try:
+    import config
+except ImportError:
+    config = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SYNC_PORT = 8770
+SYNC_PATH = "/sync"
+HEX = "0123456789abcdef"
+
+# Tree walk: a differing prefix holding at most LEAF_SIZE records (or at
+# MAX_DEPTH) is listed outright instead of being split further
+LEAF_SIZE = 64
+MAX_DEPTH = 5
+
+# Records per fetch/push request
+TRANSFER_BATCH = 500
+REQUEST_TIMEOUT = 30
+
+
+def record_hash(record):
+    data = json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def digests(hashes, prefixes):
+    """(xor, count) of the hashes under each prefix; order-independent"""
+    wanted = {p: [0, 0] for p in prefixes}
+    lengths = sorted({len(p) for p in prefixes})
+    for h in hashes:
+        for n in lengths:
+            node = wanted.get(h[:n])
+            if node is not None:
+                node[0] ^= int(h, 16)
+                node[1] += 1
+    return {p: [format(x, "x"), c] for p, (x, c) in wanted.items()}
+
+
+def under(hashes, prefixes):
+    prefixes = tuple(prefixes)
+    return {h for h in hashes if h.startswith(prefixes)} if prefixes else set()
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path), suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"⚠️ Could not read {path}: {e}")
+        return default
+
+
+# ---- Collections ----
+class HistoryCollection:
+    """Conversation history rows, identified by content hash"""
+
+    name = "history"
+
+    def __init__(self, store):
+        self.store = store
+
+    def hashes(self):
+        self.store.backfill_hashes()
+        return self.store.content_hashes()
+
+    def records(self, hashes):
+        return [
+            {k: e[k] for k in ("hash", "role", "text", "timestamp", "session") if k in e}
+            for e in self.store.entries_for_hashes(hashes)
+        ]
+
+    def apply(self, records):
+        return self.store.append_many(records, source="sync", dedupe=True)
+
+
+class SessionCollection:
+    """Session transcripts in memory/sessions, identified by name + content"""
+
+    name = "sessions"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _files(self):
+        files = {}
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if os.path.isfile(path) and name.endswith(".txt"):
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        text = f.read()
+                    files[record_hash({"name": name, "text": text})] = (name, text)
+        return files
+
+    def hashes(self):
+        return list(self._files())
+
+    def records(self, hashes):
+        files = self._files()
+        return [{"name": files[h][0], "text": files[h][1]} for h in hashes if h in files]
+
+    def apply(self, records):
+        changed = 0
+        for record in records:
+            name = os.path.basename(record["name"])
+            path = os.path.join(self.directory, name)
+            text = record["text"]
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    current = f.read()
+                # A transcript only grows while its session runs: keep the longer copy
+                if (len(current), current) >= (len(text), text):
+                    continue
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            changed += 1
+        return changed
+
+
+class RegisterCollection:
+    """
+    Last-writer-wins registers mirrored from a JSON file.
+    kind "profile" keys profile.json entries; kind "facts" keys memory.json facts.
+    """
+
+    def __init__(self, node, kind, path):
+        self.node = node
+        self.name = kind
+        self.path = path
+
+    def _current(self):
+        if self.name == "profile":
+            return _read_json(self.path, {})
+        data = _read_json(self.path, {"facts": []})
+        return {fact: True for fact in data.get("facts", []) if isinstance(fact, str)}
+
+    def observe(self):
+        """Stamp local edits made since the last sync"""
+        registers = self.node.state.setdefault(self.name, {})
+        current = self._current()
+        try:
+            stamp = os.path.getmtime(self.path)
+        except OSError:
+            stamp = time.time()
+        changed = False
+        for key, value in current.items():
+            reg = registers.get(key)
+            if reg is None or reg["deleted"] or reg["value"] != value:
+                registers[key] = {"value": value, "modified": stamp, "deleted": False, "machine": self.node.machine}
+                changed = True
+        for key, reg in registers.items():
+            if key not in current and not reg["deleted"]:
+                registers[key] = {"value": None, "modified": stamp, "deleted": True, "machine": self.node.machine}
+                changed = True
+        if changed:
+            self.node.save_state()
+        return registers
+
+    def _records(self):
+        return {
+            record_hash(r): r
+            for r in ({"key": key, **reg} for key, reg in self.observe().items())
+        }
+
+    def hashes(self):
+        return list(self._records())
+
+    def records(self, hashes):
+        records = self._records()
+        return [records[h] for h in hashes if h in records]
+
+    def apply(self, records):
+        registers = self.observe()
+        changed = 0
+        for record in records:
+            key = record["key"]
+            incoming = {k: record[k] for k in ("value", "modified", "deleted", "machine")}
+            local = registers.get(key)
+            if local is None or (incoming["modified"], incoming["machine"]) > (local["modified"], local["machine"]):
+                registers[key] = incoming
+                changed += 1
+        if changed:
+            self._write(registers)
+            self.node.save_state()
+        return changed
+
+    def _write(self, registers):
+        live = {key: reg["value"] for key, reg in registers.items() if not reg["deleted"]}
+        if self.name == "profile":
+            _write_json(self.path, live)
+            return
+        data = _read_json(self.path, {"facts": []})
+        kept = [fact for fact in data.get("facts", []) if fact in live]
+        known = set(kept)
+        added = sorted((key for key in live if key not in known), key=lambda key: registers[key]["modified"])
+        data["facts"] = kept + added
+        _write_json(self.path, data)
+
+
+# ---- Local node ----
+class SyncNode:
+    """The syncable data of one Jarvis directory"""
+
+    def __init__(self, base_dir=BASE_DIR, machine=None):
+        self.base_dir = os.path.abspath(base_dir)
+        self.machine = machine or socket.gethostname()
+        self.lock = threading.RLock()
+        memory_dir = os.path.join(self.base_dir, "memory")
+        if self.base_dir == BASE_DIR:
+            store = history_store.get_store()
+        else:
+            archive = history_archive.HistoryArchive(os.path.join(memory_dir, "archive"))
+            store = history_store.HistoryStore(os.path.join(memory_dir, "history.db"), archive=archive)
+        self.state_file = os.path.join(memory_dir, "sync_state.json")
+        self.state = _read_json(self.state_file, {})
+        self.collections = {
+            c.name: c for c in (
+                HistoryCollection(store),
+                SessionCollection(os.path.join(memory_dir, "sessions")),
+                RegisterCollection(self, "profile", os.path.join(self.base_dir, "profile.json")),
+                RegisterCollection(self, "facts", os.path.join(self.base_dir, "memory.json")),
+            )
+        }
+
+    def save_state(self):
+        _write_json(self.state_file, self.state)
+
+    def handle(self, request):
+        """Serve one protocol operation"""
+        with self.lock:
+            collection = self.collections[request["collection"]]
+            op = request["op"]
+            if op == "digests":
+                return {"digests": digests(collection.hashes(), request["prefixes"])}
+            if op == "list":
+                return {"hashes": sorted(under(collection.hashes(), request["prefixes"]))}
+            if op == "fetch":
+                return {"records": collection.records(request["hashes"])}
+            if op == "push":
+                return {"applied": collection.apply(request["records"])}
+            raise ValueError(f"Unknown sync operation: {op}")
+
+
+# ---- Transport ----
+def _token(token=None):
+    return token or os.environ.get("JARVIS_SYNC_TOKEN") or getattr(config, "SYNC_TOKEN", None)
+
+
+class Peer:
+    """Client side of the protocol over HTTP (gzip-compressed JSON)"""
+
+    def __init__(self, url, token=None):
+        self.url = url.rstrip("/") + SYNC_PATH
+        self.token = _token(token)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def call(self, op, collection, **payload):
+        body = gzip.compress(json.dumps({"op": op, "collection": collection, **payload}).encode("utf-8"))
+        request = urllib.request.Request(self.url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "Authorization": f"Bearer {self.token or ''}",
+        })
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            data = response.read()
+        self.requests += 1
+        self.bytes_sent += len(body)
+        self.bytes_received += len(data)
+        return json.loads(gzip.decompress(data))
+
+
+def make_handler(node, token):
+    class SyncHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != SYNC_PATH:
+                self.send_error(404)
+                return
+            supplied = self.headers.get("Authorization", "").encode("utf-8")
+            if token and not hmac.compare_digest(supplied, f"Bearer {token}".encode("utf-8")):
+                self.send_error(401)
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(gzip.decompress(self.rfile.read(length)))
+                body = gzip.compress(json.dumps(node.handle(request)).encode("utf-8"))
+            except Exception as e:
+                print(f"❌ Sync request failed: {e}")
+                self.send_error(400, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Quiet; sync() prints a summary on the client side
+
+    return SyncHandler
+
+
+def serve(node=None, host="0.0.0.0", port=SYNC_PORT, token=None):
+    """Serve this machine's data to peers until interrupted"""
+    node = node or SyncNode()
+    token = _token(token)
+    if not token and host not in ("127.0.0.1", "localhost", "::1"):
+        print("❌ Refusing to serve on the network without a token (set SYNC_TOKEN in config.py or JARVIS_SYNC_TOKEN)")
+        return
+    server = ThreadingHTTPServer((host, port), make_handler(node, token))
+    print(f"🔄 Sync server for {node.base_dir} on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# ---- Client ----
+def _diff_prefixes(peer, name, local_hashes):
+    """Walk both hash trees from the root; return prefixes whose contents differ"""
+    leaves = []
+    frontier = [""]
+    while frontier:
+        remote = peer.call("digests", name, prefixes=frontier)["digests"]
+        local = digests(local_hashes, frontier)
+        next_frontier = []
+        for prefix in frontier:
+            if remote[prefix] == local[prefix]:
+                continue
+            if max(remote[prefix][1], local[prefix][1]) <= LEAF_SIZE or len(prefix) >= MAX_DEPTH:
+                leaves.append(prefix)
+            else:
+                next_frontier.extend(prefix + c for c in HEX)
+        frontier = next_frontier
+    return leaves
+
+
+def sync_collection(node, peer, name):
+    """Two-way sync of one collection; returns (received, sent)"""
+    collection = node.collections[name]
+    with node.lock:
+        local_hashes = set(collection.hashes())
+    leaves = _diff_prefixes(peer, name, local_hashes)
+    if not leaves:
+        return 0, 0
+
+    remote_hashes = set(peer.call("list", name, prefixes=leaves)["hashes"])
+    local_under = under(local_hashes, leaves)
+    need = sorted(remote_hashes - local_under)
+    give = sorted(local_under - remote_hashes)
+
+    received = sent = 0
+    for i in range(0, len(need), TRANSFER_BATCH):
+        records = peer.call("fetch", name, hashes=need[i:i + TRANSFER_BATCH])["records"]
+        with node.lock:
+            collection.apply(records)
+        received += len(records)
+    for i in range(0, len(give), TRANSFER_BATCH):
+        with node.lock:
+            records = collection.records(give[i:i + TRANSFER_BATCH])
+        peer.call("push", name, records=records)
+        sent += len(records)
+    return received, sent
+
+
+def sync(url, node=None, token=None):
+    """Sync every collection with the peer at url"""
+    node = node or SyncNode()
+    peer = Peer(url, token)
+    start = time.perf_counter()
+    totals = {}
+    for name in node.collections:
+        try:
+            totals[name] = sync_collection(node, peer, name)
+        except Exception as e:
+            print(f"❌ Sync of {name} failed: {e}")
+    elapsed = (time.perf_counter() - start) * 1000
+    summary = ", ".join(f"{name} ↓{r} ↑{s}" for name, (r, s) in totals.items())
+    print(f"🔄 Synced with {url}: {summary} "
+          f"({peer.requests} requests, {(peer.bytes_sent + peer.bytes_received) / 1024:.1f} KB, {elapsed:.0f} ms)")
+    return totals
+
+
+def _option(args, flag, default=None):
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 < len(args):
+            return args[i + 1]
+    return default
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    base_dir = _option(args, "--dir", BASE_DIR)
+    token = _option(args, "--token")
+    if args and args[0] == "serve":
+        serve(SyncNode(base_dir), host=_option(args, "--host", "0.0.0.0"),
+              port=int(_option(args, "--port", SYNC_PORT)), token=token)
+    elif len(args) >= 2 and args[0] == "sync":
+        sync(args[1], SyncNode(base_dir), token=token)
+    else:
+        print(__doc__)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Tests for command_scheduler: per-session command queues and shared turn slots (run with pytest)"""
+
+import asyncio
+
+import command_scheduler
+from command_scheduler import Command, CommandQueue, TurnSlots
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_identical_commands_are_coalesced():
+    async def main():
+        queue = CommandQueue()
+        assert queue.put(Command('typed', "Open Spotify")) == []
+        assert queue.put(Command('typed', "open   spotify")) is None
+        running = await queue.get()
+        assert queue.put(Command('typed', "OPEN SPOTIFY")) is None  # Same as the running one
+        running.cancel()
+        assert queue.put(Command('typed', "open spotify")) is not None  # A cancelled one doesn't count
+        assert queue.qsize() == 1
+        # Utterances have no text to compare
+        assert queue.put(Command('voice', audio=(b"", 16000))) is not None
+        assert queue.put(Command('voice', audio=(b"", 16000))) is not None
+    _run(main())
+
+
+def test_new_command_supersedes_same_or_lower_priority():
+    async def main():
+        queue = CommandQueue()
+        queue.put(Command('voice', audio=(b"", 16000)))
+        running = await queue.get()
+        running.task = asyncio.ensure_future(asyncio.sleep(10))
+        waiting = Command('typed', "play music")
+        assert queue.put(waiting) == []  # Lower priority never cuts off higher priority
+
+        superseded = queue.put(Command('voice', audio=(b"", 16000)))
+        assert set(superseded) == {running, waiting}
+        assert running.cancelled.is_set() and waiting.cancelled.is_set()
+        await asyncio.sleep(0)
+        assert running.task.cancelled()
+        assert queue.qsize() == 1
+
+        # An already cancelled running command isn't superseded again
+        (voice,) = queue._heap
+        assert queue.put(Command('system', "stop")) == [voice]
+        queue.done(running)
+        assert (await queue.get()).kind == 'system'
+    _run(main())
+
+
+def test_commands_are_served_by_priority_then_arrival(monkeypatch):
+    monkeypatch.setattr(command_scheduler, 'SUPERSEDE', False)
+
+    async def main():
+        queue = CommandQueue()
+        for kind, text in [('typed', "a"), ('voice', None), ('typed', "b"), ('system', "stop")]:
+            queue.put(Command(kind, text, (b"", 16000) if text is None else None))
+        order = []
+        for _ in range(4):
+            command = await queue.get()
+            order.append(command.text or command.kind)
+            queue.done(command)
+        assert order == ["stop", "voice", "a", "b"]
+    _run(main())
+
+
+def test_cancel_all_drops_waiting_and_cancels_running():
+    async def main():
+        queue = CommandQueue()
+        queue.put(Command('system', "one"))
+        running = await queue.get()
+        queue.put(Command('typed', "two"))
+        cancelled = queue.cancel_all()
+        assert len(cancelled) == 2 and all(c.cancelled.is_set() for c in cancelled)
+        assert queue.qsize() == 0
+        assert queue.cancel_all() == []  # The running one is already cancelled
+        assert queue.running is running
+    _run(main())
+
+
+async def _hold(slots, priority, order, release):
+    async with slots.slot(priority):
+        order.append(priority)
+        await release.wait()
+
+
+def test_turn_slots_go_to_the_highest_priority_waiter():
+    async def main():
+        slots = TurnSlots(1)
+        order, release = [], asyncio.Event()
+        holder = asyncio.ensure_future(_hold(slots, 2, order, release))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(_hold(slots, p, order, release)) for p in (2, 1, 0)]
+        await asyncio.sleep(0)
+        assert slots.waiting() == 3
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        assert order == [2, 0, 1, 2]
+        assert slots.free == 1
+    _run(main())
+
+
+def test_cancelled_waiter_hands_its_slot_on():
+    async def main():
+        slots = TurnSlots(1)
+        order, release = [], asyncio.Event()
+        holder_release = asyncio.Event()
+        holder = asyncio.ensure_future(_hold(slots, 2, order, holder_release))
+        await asyncio.sleep(0)
+        first = asyncio.ensure_future(_hold(slots, 0, order, release))
+        second = asyncio.ensure_future(_hold(slots, 1, order, release))
+        await asyncio.sleep(0)
+
+        # The holder's release hands the slot to `first`, which is cancelled before it runs
+        holder_release.set()
+        await asyncio.sleep(0)
+        assert holder.done() and not first.done()
+        first.cancel()
+        release.set()
+        # A lost slot would leave `second` waiting forever
+        await asyncio.wait_for(asyncio.gather(first, second, return_exceptions=True), 2)
+        assert first.cancelled()
+        assert order == [2, 1]
+        assert slots.free == 1 and slots.waiting() == 0
+
+        # Cancelled while still waiting: skipped, the slot count stays right
+        release.clear()
+        holder = asyncio.ensure_future(_hold(slots, 2, order, release))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(_hold(slots, 0, order, release))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await asyncio.gather(holder, waiter, return_exceptions=True)
+        assert slots.free == 1 and slots.waiting() == 0
+    _run(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Tests for fact_store: duplicate detection, ranking and selection of memorized facts (run with pytest)"""
+
+import time
+
+import pytest
+
+import fact_store
+import history_store
+import memory_engine
+
+needs_numpy = pytest.mark.skipif(fact_store.np is None, reason="numpy not installed")
+
+STUDIES = "User studies computer science at the University of Regina"
+STUDIES_MORE = "User studies computer science at the University of Regina, Canada"
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    # Stats writes run inline so the database can be checked straight away
+    monkeypatch.setattr(fact_store.background_writer, "run", lambda func, *args: func(*args))
+    return history_store.HistoryStore(str(tmp_path / "history.db"))
+
+
+@pytest.fixture
+def facts(history):
+    return fact_store.FactStore(history)
+
+
+@needs_numpy
+def test_new_facts_are_classified_against_existing_ones(facts):
+    facts.sync(["User likes green tea", STUDIES])
+    assert facts.classify("user likes green tea!") == ("duplicate", "User likes green tea")
+    assert facts.classify(STUDIES_MORE) == ("reword", STUDIES)
+    assert facts.classify(STUDIES[:-6] + "Regina") == ("duplicate", STUDIES)
+    assert facts.classify("User owns a red bicycle") == ("new", None)
+
+
+def test_selection_ranks_by_relevance_within_budget(facts, history):
+    stored = [f"Filler fact number {i} about nothing" for i in range(40)] + [
+        "User's sister is called Maya",
+        "User's favourite food is sushi",
+    ]
+    facts.sync(stored)
+    chosen = facts.select("what food do I like", limit=3)
+    assert chosen[0] == "User's favourite food is sushi"
+    assert len(chosen) == 3
+
+    assert len("".join(facts.select("anything", limit=10, budget=80))) <= 80
+    # Only relevant picks count as used
+    stats = history.fact_stats()
+    assert stats["User's favourite food is sushi"][1] == 1
+    assert stats["User's sister is called Maya"][1] == 0
+
+
+def test_recent_use_breaks_ties(facts, history):
+    year_ago = time.time() - 365 * 86400
+    history.record_facts(["User walks to work", "User cycles to work"], year_ago)
+    facts.sync(["User walks to work", "User cycles to work"])
+
+    def order():
+        return [fact for _, _, fact in facts.rank("how do I get to work")]
+
+    facts.touch(["User cycles to work"])
+    assert order() == ["User cycles to work", "User walks to work"]
+    facts.touch(["User walks to work"])
+    facts.touch(["User walks to work"])
+    assert order() == ["User walks to work", "User cycles to work"]
+
+
+@needs_numpy
+def test_deduplicate_keeps_the_longest_wording_in_first_place(facts):
+    facts.sync([STUDIES, "User likes green tea", STUDIES_MORE, "user likes green tea."])
+    assert facts.deduplicate() == [STUDIES_MORE, "User likes green tea"]
+
+
+@needs_numpy
+def test_save_memory_folds_restated_facts(tmp_path, history, monkeypatch):
+    store = memory_engine.MemoryStore(str(tmp_path / "profile.json"), str(tmp_path / "memory.json"))
+    monkeypatch.setattr(memory_engine, "store", store)
+    monkeypatch.setattr(fact_store, "_facts", fact_store.FactStore(history))
+
+    memory_engine.save_memory("User likes green tea")
+    memory_engine.save_memory(STUDIES)
+    memory_engine.save_memory("  user likes green tea  ")
+    memory_engine.save_memory(STUDIES_MORE)
+    assert store.memory()["facts"] == ["User likes green tea", STUDIES_MORE]
+
+    stats = history.fact_stats()
+    assert STUDIES not in stats and stats[STUDIES_MORE][1] == 1  # Stats follow the rewording
+    assert stats["User likes green tea"][1] == 1
+    store.flush()
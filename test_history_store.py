@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""Tests for the SQLite history store and its monthly archive (run with pytest)"""
+
+import gzip
+import json
+
+import pytest
+
+import history_archive
+import history_store
+import merge_history
+import sync_engine
+
+# Closed months get archived; the current month stays hot
+OLD_ENTRIES = [
+    {"role": "user", "text": "what's my location", "timestamp": "20250110-120000"},
+    {"role": "jarvis", "text": "You are currently located in Canada.", "timestamp": "20250110-120005"},
+    {"role": "user", "text": "play some music", "timestamp": "20250211-090000"},
+    {"role": "jarvis", "text": "Playing your location playlist.", "timestamp": "20250211-090004"},
+]
+
+
+def _now():
+    return history_archive.month_start(0)[:9] + "120000"
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    archive = history_archive.HistoryArchive(str(tmp_path / "archive"))
+    store = history_store.HistoryStore(str(tmp_path / "history.db"), archive=archive)
+    monkeypatch.setattr(history_store, "_store", store)
+    return store
+
+
+def _write_jsonl(path, entries):
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+    return str(path)
+
+
+def _migrate_and_archive(store, tmp_path):
+    source = _write_jsonl(tmp_path / "history.jsonl", OLD_ENTRIES + [
+        {"role": "user", "text": "good morning", "timestamp": _now()},
+    ])
+    assert store.migrate_jsonl([source]) == len(OLD_ENTRIES) + 1
+    assert store.archive.archive_closed(store, vacuum=False) == len(OLD_ENTRIES)
+    assert store.count() == 1
+    return source
+
+
+def test_merge_after_archive_adds_nothing(store, tmp_path):
+    source = _migrate_and_archive(store, tmp_path)
+    assert merge_history.merge([source], workers=1) == 0
+    assert merge_history.merge([source], workers=1, force=True) == 0
+    assert store.count() == 1
+
+
+def test_sync_after_archive_adds_nothing(store, tmp_path):
+    _migrate_and_archive(store, tmp_path)
+    local = sync_engine.HistoryCollection(store)
+    assert len(local.hashes()) == len(OLD_ENTRIES) + 1
+
+    peer = history_store.HistoryStore(str(tmp_path / "peer.db"))
+    peer.append_many(OLD_ENTRIES, dedupe=True)
+    remote = sync_engine.HistoryCollection(peer)
+    assert set(remote.hashes()) < set(local.hashes())
+    assert local.apply(remote.records(remote.hashes())) == 0
+
+
+def test_segments_archived_without_hashes_are_repaired(store, tmp_path):
+    _migrate_and_archive(store, tmp_path)
+    # As archived before rows were hashed on the way out
+    with store.conn() as conn:
+        conn.execute("DELETE FROM history_hashes")
+    for index in store.archive.segments():
+        del index["hashed"]
+        store.archive._save_index(index)
+
+    store.archive.archive_closed(store, vacuum=False)
+    assert len(store.content_hashes()) == len(OLD_ENTRIES) + 1
+    assert store.append_many(OLD_ENTRIES, dedupe=True) == 0
+
+
+def test_search_covers_archived_months(store, tmp_path):
+    _migrate_and_archive(store, tmp_path)
+    store.append("user", "update my location please", _now())
+
+    hits = store.search("location", limit=5)
+    texts = [entry["text"] for _, entry in hits]
+    assert "what's my location" in texts
+    assert "Playing your location playlist." in texts
+    assert "update my location please" in texts
+    assert [score for score, _ in hits] == sorted((score for score, _ in hits), reverse=True)
+
+    assert [entry["role"] for _, entry in store.search("location", role="jarvis")] == ["jarvis"]
+    assert store.search("nothing matches this") == []
+
+
+def test_old_search_index_is_rebuilt_over_both_tiers(store, tmp_path):
+    _migrate_and_archive(store, tmp_path)
+    # As built before archived rows stayed indexed: external content, emptied by archiving
+    with store.conn() as conn:
+        conn.executescript(
+            "DROP TRIGGER history_ai; DROP TRIGGER history_au; DROP TABLE history_fts;"
+            "CREATE VIRTUAL TABLE history_fts USING fts5(text, content='history', content_rowid='id');"
+            "INSERT INTO history_fts(history_fts) VALUES ('rebuild');"
+        )
+    for index in store.archive.segments():
+        del index["indexed"]
+        store.archive._save_index(index)
+
+    migrated = history_store.HistoryStore(store.db_file, archive=store.archive)
+    assert migrated.search("morning") and not migrated.search("location")
+    migrated.archive.archive_closed(migrated, vacuum=False)
+    assert len(migrated.search("location", limit=5)) == 2
+    assert migrated.archive.archive_closed(migrated, vacuum=False) == 0  # Indexed once
+
+
+def test_pages_follow_timestamps_after_a_merge(store, tmp_path):
+    _migrate_and_archive(store, tmp_path)
+    # A late import of an old month gets new ids; it must still page by its time
+    late = _write_jsonl(tmp_path / "late.jsonl", [
+        {"role": "user", "text": "hello from december", "timestamp": "20241215-080000"},
+        {"role": "user", "text": "hello from january", "timestamp": "20250110-130000"},
+    ])
+    assert merge_history.merge([late], workers=1) == 2
+
+    # Once hot, then archived into a block that overlaps the January segment's first one
+    for rotate in (False, True):
+        if rotate:
+            store.append("user", "good night", _now())  # The newest row always stays hot
+            assert store.archive.archive_closed(store, vacuum=False) == 2
+        seen, cursor = [], None
+        while True:
+            entries, cursor = store.page(cursor, limit=2)
+            seen.extend(entries)
+            if cursor is None:
+                break
+        timestamps = [entry["timestamp"] for entry in seen]
+        assert timestamps == sorted(timestamps, reverse=True)
+        assert len(seen) == len({entry["id"] for entry in seen}) == len(OLD_ENTRIES) + 3 + rotate
+        assert seen[-1]["text"] == "hello from december"
+
+        entries, _ = store.page(limit=10, query="hello")
+        assert [entry["text"] for entry in entries] == ["hello from january", "hello from december"]
+
+
+def test_search_scores_do_not_change_when_rows_are_archived(store, tmp_path):
+    source = _write_jsonl(tmp_path / "history.jsonl", OLD_ENTRIES + [
+        {"role": "user", "text": "good morning", "timestamp": _now()},
+    ])
+    store.migrate_jsonl([source])
+    # One bm25() over one index: archiving moves text, not statistics
+    before = store.search("location playlist", limit=5)
+    assert store.archive.archive_closed(store, vacuum=False) == len(OLD_ENTRIES)
+    assert store.search("location playlist", limit=5) == before
+
+
+def test_search_ranks_matches_and_skips_repeated_texts(store):
+    store.append("user", "what's the weather", "20250301-080000")
+    store.append("user", "What's the weather", "20250302-080000")
+    store.append("jarvis", "The weather in Toronto is sunny, perfect weather for a walk.", "20250302-080005")
+    store.append("user", "open spotify", "20250302-090000")
+
+    hits = store.search("weather toronto")
+    assert [entry["text"] for _, entry in hits][0].startswith("The weather in Toronto")
+    assert len(hits) == 2
+    assert [entry["role"] for _, entry in store.search("weather", role="user")] == ["user"]
+    # User input never reaches FTS5 as query syntax
+    assert store.search('"weather" AND (spotify* OR') != []
+    assert store.search("the and of") == []
+
+
+def test_page_filters_by_time_and_words(store):
+    store.append("user", "remind me about the dentist", "20250301-080000")
+    store.append("user", "dentist appointment moved", "20250315-080000")
+    store.append("user", "really?", "20250320-080000")
+    store.append("user", "undated note")
+
+    entries, cursor = store.page(limit=10)
+    assert [e["text"] for e in entries][-1] == "undated note"
+    assert cursor is None
+    entries, _ = store.page(since="2025-03-10", until="2025-03-31")
+    assert [e["text"] for e in entries] == ["really?", "dentist appointment moved"]
+    entries, _ = store.page(query="dent")  # Last word matches as a prefix
+    assert len(entries) == 2
+    entries, _ = store.page(query="dentist remind")
+    assert [e["text"] for e in entries] == ["remind me about the dentist"]
+    entries, _ = store.page(query="?")  # No words: substring match
+    assert [e["text"] for e in entries] == ["really?"]
+
+
+def test_migrate_jsonl_once_without_duplicating_machine_copies(store, tmp_path):
+    main = _write_jsonl(tmp_path / "history.jsonl", OLD_ENTRIES)
+    copy = _write_jsonl(tmp_path / "history-LAPTOP.jsonl", OLD_ENTRIES + [
+        {"role": "user", "text": "only on the laptop", "timestamp": "20250301-100000"},
+    ])
+    assert store.migrate_jsonl([main, copy]) == len(OLD_ENTRIES) + 1
+    assert store.migrate_jsonl([main, copy]) == 0
+    assert store.count() == len(OLD_ENTRIES) + 1
+    assert len(store.content_hashes()) == store.count()
+
+
+def test_append_many_dedupes_by_content_hash(store):
+    store.append("user", "what's my location", "20250110-120000")
+    again = [
+        {"role": "user", "text": "what's  my location ", "timestamp": "2025-01-10T12:00:00"},
+        {"role": "user", "text": "something new", "timestamp": "20250110-120100"},
+    ]
+    assert store.append_many(again, dedupe=True) == 1
+    assert store.append_many(again, dedupe=True) == 0
+    assert store.count() == 2
+
+
+def test_archive_rotation_moves_closed_months_into_seekable_segments(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(history_archive, "BLOCK_BYTES", 200)  # Several blocks per month
+    old = [
+        {"role": "user", "text": f"note number {i} about the garden", "timestamp": f"202501{i % 28 + 1:02d}-100000"}
+        for i in range(30)
+    ]
+    store.append_many(old)
+    store.append("user", "latest note", "20250301-100000")  # Newest row: stays hot whatever its month
+    newest = store.append("user", "today", _now())
+
+    assert store.archive.archive_closed(store, vacuum=False) == 31
+    assert store.count() == 1 and store.last_id() == newest
+    (index,) = [i for i in store.archive.segments() if i["month"] == "2025-01"]
+    assert index["count"] == 30 and len(index["blocks"]) > 1
+    assert store.archive.archive_closed(store, vacuum=False) == 0
+
+    # A segment is still one gzip stream to ordinary tools
+    with gzip.open(tmp_path / "archive" / "history-2025-01.jsonl.gz", "rt", encoding="utf-8") as f:
+        assert [json.loads(line)["text"] for line in f] == [e["text"] for e in old]
+
+    # Reads come back through the store
+    assert [e["text"] for e in store.entries_after(0, limit=3)] == [e["text"] for e in old[:3]]
+    assert len(store.entries_after(0)) == 32
+    assert [e["id"] for e in store.archive.entries_by_ids([1, 5])] == [1, 5]
+    entries, _ = store.page(limit=5, query="garden", until="2025-01-01")
+    assert sorted(e["text"] for e in entries) == ["note number 0 about the garden", "note number 28 about the garden"]
+
+    # Search finds archived ids in the index and decompresses only the blocks holding them
+    reads = []
+    read_block = store.archive._read_block
+    monkeypatch.setattr(store.archive, "_read_block", lambda index, block: reads.append(block) or read_block(index, block))
+    (hit,) = store.search("latest")
+    assert hit[1]["text"] == "latest note" and len(reads) == 1
+    reads.clear()
+    assert len(store.search("garden", limit=2)) == 2 and len(reads) < len(index["blocks"])
+
+
+def test_scratch_copy_never_touches_the_real_archive(store, tmp_path, monkeypatch):
+    _migrate_and_archive(store, tmp_path)
+    monkeypatch.setattr(history_store, "DB_FILE", store.db_file)
+    monkeypatch.setattr(history_archive, "ARCHIVE_DIR", store.archive.directory)
+    real = sorted((p.name, p.stat().st_size) for p in (tmp_path / "archive").iterdir())
+
+    (tmp_path / "scratch").mkdir()
+    scratch = history_store.use_scratch_copy(str(tmp_path / "scratch" / "history.db"))
+    assert scratch.archive.directory != store.archive.directory
+    assert len(scratch.search("location")) == len(store.search("location")) > 0
+    scratch.append_many([{"role": "user", "text": "load test row", "timestamp": "20250115-120000"}])
+    scratch.append("user", "newest", _now())
+    assert scratch.archive.archive_closed(scratch, vacuum=False) == 1
+    assert sorted((p.name, p.stat().st_size) for p in (tmp_path / "archive").iterdir()) == real
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Tests for streaming chat-export imports into the history store (run with pytest)"""
+
+import json
+
+import pytest
+
+import history_store
+import import_history
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = history_store.HistoryStore(str(tmp_path / "history.db"))
+    monkeypatch.setattr(history_store, "_store", store)
+    return store
+
+
+def _texts(store):
+    return [entry["text"] for entry in store.entries()]
+
+
+def _conversation(number, texts):
+    mapping, parent = {}, None
+    for i, text in enumerate(texts):
+        node = f"c{number}-{i}"
+        mapping[node] = {
+            "parent": parent,
+            "message": {
+                "author": {"role": "user" if i % 2 == 0 else "assistant"},
+                "content": {"parts": [text]},
+                "create_time": 1735725600 + number * 3600 + i,
+            },
+        }
+        parent = node
+    return {"id": f"conv-{number}", "current_node": parent, "mapping": mapping}
+
+
+def test_repeated_undated_html_messages_are_all_kept(store, tmp_path):
+    path = tmp_path / "history.html"
+    path.write_text(
+        "<html><body>"
+        "<div>User</div><p>ok</p><div>ChatGPT</div><p>Done.</p>"
+        "<div>User</div><p>ok</p><div>ChatGPT</div><p>Done.</p>"
+        "</body></html>",
+        encoding="utf-8",
+    )
+    import_history.parse_history(str(path))
+    assert _texts(store) == ["ok", "Done.", "ok", "Done."]
+
+    # The same export again is still recognised entry by entry
+    import_history.parse_history(str(path), restart=True)
+    assert store.count() == 4
+
+
+def test_undated_json_turns_are_told_apart_by_position(store, tmp_path):
+    conversation = _conversation(1, ["ok", "Done.", "ok", "Done."])
+    for node in conversation["mapping"].values():
+        del node["message"]["create_time"]
+    path = tmp_path / "conversations.json"
+    path.write_text(json.dumps([conversation]), encoding="utf-8")
+
+    import_history.parse_history(str(path))
+    assert _texts(store) == ["ok", "Done.", "ok", "Done."]
+
+
+@pytest.mark.parametrize("name", ["conversations.json", "history.html"])
+def test_interrupted_import_resumes_after_the_last_committed_batch(store, tmp_path, monkeypatch, name):
+    texts = [f"message number {i}" for i in range(12)]
+    path = tmp_path / name
+    if name.endswith(".json"):
+        path.write_text(json.dumps([_conversation(n, texts[n * 2:n * 2 + 2]) for n in range(6)]), encoding="utf-8")
+    else:
+        path.write_text("".join(
+            f"<div>{'User' if i % 2 == 0 else 'ChatGPT'}</div><p>{text}</p>" for i, text in enumerate(texts)
+        ), encoding="utf-8")
+    monkeypatch.setattr(import_history, "BATCH_SIZE", 4)
+
+    batches = []
+    append_many = store.append_many
+
+    def interrupt_third_batch(entries, **kwargs):
+        batches.append([e["text"] for e in entries])
+        if len(batches) == 3:
+            raise KeyboardInterrupt
+        return append_many(entries, **kwargs)
+
+    monkeypatch.setattr(store, "append_many", interrupt_third_batch)
+    import_history.parse_history(str(path))
+    assert _texts(store) == texts[:8]
+
+    # The resumed run starts at the interrupted batch: committed ones are never read again
+    batches.clear()
+    monkeypatch.setattr(store, "append_many", lambda entries, **kwargs: batches.append(1) or append_many(entries, **kwargs))
+    import_history.parse_history(str(path))
+    assert _texts(store) == texts
+    assert len(batches) == 1
+    assert store.import_progress(str(path))[3] == 1  # Done: a third run does nothing
+    import_history.parse_history(str(path))
+    assert len(batches) == 1
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Tests for memory_engine.MemoryStore, the cached profile/facts files (run with pytest)"""
+
+import json
+import os
+
+import pytest
+
+import memory_engine
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_engine, "FLUSH_DELAY", 60)  # Flushes only when a test asks
+    return memory_engine.MemoryStore(str(tmp_path / "profile.json"), str(tmp_path / "memory.json"))
+
+
+def _write_outside(path, data, bump_ns):
+    """Edit a file as another process would, with a distinct mtime"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    mtime = os.stat(path).st_mtime_ns + bump_ns
+    os.utime(path, ns=(mtime, mtime))
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_outside_edits_are_picked_up_once_the_mtime_changes(store, tmp_path, monkeypatch):
+    path = str(tmp_path / "profile.json")
+    _write_outside(path, {"name": "Ada"}, 0)
+    assert store.profile()["name"] == "Ada"
+
+    _write_outside(path, {"name": "Grace"}, 10**9)
+    monkeypatch.setattr(memory_engine, "REVALIDATE_SECONDS", 3600)
+    assert store.profile()["name"] == "Ada"  # Served from memory between checks
+    monkeypatch.setattr(memory_engine, "REVALIDATE_SECONDS", 0)
+    assert store.profile()["name"] == "Grace"
+
+    # An unchanged mtime means no re-read, even when a check is due
+    store.profile_doc.data["name"] = "cached"
+    assert store.profile()["name"] == "cached"
+
+
+def test_flush_replays_pending_edits_over_outside_changes(store, tmp_path):
+    path = str(tmp_path / "memory.json")
+    _write_outside(path, {"facts": ["likes tea"]}, 0)
+    store.add_fact("studies physics")
+    _write_outside(path, {"facts": ["likes tea", "added by hand"]}, 10**9)
+
+    store.flush()
+    assert _read(path)["facts"] == ["likes tea", "added by hand", "studies physics"]
+    assert store.memory()["facts"] == _read(path)["facts"]
+    assert not store.memory_doc.pending
+
+
+def test_failed_flush_leaves_the_file_and_no_temp_file(store, tmp_path):
+    path = str(tmp_path / "profile.json")
+    _write_outside(path, {"name": "Ada"}, 0)
+    store.update_profile("study", object())  # Not JSON-serializable: the write fails part-way
+
+    store.flush()
+    assert _read(path) == {"name": "Ada"}
+    assert sorted(os.listdir(tmp_path)) == ["profile.json"]
+    assert store.profile_doc.pending  # Still owed, not silently dropped
+    store.profile_doc.pending = []  # Don't retry it at exit
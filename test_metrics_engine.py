@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Tests for metrics_engine: counters, gauges, histograms and their exports (run with pytest)"""
+
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics_engine
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    for name in ("_counters", "_gauges", "_gauge_fns", "_histograms"):
+        monkeypatch.setattr(metrics_engine, name, {})
+
+
+def test_quantiles_are_estimated_within_their_bucket():
+    for i in range(100):
+        metrics_engine.observe("stage_seconds", 0.15 + i * 0.001, stage="llm")  # All in (0.1, 0.25]
+    metrics_engine.observe("stage_seconds", 0.003, stage="llm")
+    summary = metrics_engine.snapshot()['histograms']['stage_seconds{stage="llm"}']
+    assert summary['count'] == 101
+    assert summary['max'] == pytest.approx(0.249)
+    assert 0.1 < summary['p50'] <= 0.25
+    assert summary['p50'] < summary['p95'] <= summary['p99'] <= 0.25
+    assert summary['mean'] == pytest.approx(summary['sum'] / 101, abs=1e-6)  # Rounded to 6 places
+
+
+def test_overflow_bucket_reports_the_largest_value():
+    metrics_engine.observe("slow_seconds", 95.0)
+    metrics_engine.observe("slow_seconds", 120.0)
+    summary = metrics_engine.snapshot()['histograms']['slow_seconds']
+    assert summary['p50'] == summary['p99'] == 120.0
+
+
+def test_timer_and_provider_calls_record_failures_too():
+    with pytest.raises(ZeroDivisionError):
+        with metrics_engine.timer("turn_seconds"):
+            1 / 0
+    assert metrics_engine.snapshot()['histograms']['turn_seconds']['count'] == 1
+
+    assert metrics_engine.call_provider("tts", "edge", lambda text: text, "hi") == "hi"
+    assert metrics_engine.call_provider("tts", "edge", lambda text: None, "hi") is None
+    with pytest.raises(RuntimeError):
+        metrics_engine.call_provider("tts", "edge", lambda: (_ for _ in ()).throw(RuntimeError()))
+    counters = metrics_engine.snapshot()['counters']
+    assert counters['provider_attempts_total{kind="tts",provider="edge"}'] == 3
+    assert counters['provider_failures_total{kind="tts",provider="edge"}'] == 2
+
+
+def test_gauges_read_callbacks_and_survive_failing_ones():
+    metrics_engine.set_gauge("sessions", 3)
+    metrics_engine.gauge_fn("queue_depth", lambda: 7, queue="stt")
+    metrics_engine.gauge_fn("broken", lambda: 1 / 0)
+    gauges = metrics_engine.snapshot()['gauges']
+    assert gauges['sessions'] == 3 and gauges['queue_depth{queue="stt"}'] == 7
+    assert 'broken' not in gauges
+
+
+def test_prometheus_text_has_cumulative_buckets():
+    metrics_engine.inc("ws_messages_sent_total", 2)
+    metrics_engine.inc("ws_messages_dropped_total", reason="overflow")
+    for seconds in (0.002, 0.02, 0.2, 100):
+        metrics_engine.observe("stt_seconds", seconds, provider="google")
+    lines = metrics_engine.prometheus_text().splitlines()
+
+    assert "# TYPE ws_messages_sent_total counter" in lines
+    assert 'ws_messages_dropped_total{reason="overflow"} 1' in lines
+    assert lines.count("# TYPE stt_seconds histogram") == 1
+    buckets = [line for line in lines if line.startswith("stt_seconds_bucket")]
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and len(buckets) == len(metrics_engine.BUCKETS) + 1
+    assert buckets[-1] == 'stt_seconds_bucket{provider="google",le="+Inf"} 4'
+    assert 'stt_seconds_count{provider="google"} 4' in lines
+
+
+def test_endpoint_serves_only_the_metrics_path():
+    server = metrics_engine.serve("127.0.0.1", 0)
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        metrics_engine.inc("scrapes_total")
+        with urllib.request.urlopen(base + metrics_engine.METRICS_PATH, timeout=5) as response:
+            assert "scrapes_total 1" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(base + "/other", timeout=5)
+    finally:
+        server.shutdown()
+        server.server_close()
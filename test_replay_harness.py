@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Tests for replay_harness: endpointing, clip lengths and simulated replays (run with pytest)"""
+
+import array
+import asyncio
+import wave
+
+import pytest
+
+import metrics_engine
+import replay_harness
+from replay_harness import Recording, ReplayBackends
+
+RATE = 16000
+SPEED = 50  # Fast enough for a test, slow enough that scheduling noise stays small
+LATENCIES = {"stt": 0.4, "llm": 0.9, "tts": 0.35, "tts_first": 0.25, "act": 0.1}
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    for name in ("_counters", "_gauges", "_gauge_fns", "_histograms"):
+        monkeypatch.setattr(metrics_engine, name, {})
+
+
+def _pcm(speech, silence, level=1000):
+    """Square wave at `level` for `speech` seconds, then `silence` seconds of zeros"""
+    loud = [level if i % 2 else -level for i in range(int(RATE * speech))]
+    return array.array("h", loud + [0] * int(RATE * silence)).tobytes()
+
+
+def _wav(path, pcm):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes(pcm)
+    return str(path)
+
+
+def _mp3(path, seconds, header=b"\xFF\xFB\x90\x00", id3=20):
+    """A fake constant-bitrate MP3: an ID3 tag, then one frame header and padding"""
+    tag = b"ID3\x04\x00\x00" + bytes([0, 0, 0, id3]) + b"\x00" * id3
+    audio = header + b"\x00" * (int(seconds * 128000 / 8) - len(header))
+    path.write_bytes(tag + audio)
+    return str(path)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    spoken = Recording(_wav(tmp_path / "command_1.wav", _pcm(0.5, 1.0)))
+    silent = Recording(_wav(tmp_path / "command_2.wav", _pcm(0, 1.0)))
+    return [spoken, silent], [_mp3(tmp_path / "response_1.mp3", 0.5)]
+
+
+def test_speech_ends_at_the_last_loud_frame():
+    assert replay_harness.speech_end(_pcm(0.5, 1.0), RATE, 300) == pytest.approx(16 * replay_harness.FRAME_SECONDS)
+    assert replay_harness.speech_end(_pcm(0.5, 1.0, level=200), RATE, 300) is None
+    assert replay_harness.speech_end(_pcm(0, 1.0), RATE, 300) is None
+
+
+def test_mp3_duration_skips_the_tag_and_reads_the_bitrate(tmp_path):
+    assert replay_harness.mp3_duration(_mp3(tmp_path / "a.mp3", 2.0)) == pytest.approx(2.0)
+    # MPEG-2 with the same bitrate index is 80 kbps
+    mpeg2 = _mp3(tmp_path / "b.mp3", 2.0, header=b"\xFF\xF3\x90\x00", id3=0)
+    assert replay_harness.mp3_duration(mpeg2) == pytest.approx(2.0 * 128 / 80)
+
+
+def test_pct_picks_the_sample_at_the_rank():
+    values = list(range(1, 101))
+    assert replay_harness.pct(values[::-1], 0.5) == 51
+    assert replay_harness.pct(values, 0.99) == 100
+    assert replay_harness.pct(values, 1.0) == 100
+    assert replay_harness.pct([], 0.5) == 0.0
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_replay_times_each_turn_in_real_time_seconds(corpus, stream):
+    recordings, responses = corpus
+    backends = ReplayBackends(responses, speed=SPEED, latencies=LATENCIES, jitter=0, action_rate=1.0)
+    results = asyncio.run(replay_harness.replay(recordings, backends, turns=3, stream=stream))
+
+    assert [r["recording"] for r in results] == ["command_1.wav", "command_2.wav", "command_1.wav"]
+    assert [r["understood"] for r in results] == [True, False, True]
+
+    spoken, silent = results[0], results[1]
+    assert "response" not in silent and set(silent["stages"]) == {"capture"}
+    assert silent["total"] == pytest.approx(replay_harness.LISTEN_TIMEOUT, rel=0.1)
+    # End of speech → first audio: the endpoint wait, STT, the LLM and the first TTS audio
+    first_audio = LATENCIES["tts_first"] if stream else LATENCIES["tts"]
+    expected = replay_harness.PAUSE_THRESHOLD + LATENCIES["stt"] + LATENCIES["llm"] + first_audio
+    assert expected <= spoken["response"] < expected + 0.5
+    assert spoken["stages"]["act"] == pytest.approx(LATENCIES["act"], abs=0.25)  # Every reply had an action
+    assert ("playback" in spoken["stages"]) is not stream
+
+
+def test_summary_has_stage_rows_and_queue_waits(corpus):
+    recordings, responses = corpus
+    backends = ReplayBackends(responses, speed=SPEED, latencies=LATENCIES, jitter=0)
+    results = asyncio.run(replay_harness.replay(recordings[:1], backends, turns=2))
+    summary = replay_harness.summarize(results, SPEED)
+
+    for key in ("response", "total", "capture", "stt", "llm", "tts", "playback", "queue:llm"):
+        assert summary[key]["n"] == 2, key
+    assert "act" not in summary
+    row = summary["llm"]
+    assert row["p50"] <= row["max"] and row["mean"] == pytest.approx(1000 * LATENCIES["llm"], rel=0.25)
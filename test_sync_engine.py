@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Tests for sync_engine: hash-tree diffing, last-writer-wins registers and the HTTP transport (run with pytest)"""
+
+import json
+import os
+import threading
+import urllib.error
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import sync_engine
+from sync_engine import SyncNode
+
+ENTRIES = [
+    {"role": "user", "text": "what's my location", "timestamp": "20250110-120000"},
+    {"role": "jarvis", "text": "You are in Canada.", "timestamp": "20250110-120005"},
+]
+
+
+def _node(tmp_path, name):
+    base = tmp_path / name
+    (base / "memory").mkdir(parents=True)
+    return SyncNode(str(base), machine=name)
+
+
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def start(node, token=None):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), sync_engine.make_handler(node, token))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class LocalPeer:
+    """A peer answered in-process, counting round trips"""
+
+    def __init__(self, node):
+        self.node = node
+        self.requests = 0
+
+    def call(self, op, collection, **payload):
+        self.requests += 1
+        return json.loads(json.dumps(self.node.handle({"op": op, "collection": collection, **payload})))
+
+
+def _hashes(n):
+    return [sync_engine.record_hash({"n": i}) for i in range(n)]
+
+
+def test_digests_are_order_independent():
+    hashes = _hashes(50)
+    prefixes = ["", "a", "0f"]
+    assert sync_engine.digests(hashes, prefixes) == sync_engine.digests(hashes[::-1], prefixes)
+    assert sync_engine.digests(hashes, [""])[""][1] == 50
+
+
+def test_diff_descends_only_into_prefixes_that_differ(monkeypatch):
+    monkeypatch.setattr(sync_engine, "LEAF_SIZE", 4)
+    hashes = _hashes(2000)
+
+    class Remote:
+        requests = 0
+
+        def __init__(self, remote_hashes):
+            self.remote_hashes = remote_hashes
+
+        def call(self, op, name, prefixes):
+            self.requests += 1
+            return {"digests": sync_engine.digests(self.remote_hashes, prefixes)}
+
+    same = Remote(hashes)
+    assert sync_engine._diff_prefixes(same, "history", set(hashes)) == []
+    assert same.requests == 1  # Nothing changed: one round trip
+
+    changed = Remote(hashes[1:])
+    leaves = sync_engine._diff_prefixes(changed, "history", set(hashes))
+    assert all(hashes[0].startswith(leaf) for leaf in leaves) and leaves
+    assert sync_engine.under(hashes, leaves) >= {hashes[0]}
+    assert len(sync_engine.under(hashes, leaves)) <= sync_engine.LEAF_SIZE
+    assert changed.requests <= sync_engine.MAX_DEPTH + 1
+
+
+def test_history_syncs_both_ways_and_then_stops(tmp_path):
+    a, b = _node(tmp_path, "a"), _node(tmp_path, "b")
+    a.collections["history"].store.append_many(ENTRIES)
+    b.collections["history"].store.append_many(ENTRIES[:1] + [
+        {"role": "user", "text": "only on b", "timestamp": "20250111-090000"},
+    ])
+
+    peer = LocalPeer(b)
+    assert sync_engine.sync_collection(a, peer, "history") == (1, 1)
+    for node in (a, b):
+        assert node.collections["history"].store.count() == 3
+
+    peer.requests = 0
+    assert sync_engine.sync_collection(a, peer, "history") == (0, 0)
+    assert peer.requests == 1
+
+
+def test_profile_keys_resolve_to_the_newest_edit(tmp_path):
+    a, b = _node(tmp_path, "a"), _node(tmp_path, "b")
+    for node, location, mtime in ((a, "Regina", 1_700_000_000), (b, "Toronto", 1_700_000_100)):
+        path = os.path.join(node.base_dir, "profile.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"name": "Manan", "location": location}, f)
+        os.utime(path, (mtime, mtime))
+
+    sync_engine.sync_collection(a, LocalPeer(b), "profile")
+    for node in (a, b):
+        with open(os.path.join(node.base_dir, "profile.json"), encoding="utf-8") as f:
+            assert json.load(f)["location"] == "Toronto"
+
+    # Equal stamps: the machine name breaks the tie, the same way on every peer
+    profile = a.collections["profile"]
+    stamp = a.state["profile"]["location"]["modified"]
+    record = {"key": "location", "value": "Oslo", "modified": stamp, "deleted": False}
+    assert profile.apply([dict(record, machine="0-older-name")]) == 0
+    assert profile.apply([dict(record, machine="z")]) == 1
+    with open(os.path.join(a.base_dir, "profile.json"), encoding="utf-8") as f:
+        assert json.load(f)["location"] == "Oslo"
+
+
+def test_removed_facts_stay_removed_on_the_peer(tmp_path):
+    a, b = _node(tmp_path, "a"), _node(tmp_path, "b")
+    path = os.path.join(a.base_dir, "memory.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"facts": ["likes tea", "studies physics"]}, f)
+    os.utime(path, (1_700_000_000, 1_700_000_000))
+    sync_engine.sync_collection(a, LocalPeer(b), "facts")
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"facts": ["studies physics"]}, f)
+    os.utime(path, (1_700_000_100, 1_700_000_100))
+    sync_engine.sync_collection(a, LocalPeer(b), "facts")
+    with open(os.path.join(b.base_dir, "memory.json"), encoding="utf-8") as f:
+        assert json.load(f)["facts"] == ["studies physics"]
+
+
+def test_server_rejects_a_wrong_token(tmp_path, serve, monkeypatch):
+    monkeypatch.delenv("JARVIS_SYNC_TOKEN", raising=False)
+    monkeypatch.setattr(sync_engine, "config", None)
+    b = _node(tmp_path, "b")
+    b.collections["history"].store.append_many(ENTRIES)
+    url = serve(b, token="s3cret")
+
+    for token in ("wrong", "s3cre", None):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            sync_engine.Peer(url, token=token or "").call("digests", "history", prefixes=[""])
+        assert error.value.code == 401
+
+    a = _node(tmp_path, "a")
+    totals = sync_engine.sync(url, a, token="s3cret")
+    assert totals["history"] == (2, 0)
+    assert a.collections["history"].store.count() == 2
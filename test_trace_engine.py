@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Tests for trace_engine: per-turn traces in Chrome trace event format (run with pytest)"""
+
+import asyncio
+import contextvars
+import json
+import threading
+
+import pytest
+
+import trace_engine
+
+
+@pytest.fixture(autouse=True)
+def trace_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(trace_engine, "TRACE_DIR", str(tmp_path))
+    monkeypatch.setattr(trace_engine, "TRACE_FILE", str(tmp_path / "trace.json"))
+    monkeypatch.setattr(trace_engine.background_writer, "submit", lambda func, *args: func(*args))
+    return tmp_path
+
+
+def _load(path):
+    # The file is an unterminated JSON array, as the viewers accept it
+    with open(path, encoding="utf-8") as f:
+        return json.loads(f.read().rstrip().rstrip(",") + "]")
+
+
+def test_spans_follow_the_trace_into_tasks_and_threads(trace_dir):
+    async def stage(name):
+        with trace_engine.span(name, kind="async"):
+            await asyncio.sleep(0)
+
+    def worker():
+        with trace_engine.span("tts.synthesize") as args:
+            args["bytes"] = 42
+
+    async def turn():
+        with trace_engine.trace("turn", session="tab-a") as current:
+            with trace_engine.span("memory.context"):
+                pass
+            await asyncio.gather(stage("llm.query"), stage("actions.dispatch"))
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(worker,))
+            thread.start()
+            thread.join()
+            trace_engine.annotate(text="hello")
+            return current.id
+
+    trace_id = asyncio.run(turn())
+    events = _load(trace_dir / "trace.json")
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(spans) == {"turn", "memory.context", "llm.query", "actions.dispatch", "tts.synthesize"}
+    assert {e["args"]["trace"] for e in spans.values()} == {trace_id}
+    assert spans["turn"]["args"]["text"] == "hello" and spans["tts.synthesize"]["args"]["bytes"] == 42
+    assert spans["llm.query"]["tid"] != spans["actions.dispatch"]["tid"]  # One lane per task
+    lanes = {e["tid"] for e in events if e["ph"] == "M"}
+    assert {e["tid"] for e in spans.values()} <= lanes
+    root = spans["turn"]
+    assert all(root["ts"] <= e["ts"] and e["ts"] + e["dur"] <= root["ts"] + root["dur"] + 1 for e in spans.values())
+
+
+def test_nothing_is_written_outside_a_trace_or_for_a_discarded_one(trace_dir):
+    with trace_engine.span("wake.listen") as args:
+        args["heard"] = False
+    with trace_engine.trace("wake") as current:
+        with trace_engine.span("wake.listen"):
+            pass
+        current.discard()
+    assert not (trace_dir / "trace.json").exists()
+
+
+def test_errors_are_recorded_on_their_spans(trace_dir):
+    with pytest.raises(ValueError):
+        with trace_engine.trace("turn"):
+            with trace_engine.span("stt.transcribe"):
+                raise ValueError("no audio")
+    spans = {e["name"]: e for e in _load(trace_dir / "trace.json") if e["ph"] == "X"}
+    assert "no audio" in spans["stt.transcribe"]["args"]["error"]
+    assert "no audio" in spans["turn"]["args"]["error"]
+
+
+def test_files_rotate_and_old_traces_stay_readable(trace_dir, monkeypatch):
+    monkeypatch.setattr(trace_engine, "MAX_TRACE_BYTES", 200)
+    monkeypatch.setattr(trace_engine, "TRACE_BACKUPS", 2)
+    ids = []
+    for n in range(6):
+        with trace_engine.trace("turn", n=n) as current:
+            ids.append(current.id)
+
+    assert sorted(p.name for p in trace_dir.iterdir()) == ["trace.1.json", "trace.2.json", "trace.json"]
+    listed = trace_engine.recent(10)
+    assert [item[0] for item in listed] == ids[-len(listed):]
+    assert listed[-1][4] == {"n": 5}
+
+    path = trace_engine.export(ids[-1])
+    with open(path, encoding="utf-8") as f:
+        exported = json.load(f)["traceEvents"]
+    assert [e["ph"] for e in exported] == ["M", "X"]
+    assert trace_engine.export("not-a-trace") is None
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Tests for turn_pipeline: concurrent action dispatch and per-action reports (run with pytest)"""
+
+import asyncio
+import time
+
+import pytest
+
+import metrics_engine
+from turn_pipeline import TurnPipeline
+
+WAKE_UP = [
+    '[[ACTION: OPEN_APP, "spotify", 1]]',
+    '[[ACTION: OPEN_APP, "chrome", 2]]',
+    '[[ACTION: OPEN_WEBSITE, "https://mail.google.com"]]',
+]
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    for name in ("_counters", "_gauges", "_gauge_fns", "_histograms"):
+        monkeypatch.setattr(metrics_engine, name, {})
+
+
+class SlowActions:
+    """Actions that take `delays[name]` seconds, or fail when the delay is None"""
+
+    def __init__(self, delays):
+        self.delays = delays
+
+    def act(self, action):
+        delay = next(d for name, d in self.delays.items() if name in action)
+        if delay is None:
+            raise RuntimeError("app not found")
+        time.sleep(delay)
+        return f"Done {action}"
+
+
+def test_actions_run_side_by_side():
+    pipeline = TurnPipeline(SlowActions({"spotify": 0.2, "chrome": 0.2, "mail": 0.2}))
+    start = time.perf_counter()
+    reports = asyncio.run(pipeline.act(WAKE_UP))
+    assert time.perf_counter() - start < 0.4  # One action's time, not three
+    assert [r["action"] for r in reports] == WAKE_UP
+    assert [r["type"] for r in reports] == ["open_app", "open_app", "open_website"]
+    assert all(r["result"] == f"Done {r['action']}" and r["seconds"] >= 0.2 for r in reports)
+
+
+def test_each_action_is_reported_as_it_finishes():
+    pipeline = TurnPipeline(SlowActions({"spotify": 0.3, "chrome": 0.0, "mail": 0.15}))
+
+    async def main():
+        finished = []
+        futures = pipeline.dispatch_actions(WAKE_UP)
+        for future in futures:
+            future.add_done_callback(lambda done: finished.append(done.result()["action"]))
+        await asyncio.gather(*futures)
+        return finished
+
+    assert asyncio.run(main()) == [WAKE_UP[1], WAKE_UP[2], WAKE_UP[0]]
+
+
+def test_a_failing_action_is_reported_and_timed_like_the_others():
+    pipeline = TurnPipeline(SlowActions({"spotify": None, "chrome": 0.0, "mail": 0.0}))
+    reports = asyncio.run(pipeline.act(WAKE_UP))
+    assert reports[0]["result"] == "Action failed: app not found"
+    assert reports[1]["result"].startswith("Done")
+
+    histograms = metrics_engine.snapshot()["histograms"]
+    assert histograms['action_seconds{type="open_app"}']["count"] == 2
+    assert histograms['action_seconds{type="open_website"}']["count"] == 1
+
+
+def test_no_actions_means_no_futures():
+    assert TurnPipeline(SlowActions({})).dispatch_actions([]) == []
+    assert asyncio.run(TurnPipeline(SlowActions({})).act([])) == []
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""Tests for the WebSocket server: per-client outboxes and history requests (run with pytest)"""
+
+import asyncio
+import json
+
+import pytest
+
+import history_store
+import websocket_server
+from websocket_server import ClientConnection
+
+
+class FakeSocket:
+    """Records sent frames; sends wait while `gate` is clear"""
+
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.close_code = None
+
+    async def send(self, frame):
+        await self.gate.wait()
+        self.sent.append(frame)
+
+    async def close(self, code=1000, reason=""):
+        self.close_code = code
+
+
+class FakeClient:
+    """Collects what handlers send to one client"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message, cache=None):
+        self.messages.append(message)
+
+    async def put(self, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = history_store.HistoryStore(str(tmp_path / "history.db"))
+    monkeypatch.setattr(history_store, "_store", store)
+    return store
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _drain(client):
+    while client.outbox:
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+
+def _messages(socket):
+    return [json.loads(frame) for frame in socket.sent]
+
+
+def test_state_updates_are_coalesced_per_session():
+    async def main():
+        socket = FakeSocket()
+        socket.gate.clear()
+        client = ClientConnection(socket)
+        client.send({'type': 'jarvis_response', 'payload': {'text': 'hold'}})
+        await asyncio.sleep(0)  # The sender takes it and stalls
+
+        client.send({'type': 'state_change', 'payload': {'state': 'processing', 'session': 'voice'}})
+        client.send({'type': 'state_change', 'payload': {'state': 'processing', 'session': 'tab-a'}})
+        client.send({'type': 'state_change', 'payload': {'state': 'speaking', 'session': 'voice'}})
+        client.send({'type': 'status', 'payload': {'session': 'tab-a', 'processing': 'Thinking'}})
+        client.send({'type': 'status', 'payload': {'session': 'tab-a', 'audioOutput': 'Speaking'}})
+        assert len(client.outbox) == 3
+
+        socket.gate.set()
+        await _drain(client)
+        client.close()
+        assert [(m['type'], m['payload']) for m in _messages(socket)[1:]] == [
+            ('state_change', {'state': 'speaking', 'session': 'voice'}),
+            ('state_change', {'state': 'processing', 'session': 'tab-a'}),
+            ('status', {'session': 'tab-a', 'processing': 'Thinking', 'audioOutput': 'Speaking'}),
+        ]
+    _run(main())
+
+
+def test_overflowing_client_is_disconnected(monkeypatch):
+    monkeypatch.setattr(websocket_server, "CLIENT_QUEUE_DEPTH", 4)
+
+    async def main():
+        socket = FakeSocket()
+        socket.gate.clear()
+        client = ClientConnection(socket)
+        for i in range(4):
+            client.send({'type': 'jarvis_response', 'payload': {'text': str(i)}})
+            client.send({'type': 'state_change', 'payload': {'state': 'speaking', 'session': 'voice'}})
+            await asyncio.sleep(0)
+        assert not client.closed  # One in flight; three queued plus the one coalesced state
+        client.send({'type': 'jarvis_response', 'payload': {'text': 'one too many'}})
+        assert client.closed and not client.outbox
+        await asyncio.sleep(0)
+        assert socket.close_code == 1013
+        client.close()
+    _run(main())
+
+
+def test_stalled_send_disconnects_the_client(monkeypatch):
+    monkeypatch.setattr(websocket_server, "CLIENT_SEND_TIMEOUT", 0.05)
+
+    async def main():
+        socket = FakeSocket()
+        socket.gate.clear()
+        client = ClientConnection(socket)
+        client.send({'type': 'jarvis_response', 'payload': {'text': 'never read'}})
+        await asyncio.wait_for(client.sender, 1)
+        assert client.closed
+        await asyncio.sleep(0)
+        assert socket.close_code == 1013
+    _run(main())
+
+
+def test_replies_wait_while_the_outbox_is_half_full(monkeypatch):
+    monkeypatch.setattr(websocket_server, "CLIENT_QUEUE_DEPTH", 8)
+
+    async def main():
+        socket = FakeSocket()
+        socket.gate.clear()
+        client = ClientConnection(socket)
+        for i in range(5):
+            client.send({'type': 'history_append', 'payload': {'id': i}})
+        await asyncio.sleep(0)
+        reply = asyncio.ensure_future(client.put({'type': 'history_data', 'payload': {}}))
+        await asyncio.sleep(0.01)
+        assert not reply.done() and len(client.outbox) == 4
+
+        socket.gate.set()
+        await asyncio.wait_for(reply, 1)
+        await _drain(client)
+        client.close()
+        assert [m['type'] for m in _messages(socket)][-1] == 'history_data'
+        assert len(socket.sent) == 6
+    _run(main())
+
+
+def test_session_state_changes_name_their_session():
+    async def main():
+        socket = FakeSocket()
+        client = ClientConnection(socket)
+        session = websocket_server.ConversationSession('tab-b')
+        session.clients.add(client)
+        session.set_state('processing')
+        session.set_status(processing='Thinking')
+        session.set_status(processing='Thinking')  # Unchanged: not sent
+        await _drain(client)
+        client.close()
+        assert [m['payload'] for m in _messages(socket)] == [
+            {'state': 'processing', 'session': 'tab-b'},
+            {'processing': 'Thinking', 'session': 'tab-b'},
+        ]
+    _run(main())
+
+
+def test_history_pages_follow_the_cursor_to_the_end(store, monkeypatch):
+    for i in range(7):
+        store.append("user", f"note {i}", f"2025030{i + 1}-080000")
+    monkeypatch.setattr(websocket_server, "HISTORY_MAX_PAGE_SIZE", 3)
+    monkeypatch.setattr(websocket_server, "HISTORY_MAX_TEXT", 4)
+
+    async def main():
+        client, pages, cursor = FakeClient(), [], None
+        while True:
+            await websocket_server.handle_get_history(client, {'cursor': cursor, 'limit': 50})
+            payload = client.messages[-1]['payload']
+            pages.append(payload)
+            cursor = payload['next_cursor']
+            if not payload['has_more']:
+                return pages
+
+    pages = _run(main())
+    assert [len(page['history']) for page in pages] == [3, 3, 1]  # limit is capped
+    items = [item for page in pages for item in page['history']]
+    assert [item['id'] for item in items] == [7, 6, 5, 4, 3, 2, 1]
+    assert items[0]['text'] == "note" and items[0]['truncated']
+    assert {page['last_id'] for page in pages} == {7}
+    assert pages[1]['cursor'] == pages[0]['next_cursor']
+
+
+def test_history_page_errors_still_answer(store, monkeypatch):
+    monkeypatch.setattr(store, "page", lambda **kwargs: 1 / 0)
+    client = FakeClient()
+    _run(websocket_server.handle_get_history(client, {}))
+    (message,) = client.messages
+    assert message['payload']['history'] == [] and not message['payload']['has_more']
+    assert 'division' in message['payload']['error']
+
+
+def _saved(store, text):
+    entry = {'id': store.append("user", text, "20250301-080000"), 'role': "user", 'text': text, 'timestamp': "20250301-080000"}
+    websocket_server.broadcast_history_append(entry)
+    return entry
+
+
+def test_history_subscription_sends_each_missed_and_new_entry_once(store, monkeypatch):
+    monkeypatch.setattr(websocket_server, "history_subscribers", {})
+    monkeypatch.setattr(websocket_server, "HISTORY_DELTA_CHUNK", 2)
+    for i in range(5):
+        store.append("user", f"note {i}", "20250301-080000")
+
+    # A turn saved while the client is still catching up
+    entries_after = store.entries_after
+    calls = []
+
+    def entries_after_with_a_save(after_id, limit):
+        calls.append(after_id)
+        if len(calls) == 1:
+            _saved(store, "said during the catch-up")
+        return entries_after(after_id, limit)
+
+    monkeypatch.setattr(store, "entries_after", entries_after_with_a_save)
+    client = FakeClient()
+    _run(websocket_server.handle_subscribe_history(client, {'last_id': 1}))
+    _saved(store, "said afterwards")
+
+    deltas = [m['payload'] for m in client.messages if m['type'] == 'history_delta']
+    assert [[item['id'] for item in delta['history']] for delta in deltas] == [[2, 3], [4, 5], [6]]
+    assert [delta['complete'] for delta in deltas] == [False, False, True]
+    appends = [m['payload']['id'] for m in client.messages if m['type'] == 'history_append']
+    assert appends == [7]  # The buffered save was already in a delta
+
+
+def test_history_subscription_without_last_id_starts_now(store, monkeypatch):
+    monkeypatch.setattr(websocket_server, "history_subscribers", {})
+    store.append("user", "old news", "20250301-080000")
+    client = FakeClient()
+    _run(websocket_server.handle_subscribe_history(client, {}))
+    assert client.messages[0]['payload'] == {'history': [], 'last_id': 1, 'complete': True}
+    websocket_server.history_subscribers.pop(client)
+    _saved(store, "nobody is listening")
+    assert len(client.messages) == 1
+
+
+def test_finished_actions_are_reported_to_the_session():
+    async def main():
+        socket = FakeSocket()
+        client = ClientConnection(socket)
+        session = websocket_server.ConversationSession('tab-c')
+        session.clients.add(client)
+        done = asyncio.get_running_loop().create_future()
+        done.set_result({'action': '[[ACTION: OPEN_APP, "notepad"]]', 'type': 'open_app', 'result': 'Opened', 'seconds': 0.4})
+        websocket_server.report_action(session, done)
+        cancelled = asyncio.get_running_loop().create_future()
+        cancelled.cancel()
+        websocket_server.report_action(session, cancelled)  # Not sent
+        await _drain(client)
+        client.close()
+        assert _messages(socket) == [{'type': 'action_result', 'payload': done.result()}]
+    _run(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Tests for wire_codec message encodings (run with pytest)"""
+
+import json
+
+import pytest
+
+import wire_codec
+
+MESSAGES = [
+    {'type': 'jarvis_response', 'payload': {'text': "Bonjour, ça va? 👋", 'id': 42, 'responseTime': 180}},
+    {'type': 'history_data', 'payload': {'history': [{'id': 1, 'role': 'user', 'text': 'hi'}], 'next_cursor': None}},
+    {'type': 'get_status', 'payload': None},
+    {'type': 'action_result', 'payload': {'type': 'OPEN_APP', 'seconds': 0.25}},
+    {'type': 'not_in_the_table', 'payload': {'x': [1, 2.5, True]}},
+]
+
+
+@pytest.mark.parametrize('name', sorted(wire_codec.CODECS))
+@pytest.mark.parametrize('message', MESSAGES, ids=[m['type'] for m in MESSAGES])
+def test_every_codec_round_trips(name, message):
+    frame = wire_codec.encode(wire_codec.CODECS[name], message)
+    assert wire_codec.is_message_frame(frame)
+    assert wire_codec.decode(frame) == message
+
+
+def test_compact_forms_use_type_codes():
+    message = {'type': 'jarvis_response', 'payload': {'text': 'hi'}}
+    frame = wire_codec.CODECS['compact'].encode(message)
+    assert json.loads(frame) == [wire_codec.TYPE_CODES['jarvis_response'], {'text': 'hi'}]
+    assert len(frame) < len(wire_codec.CODECS['json'].encode(message))
+    # Codes past the table (a newer peer) decode to no type rather than failing
+    assert wire_codec.decode(json.dumps([len(wire_codec.MESSAGE_TYPES), {}]))['type'] is None
+
+
+def test_message_types_are_append_only():
+    # Clients may cache the table: existing codes must never move
+    assert wire_codec.MESSAGE_TYPES[:6] == ['hello', 'status', 'state_change', 'user_speech', 'jarvis_response', 'error']
+    assert len(set(wire_codec.MESSAGE_TYPES)) == len(wire_codec.MESSAGE_TYPES)
+
+
+def test_negotiate_prefers_the_clients_first_supported_choice():
+    assert wire_codec.negotiate(['cbor', 'compact', 'json']).name == 'compact'
+    assert wire_codec.negotiate(['cbor']) is wire_codec.DEFAULT_CODEC
+    assert wire_codec.negotiate(None) is wire_codec.DEFAULT_CODEC
+
+
+def test_encode_cache_reuses_one_encoding_per_codec():
+    message = {'type': 'status', 'payload': {'state': 'idle'}}
+    cache = {}
+    first = wire_codec.encode(wire_codec.CODECS['compact'], message, cache)
+    message['payload']['state'] = 'changed'  # A broadcast encodes once, whatever happens after
+    assert wire_codec.encode(wire_codec.CODECS['compact'], message, cache) is first
+    assert set(cache) == {'compact'}
+
+
+@pytest.mark.skipif(wire_codec.msgpack is None, reason="msgpack not installed")
+def test_binary_frames_are_messages_only_with_the_message_tag():
+    frame = wire_codec.CODECS['msgpack'].encode({'type': 'status', 'payload': {}})
+    assert frame[0] == wire_codec.FRAME_MESSAGE
+    assert not wire_codec.is_message_frame(bytes([0x01]) + frame[1:])  # Audio frames use other tags
@@ -0,0 +1,239 @@
+# trace_engine.py
+"""
+Per-turn traces in Chrome trace event format (open in ui.perfetto.dev or
+chrome://tracing).
+A trace is started around one unit of work (a turn, a wake word attempt) and
+gets a short id. Code anywhere below it opens nested spans with span(); the
+current trace follows the call through asyncio tasks and, via
+contextvars.copy_context(), into stage worker threads. A span outside any
+trace is a no-op costing ~2 µs; inside one, ~10 µs.
+A finished trace's events are appended as one batch to logs/traces/trace.json
+on the background writer; the file rotates at MAX_TRACE_BYTES.
+
+    python trace_engine.py list [count]            # recent traces
+    python trace_engine.py export <trace id> [out] # one trace as its own file
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import background_writer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_DIR = os.path.join(BASE_DIR, "logs", "traces")
+TRACE_FILE = os.path.join(TRACE_DIR, "trace.json")
+
+TRACING_ENABLED = True
+MAX_TRACE_BYTES = 20 * 1024 * 1024
+TRACE_BACKUPS = 5  # trace.1.json (newest) ... trace.5.json
+
+PID = os.getpid()
+# perf_counter for durations, anchored to wall time so files line up across runs
+_EPOCH_US = time.time() * 1e6 - time.perf_counter() * 1e6
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def _now_us():
+    return _EPOCH_US + time.perf_counter() * 1e6
+
+
+def _lane():
+    """(tid, name) for the track a span is drawn on: its asyncio task, else its thread"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return id(task) & 0x7FFFFFFF, f"task {task.get_name()}"
+    thread = threading.current_thread()
+    return thread.ident & 0x7FFFFFFF, thread.name
+
+
+class Trace:
+    """Events of one traced unit of work, written when it finishes"""
+
+    def __init__(self, name, args):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.args = args
+        self.events = []
+        self.lanes = {}
+        self.discarded = False
+        self.finished = False
+
+    def add(self, name, start_us, end_us, args):
+        tid, lane = _lane()
+        self.lanes[tid] = lane
+        event = {
+            "name": name, "cat": name.split(".")[0], "ph": "X",
+            "ts": round(start_us, 1), "dur": round(end_us - start_us, 1),
+            "pid": PID, "tid": tid, "args": dict(args, trace=self.id),
+        }
+        if self.finished:
+            _write([event], {tid: lane})  # A span that outlived its trace
+        else:
+            self.events.append(event)
+
+    def discard(self):
+        """Don't write this trace (e.g. a wake word attempt that heard nothing)"""
+        self.discarded = True
+
+
+def current_trace_id():
+    trace = _current.get()
+    return trace.id if trace else None
+
+
+def annotate(**args):
+    """Add details to the current trace's root span (shown by `list`)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.args.update(args)
+
+
+@contextlib.contextmanager
+def trace(name, **args):
+    """Start a trace (and its root span); yields the Trace"""
+    if not TRACING_ENABLED:
+        yield Trace(name, args)
+        return
+    current = Trace(name, args)
+    token = _current.set(current)
+    start = _now_us()
+    try:
+        yield current
+    except BaseException as e:
+        args["error"] = repr(e)
+        raise
+    finally:
+        current.add(name, start, _now_us(), args)
+        _current.reset(token)
+        current.finished = True
+        if not current.discarded:
+            _write(current.events, current.lanes)
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Time a block as a span of the current trace (no-op outside a trace)"""
+    current = _current.get()
+    if current is None:
+        yield args
+        return
+    start = _now_us()
+    try:
+        yield args  # Callers may add result details to the span's args
+    except BaseException as e:
+        args["error"] = repr(e)
+        raise
+    finally:
+        current.add(name, start, _now_us(), args)
+
+
+def _write(events, lanes):
+    meta = [
+        {"name": "thread_name", "ph": "M", "pid": PID, "tid": tid, "args": {"name": lane}}
+        for tid, lane in lanes.items()
+    ]
+    text = "".join(json.dumps(event) + ",\n" for event in meta + events)
+    background_writer.submit(_append, text)
+
+
+def _append(text):
+    """Writer thread: append a batch, rotating the file when it gets too big"""
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    try:
+        size = os.path.getsize(TRACE_FILE)
+    except FileNotFoundError:
+        size = 0
+    if size >= MAX_TRACE_BYTES:
+        for n in range(TRACE_BACKUPS - 1, 0, -1):
+            older = os.path.join(TRACE_DIR, f"trace.{n}.json")
+            if os.path.exists(older):
+                os.replace(older, os.path.join(TRACE_DIR, f"trace.{n + 1}.json"))
+        os.replace(TRACE_FILE, os.path.join(TRACE_DIR, "trace.1.json"))
+        size = 0
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        if size == 0:
+            f.write("[\n")  # JSON array format; viewers accept it without the closing bracket
+        f.write(text)
+
+
+# ---- Reading traces back ----
+def read_events(paths=None):
+    """All events in the trace files, oldest file first"""
+    if paths is None:
+        backups = sorted(glob.glob(os.path.join(TRACE_DIR, "trace.*.json")),
+                         key=lambda p: int(p.rsplit(".", 2)[1]), reverse=True)
+        paths = backups + [TRACE_FILE]
+    events = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip().rstrip(",")
+                if line.startswith("{"):
+                    try:
+                        events.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass  # Torn last line of a crashed run
+    return events
+
+
+def export(trace_id, out_path=None):
+    """Write one trace (and its track names) as a standalone trace file"""
+    spans, names, latest = [], {}, {}
+    for e in read_events():
+        if e["ph"] == "M":
+            latest[e["tid"]] = e  # Task ids get reused; use the name written with the span
+        elif e.get("args", {}).get("trace") == trace_id:
+            spans.append(e)
+            if e["tid"] not in names and e["tid"] in latest:
+                names[e["tid"]] = latest[e["tid"]]
+    if not spans:
+        return None
+    out_path = out_path or os.path.join(TRACE_DIR, f"turn-{trace_id}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": list(names.values()) + spans, "displayTimeUnit": "ms"}, f)
+    return out_path
+
+
+def recent(count=20):
+    """Root spans of the latest traces: [(trace id, name, start, ms, args)]"""
+    roots = {}
+    for e in read_events():
+        args = e.get("args", {})
+        trace_id = args.get("trace")
+        if e["ph"] != "X" or not trace_id:
+            continue
+        # The root span starts first (a span can outlive a cancelled trace)
+        if trace_id not in roots or (e["ts"], -e["dur"]) < (roots[trace_id]["ts"], -roots[trace_id]["dur"]):
+            roots[trace_id] = e
+    latest = sorted(roots.values(), key=lambda e: e["ts"])[-count:]
+    return [
+        (e["args"]["trace"], e["name"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["ts"] / 1e6)),
+         e["dur"] / 1000, {k: v for k, v in e["args"].items() if k != "trace"})
+        for e in latest
+    ]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        for trace_id, name, started, ms, args in recent(int(sys.argv[2]) if len(sys.argv) > 2 else 20):
+            print(f"{trace_id}  {started}  {name:<6} {ms:9.1f} ms  {args}")
+    elif command == "export" and len(sys.argv) > 2:
+        path = export(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"📈 Wrote {path}" if path else f"⚠️ No trace {sys.argv[2]}")
+    else:
+        print(__doc__)
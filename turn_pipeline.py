@@ -0,0 +1,244 @@
+# turn_pipeline.py
+"""
+Async stages of one conversation turn:
+capture → STT → LLM → actions/TTS → playback.
+Each stage that calls a blocking SDK runs on its own small thread pool, so a
+slow provider only holds up its own stage and the event loop stays free for
+the UI. The engines behind the stages are a plain object of callables; the
+server uses the real ones (FakeBackends with --fake-ai), tools can plug in
+their own.
+Every stage call records its queue wait and run time in metrics_engine
+(stage_queue_seconds / stage_seconds), and stage_pending counts calls
+submitted but not finished. Stage calls run in a copy of the caller's
+context, so trace_engine spans inside them join the caller's trace, and
+cancel_requested() tells a worker thread that its turn was cancelled (a
+cancelled stage call still waiting for a worker never runs; a running one
+can't be interrupted, so the engines check the flag between providers, chunks
+and playback ticks).
+"""
+
+import asyncio
+import contextvars
+import functools
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics_engine
+import trace_engine
+
+# Worker threads per stage. Audio devices have one owner: one capture, one playback
+STAGE_WORKERS = {
+    "capture": 1,
+    "stt": 2,
+    "llm": 4,
+    "actions": 4,  # All of a reply's actions start at once ("Wake Up" launches three apps)
+    "tts": 2,
+    "playback": 1,
+}
+
+ACTION_RE = re.compile(r'\[\[ACTION:.*?\]\]')
+ACTION_TYPE_RE = re.compile(r'\[\[ACTION:\s*(\w+)')
+
+_executors = {}
+_pending = dict.fromkeys(STAGE_WORKERS, 0)
+
+# threading.Event of the current turn, set when it is cancelled
+_cancel = contextvars.ContextVar("turn_cancel", default=None)
+
+for _stage in STAGE_WORKERS:
+    metrics_engine.gauge_fn("stage_pending", functools.partial(_pending.get, _stage), stage=_stage)
+
+
+def executor(stage):
+    if stage not in _executors:
+        _executors[stage] = ThreadPoolExecutor(max_workers=STAGE_WORKERS[stage], thread_name_prefix=stage)
+    return _executors[stage]
+
+
+def bind_cancel(event):
+    """Make event the current task's cancel flag (stage calls started from it see it)"""
+    _cancel.set(event)
+
+
+def cancel_requested():
+    """True when the turn this call belongs to has been cancelled"""
+    event = _cancel.get()
+    return event is not None and event.is_set()
+
+
+def _timed(stage, queued, func, *args):
+    start = time.perf_counter()
+    metrics_engine.observe("stage_queue_seconds", start - queued, stage=stage)
+    try:
+        with trace_engine.span(f"stage.{stage}", queue_ms=round((start - queued) * 1000, 2)):
+            return func(*args)
+    finally:
+        metrics_engine.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+
+async def run_stage(stage, func, *args):
+    """Run a blocking call on the stage's executor without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    _pending[stage] += 1
+    try:
+        return await loop.run_in_executor(
+            executor(stage), contextvars.copy_context().run, _timed, stage, time.perf_counter(), func, *args)
+    finally:
+        _pending[stage] -= 1
+
+
+def split_actions(ai_text):
+    """(text to show and speak, [[ACTION: ...]] tags) of an AI reply"""
+    actions = ACTION_RE.findall(ai_text)
+    if actions:
+        ai_text = ACTION_RE.sub('', ai_text).strip()
+    return ai_text, actions
+
+
+class EngineBackends:
+    """The real engines (imported here so fakes don't need the SDKs installed)"""
+
+    def __init__(self):
+        from speech_engine import capture_command, transcribe, transcribe_pcm, tts_speak, tts_stream, play_audio_blocking
+        from ai_engine import get_ai_response
+        from actions_engine import execute_action
+        self.capture = capture_command
+        self.transcribe = transcribe
+        self.transcribe_pcm = transcribe_pcm
+        self.respond = get_ai_response
+        self.act = execute_action
+        self.synthesize = tts_speak
+        self.synthesize_stream = tts_stream
+        self.play = play_audio_blocking
+
+
+class TurnPipeline:
+    """Awaitable turn stages over a set of backends"""
+
+    def __init__(self, backends=None):
+        self.backends = backends or EngineBackends()
+
+    async def listen(self):
+        """Capture a spoken command and transcribe it; None if nothing was understood"""
+        audio = await run_stage("capture", self.backends.capture)
+        if audio is None:
+            return None
+        return await run_stage("stt", self.backends.transcribe, audio)
+
+    async def transcribe_pcm(self, pcm, sample_rate):
+        """Transcribe an utterance streamed from a client (16-bit mono PCM)"""
+        return await run_stage("stt", self.backends.transcribe_pcm, pcm, sample_rate)
+
+    async def think(self, user_text, session_history, summary=""):
+        """(reply text, action tags) for the user's command"""
+        ai_text = await run_stage("llm", self.backends.respond, user_text, session_history, summary)
+        return split_actions(ai_text or "")
+
+    def dispatch_actions(self, actions):
+        """
+        Start all of the reply's actions at once on the actions pool; returns a
+        future per action, resolving to {action, type, result, seconds}
+        """
+        return [asyncio.ensure_future(self._run_action(action)) for action in actions]
+
+    async def _run_action(self, action):
+        match = ACTION_TYPE_RE.match(action)
+        kind = match.group(1).lower() if match else "unknown"
+        start = time.perf_counter()
+        try:
+            result = await run_stage("actions", self.backends.act, action)
+        except Exception as e:
+            result = f"Action failed: {e}"
+        seconds = time.perf_counter() - start
+        metrics_engine.observe("action_seconds", seconds, type=kind)
+        print(f"⚙️ Action: {result} ({seconds:.1f}s)")
+        return {"action": action, "type": kind, "result": result, "seconds": round(seconds, 3)}
+
+    async def act(self, actions):
+        """Run the reply's actions side by side; returns their reports in order"""
+        return await asyncio.gather(*self.dispatch_actions(actions))
+
+    async def speak(self, text, filename):
+        """Synthesize the reply, then play it; returns the audio file (None if TTS failed)"""
+        start = time.perf_counter()
+        path = await run_stage("tts", self.backends.synthesize, text, filename)
+        if path:
+            metrics_engine.observe("speech_start_seconds", time.perf_counter() - start, mode="local")
+            await run_stage("playback", self.backends.play, path)
+        return path
+
+    async def stream_speech(self, text, send_chunk):
+        """
+        Synthesize the reply and hand each audio chunk to send_chunk (on the
+        event loop) as the provider produces it. Returns the bytes sent.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        def produce():
+            stream = self.backends.synthesize_stream(text)
+            try:
+                for chunk in stream:
+                    if cancel_requested():
+                        break  # Closing the generator drops the provider's stream
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                if hasattr(stream, "close"):
+                    stream.close()
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        start = time.perf_counter()
+        producer = loop.run_in_executor(executor("tts"), contextvars.copy_context().run, _timed, "tts", start, produce)
+        sent = 0
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            if not sent:
+                metrics_engine.observe("speech_start_seconds", time.perf_counter() - start, mode="stream")
+            send_chunk(chunk)
+            sent += len(chunk)
+        await producer
+        return sent
+
+
+class FakeBackends:
+    """Canned replies after a fixed delay and no audio; for load tests without SDKs or a mic"""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+
+    def capture(self):
+        time.sleep(self.latency)
+        return None
+
+    def transcribe(self, audio):
+        return None
+
+    def transcribe_pcm(self, pcm, sample_rate):
+        time.sleep(self.latency)
+        return f"{len(pcm)} bytes of audio"
+
+    def respond(self, user_text, session_history=None, session_summary=""):
+        time.sleep(self.latency)
+        reply = f"Fake reply to: {user_text}"
+        if user_text.lower().startswith("open "):
+            # "open a, b and c" → one OPEN_APP tag per app, like the "Wake Up" macro
+            for app in re.split(r",|\band\b", user_text[5:]):
+                if app.strip():
+                    reply += f' [[ACTION: OPEN_APP, "{app.strip()}"]]'
+        return reply
+
+    def act(self, action):
+        time.sleep(self.latency)
+        return f"Faked {action}"
+
+    def synthesize(self, text, filename):
+        return None  # No file, so speak() skips playback
+
+    def synthesize_stream(self, text):
+        return iter(())
+
+    def play(self, path):
+        pass
@@ -5,6 +5,15 @@
 const WS_URL = 'ws://localhost:8765';
 const PARTICLE_COUNT = 60;
 const RING_COUNT = 3;
+const HISTORY_PAGE_SIZE = 100;
+
+// Binary audio frames: one type byte, then data (see websocket_server.py)
+const FRAME_MIC_PCM = 0x01;    // 16-bit mono PCM up to the server
+const FRAME_TTS_AUDIO = 0x02;  // MP3 chunks of a reply down to us
+const FRAME_MESSAGE = 0x00;    // a MessagePack [type code, payload] message
+
+// Message encodings we can read, best first (wire_codec.py); JSON is the fallback
+const WIRE_ENCODINGS = ['msgpack', 'compact'];
 
 // ===== STATE =====
 let ws = null;
@@ -12,12 +21,35 @@ let reconnectInterval = null;
 let conversationCount = 0;
 let startTime = Date.now();
 let animationFrame = 0;
+let messageTypes = [];  // type code -> name, from the server's hello reply
+
+// History pages loaded so far (newest first)
+let historyItems = [];
+let historyNextCursor = null;
+let historyQuery = '';
+let historySearchTimer = null;
+let historyLastId = null;  // Newest history id this page has seen (survives reconnects)
+
+// Conversation session of this tab: the server keeps a separate context per session,
+// and reusing the id after a reload or reconnect continues the same conversation
+let sessionId = sessionStorage.getItem('jarvisSession');
+if (!sessionId) {
+    sessionId = 'tab-' + Math.random().toString(36).slice(2, 10);
+    sessionStorage.setItem('jarvisSession', sessionId);
+}
+
+// State and status per session ('voice' is the local mic conversation every tab sees);
+// the reactor shows this tab's session while it is busy, the voice session otherwise
+const VOICE_SESSION = 'voice';
+const sessionStates = { [VOICE_SESSION]: 'idle' };
+const sessionStatus = {};
 
 // ===== DOM ELEMENTS =====
 const elements = {
     particlesContainer: document.getElementById('particles-container'),
     commandInput: document.getElementById('commandInput'),
     sendBtn: document.getElementById('sendBtn'),
+    micBtn: document.getElementById('micBtn'),
     conversationLog: document.getElementById('conversationLog'),
     historyToggle: document.getElementById('historyToggle'),
     historySidebar: document.getElementById('historySidebar'),
@@ -217,6 +249,7 @@ function updateGauge(progressId, textId, percentage) {
 function connectWebSocket() {
     try {
         ws = new WebSocket(WS_URL);
+        ws.binaryType = 'arraybuffer';
 
         ws.onopen = () => {
             console.log('✅ Connected to JARVIS backend');
@@ -224,19 +257,33 @@ function connectWebSocket() {
             clearInterval(reconnectInterval);
             reconnectInterval = null;
 
-            // Request history when connected
-            if (ws && ws.readyState === WebSocket.OPEN) {
-                ws.send(JSON.stringify({
-                    type: 'get_history',
-                    payload: {}
-                }));
+            ws.send(JSON.stringify({ type: 'hello', payload: { encodings: WIRE_ENCODINGS } }));
+
+            // Replies of this tab's session keep coming to us as audio after a reconnect
+            if (audioOutputEnabled) {
+                enableAudioOutput();
+            }
+
+            // First connect: load the newest page. Reconnect: only ask for what we missed.
+            if (historyLastId === null) {
+                requestHistory(true);
+            } else {
+                subscribeHistory();
             }
         };
 
         ws.onmessage = (event) => {
             try {
-                const data = JSON.parse(event.data);
-                handleWebSocketMessage(data);
+                if (event.data instanceof ArrayBuffer) {
+                    const bytes = new Uint8Array(event.data);
+                    if (bytes[0] === FRAME_MESSAGE) {
+                        handleWebSocketMessage(expandMessage(decodeMsgpack(bytes.subarray(1))));
+                    } else {
+                        handleBinaryFrame(event.data);
+                    }
+                    return;
+                }
+                handleWebSocketMessage(expandMessage(JSON.parse(event.data)));
             } catch (error) {
                 console.error('Error parsing WebSocket message:', error);
             }
@@ -277,9 +324,16 @@ function handleWebSocketMessage(data) {
     const { type, payload } = data;
 
     switch (type) {
-        case 'status':
-            updateSystemStatus(payload);
+        case 'hello':
+            messageTypes = payload.types || [];
+            console.log(`🔗 Wire encoding: ${payload.encoding}`);
             break;
+        case 'status': {
+            const session = payload.session || VOICE_SESSION;
+            sessionStatus[session] = { ...sessionStatus[session], ...payload };
+            updateSystemStatus(sessionStatus[session]);
+            break;
+        }
         case 'user_speech':
             addLogEntry('user', payload.text);
             break;
@@ -287,14 +341,106 @@ function handleWebSocketMessage(data) {
             addLogEntry('jarvis', payload.text);
             break;
         case 'state_change':
-            updateReactorState(payload.state);
+            sessionStates[payload.session || VOICE_SESSION] = payload.state;
+            updateReactorState(shownState());
             break;
         case 'history_data':
-            displayHistory(payload.history || []);
+            receiveHistoryPage(payload);
+            break;
+        case 'history_delta':
+            (payload.history || []).forEach(addHistoryItem);
+            break;
+        case 'history_append':
+            addHistoryItem(payload);
+            break;
+        case 'tts_start':
+            startTtsStream(payload);
+            break;
+        case 'tts_end':
+            endTtsStream();
+            break;
+        case 'action_result':
+            addLogEntry('system', `⚙️ ${payload.result} (${payload.seconds.toFixed(1)}s)`);
+            break;
+        case 'turn_cancelled':
+            // A newer command (or the stop key) replaced this one: stop its speech here too
+            ttsAudio.pause();
+            addLogEntry('system', `${payload.reason === 'superseded' ? 'Superseded' : 'Cancelled'}: ${payload.text || 'voice command'}`);
             break;
     }
 }
 
+// [type code, payload] (compact JSON or MessagePack) → { type, payload }
+function expandMessage(data) {
+    if (!Array.isArray(data)) return data;
+    const [kind, payload] = data;
+    return { type: typeof kind === 'number' ? messageTypes[kind] : kind, payload };
+}
+
+// Minimal MessagePack decoder for the types the server sends
+function decodeMsgpack(bytes) {
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    const utf8 = new TextDecoder();
+    let pos = 0;
+
+    const str = (n) => utf8.decode(bytes.subarray(pos, pos += n));
+    const bin = (n) => bytes.slice(pos, pos += n);
+    const array = (n) => {
+        const out = new Array(n);
+        for (let i = 0; i < n; i++) out[i] = read();
+        return out;
+    };
+    const map = (n) => {
+        const out = {};
+        for (let i = 0; i < n; i++) {
+            const key = read();
+            out[key] = read();
+        }
+        return out;
+    };
+    const u8 = () => view.getUint8(pos++);
+    const u16 = () => { const v = view.getUint16(pos); pos += 2; return v; };
+    const u32 = () => { const v = view.getUint32(pos); pos += 4; return v; };
+
+    function read() {
+        const b = u8();
+        if (b <= 0x7f) return b;
+        if (b >= 0xe0) return b - 0x100;
+        if ((b & 0xf0) === 0x80) return map(b & 0x0f);
+        if ((b & 0xf0) === 0x90) return array(b & 0x0f);
+        if ((b & 0xe0) === 0xa0) return str(b & 0x1f);
+        let v;
+        switch (b) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return bin(u8());
+            case 0xc5: return bin(u16());
+            case 0xc6: return bin(u32());
+            case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+            case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+            case 0xcc: return u8();
+            case 0xcd: return u16();
+            case 0xce: return u32();
+            case 0xcf: v = Number(view.getBigUint64(pos)); pos += 8; return v;
+            case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+            case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+            case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+            case 0xd3: v = Number(view.getBigInt64(pos)); pos += 8; return v;
+            case 0xd9: return str(u8());
+            case 0xda: return str(u16());
+            case 0xdb: return str(u32());
+            case 0xdc: return array(u16());
+            case 0xdd: return array(u32());
+            case 0xde: return map(u16());
+            case 0xdf: return map(u32());
+        }
+        throw new Error(`Unsupported MessagePack byte 0x${b.toString(16)}`);
+    }
+
+    return read();
+}
+
 function updateSystemStatus(status) {
     // Update any system status indicators
     if (status.voiceRecognition) {
@@ -302,6 +448,11 @@ function updateSystemStatus(status) {
     }
 }
 
+function shownState() {
+    const own = sessionStates[sessionId];
+    return own && own !== 'idle' ? own : sessionStates[VOICE_SESSION];
+}
+
 function updateReactorState(state) {
     const core = document.querySelector('.core-main');
     const coreInner = document.querySelector('.core-inner');
@@ -395,7 +546,7 @@ function sendCommand() {
     if (ws && ws.readyState === WebSocket.OPEN) {
         ws.send(JSON.stringify({
             type: 'text_command',
-            payload: { text: command }
+            payload: { text: command, session: sessionId }
         }));
         addLogEntry('user', command);
     } else {
@@ -407,6 +558,184 @@ function sendCommand() {
     input.focus();
 }
 
+// ===== AUDIO STREAMING =====
+// Hold the mic button to talk: the mic is streamed to the server's STT as PCM and the
+// reply is streamed back as MP3 and played here instead of on the server's speakers.
+const MIC_WORKLET = `
+class PcmCapture extends AudioWorkletProcessor {
+    constructor() {
+        super();
+        this.buffer = new Int16Array(4096);
+        this.length = 0;
+        this.port.onmessage = () => {
+            this.flush();
+            this.port.postMessage('flushed');
+        };
+    }
+    flush() {
+        if (this.length) {
+            const pcm = this.buffer.slice(0, this.length);
+            this.port.postMessage(pcm.buffer, [pcm.buffer]);
+            this.length = 0;
+        }
+    }
+    process(inputs) {
+        const samples = inputs[0][0];
+        if (samples) {
+            for (let i = 0; i < samples.length; i++) {
+                const s = Math.max(-1, Math.min(1, samples[i]));
+                this.buffer[this.length++] = s < 0 ? s * 0x8000 : s * 0x7fff;
+                if (this.length === this.buffer.length) this.flush();
+            }
+        }
+        return true;
+    }
+}
+registerProcessor('pcm-capture', PcmCapture);
+`;
+
+let audioOutputEnabled = false;
+let micContext = null;
+let micStream = null;
+let micNode = null;
+let recording = false;
+let stopRequested = false;  // Button released while the mic was still starting
+
+let ttsAudio = new Audio();
+let ttsMediaSource = null;
+let ttsSourceBuffer = null;
+let ttsPending = [];   // Chunks waiting to be appended (or, without MediaSource, the whole clip)
+let ttsEnded = false;
+
+function enableAudioOutput() {
+    audioOutputEnabled = true;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({
+            type: 'audio_output',
+            payload: { enabled: true, session: sessionId }
+        }));
+    }
+}
+
+function sendFrame(type, buffer) {
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+    const frame = new Uint8Array(buffer.byteLength + 1);
+    frame[0] = type;
+    frame.set(new Uint8Array(buffer), 1);
+    ws.send(frame.buffer);
+}
+
+async function startRecording() {
+    if (recording || !ws || ws.readyState !== WebSocket.OPEN) return;
+    recording = true;
+    stopRequested = false;
+    try {
+        if (!micContext) {
+            micContext = new AudioContext();
+            const url = URL.createObjectURL(new Blob([MIC_WORKLET], { type: 'application/javascript' }));
+            await micContext.audioWorklet.addModule(url);
+        }
+        await micContext.resume();
+        micStream = await navigator.mediaDevices.getUserMedia({
+            audio: { channelCount: 1, echoCancellation: true, noiseSuppression: true }
+        });
+        enableAudioOutput();
+        ws.send(JSON.stringify({
+            type: 'audio_start',
+            payload: { session: sessionId, sampleRate: micContext.sampleRate }
+        }));
+        micNode = new AudioWorkletNode(micContext, 'pcm-capture', { numberOfOutputs: 0 });
+        micNode.port.onmessage = (event) => {
+            if (event.data === 'flushed') {
+                finishRecording();
+            } else {
+                sendFrame(FRAME_MIC_PCM, event.data);
+            }
+        };
+        micContext.createMediaStreamSource(micStream).connect(micNode);
+        if (elements.micBtn) elements.micBtn.classList.add('recording');
+        if (elements.inputStatus) elements.inputStatus.textContent = 'Listening...';
+        if (stopRequested) stopRecording();
+    } catch (error) {
+        console.error('Microphone error:', error);
+        addLogEntry('system', 'Microphone unavailable: ' + error.message);
+        recording = false;
+    }
+}
+
+function stopRecording() {
+    if (!recording) return;
+    if (!micNode) {
+        stopRequested = true;
+        return;
+    }
+    // The worklet sends what it still holds, then 'flushed' ends the utterance
+    micNode.port.postMessage('flush');
+}
+
+function finishRecording() {
+    recording = false;
+    if (micStream) micStream.getTracks().forEach(track => track.stop());
+    if (micNode) micNode.disconnect();
+    micStream = null;
+    micNode = null;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'audio_end', payload: {} }));
+    }
+    if (elements.micBtn) elements.micBtn.classList.remove('recording');
+    if (elements.inputStatus) elements.inputStatus.textContent = 'Ready';
+}
+
+function handleBinaryFrame(buffer) {
+    const bytes = new Uint8Array(buffer);
+    if (bytes[0] === FRAME_TTS_AUDIO) {
+        ttsPending.push(bytes.subarray(1));
+        pumpTts();
+    }
+}
+
+function startTtsStream() {
+    ttsPending = [];
+    ttsEnded = false;
+    ttsSourceBuffer = null;
+    ttsMediaSource = null;
+    ttsAudio.pause();
+    if (window.MediaSource && MediaSource.isTypeSupported('audio/mpeg')) {
+        // Play while the reply is still arriving
+        const mediaSource = new MediaSource();
+        ttsMediaSource = mediaSource;
+        ttsAudio.src = URL.createObjectURL(mediaSource);
+        mediaSource.addEventListener('sourceopen', () => {
+            if (ttsMediaSource !== mediaSource) return;
+            ttsSourceBuffer = mediaSource.addSourceBuffer('audio/mpeg');
+            ttsSourceBuffer.addEventListener('updateend', pumpTts);
+            pumpTts();
+        }, { once: true });
+        ttsAudio.play().catch(error => console.error('Audio playback error:', error));
+    }
+}
+
+function pumpTts() {
+    if (!ttsSourceBuffer || ttsSourceBuffer.updating) return;
+    if (ttsPending.length) {
+        ttsSourceBuffer.appendBuffer(ttsPending.shift());
+    } else if (ttsEnded && ttsMediaSource.readyState === 'open') {
+        ttsMediaSource.endOfStream();
+    }
+}
+
+function endTtsStream() {
+    ttsEnded = true;
+    if (ttsMediaSource) {
+        pumpTts();
+    } else if (ttsPending.length) {
+        // No MediaSource support for MP3: play the whole clip once it is complete
+        ttsAudio.src = URL.createObjectURL(new Blob(ttsPending, { type: 'audio/mpeg' }));
+        ttsPending = [];
+        ttsAudio.play().catch(error => console.error('Audio playback error:', error));
+    }
+}
+
 // ===== HISTORY SIDEBAR =====
 function parseTimestamp(timestamp) {
     // Parse timestamp format: YYYYMMDD-HHMMSS
@@ -442,6 +771,79 @@ function getDateLabel(date) {
     }
 }
 
+function requestHistory(reset) {
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+    if (!reset && !historyNextCursor) return;
+
+    ws.send(JSON.stringify({
+        type: 'get_history',
+        payload: {
+            cursor: reset ? null : historyNextCursor,
+            limit: HISTORY_PAGE_SIZE,
+            query: historyQuery
+        }
+    }));
+}
+
+function subscribeHistory() {
+    if (!ws || ws.readyState !== WebSocket.OPEN) return;
+
+    ws.send(JSON.stringify({
+        type: 'subscribe_history',
+        payload: { last_id: historyLastId }
+    }));
+}
+
+// Page order: newest timestamp first, then newest id
+function isNewerHistoryItem(a, b) {
+    const ta = a.timestamp || '';
+    const tb = b.timestamp || '';
+    return ta !== tb ? ta > tb : a.id > b.id;
+}
+
+function addHistoryItem(item) {
+    if (historyLastId !== null && item.id <= historyLastId) return;
+    historyLastId = item.id;
+
+    // While a search is active the list shows search results only
+    if (historyQuery) return;
+    if (historyItems.some(other => other.id === item.id)) return;
+
+    // Merged imports arrive with old timestamps: place them by time, not on top
+    const index = historyItems.findIndex(other => isNewerHistoryItem(item, other));
+    if (index === -1) {
+        if (historyNextCursor) return;  // Older than everything loaded: a later page has it
+        historyItems.push(item);
+    } else {
+        historyItems.splice(index, 0, item);
+    }
+    displayHistory(historyItems);
+}
+
+function receiveHistoryPage(payload) {
+    // Ignore pages for a search the user has already changed
+    if ((payload.query || '') !== historyQuery) return;
+
+    const page = payload.history || [];
+    historyItems = payload.cursor ? historyItems.concat(page) : page;
+    historyNextCursor = payload.next_cursor || null;
+    displayHistory(historyItems);
+
+    // After the first unfiltered page, follow live appends from the newest id it saw
+    if (!payload.cursor && !historyQuery && historyLastId === null) {
+        historyLastId = payload.last_id !== undefined ? payload.last_id : (page.length ? page[0].id : 0);
+        subscribeHistory();
+    }
+
+    if (historyQuery) {
+        elements.historyList.querySelectorAll('.history-date-items').forEach(folder => {
+            folder.classList.add('open');
+            const icon = folder.previousElementSibling.querySelector('.history-date-icon');
+            if (icon) icon.textContent = '▼';
+        });
+    }
+}
+
 function displayHistory(history) {
     const list = elements.historyList;
     if (!list) return;
@@ -504,6 +906,10 @@ function displayHistory(history) {
         `;
     });
 
+    if (historyNextCursor) {
+        html += '<div class="history-empty history-load-more" onclick="requestHistory(false)">Load older…</div>';
+    }
+
     list.innerHTML = html;
 }
 
@@ -554,6 +960,13 @@ function setupEventListeners() {
         elements.sendBtn.addEventListener('click', sendCommand);
     }
 
+    // Mic button - hold to talk
+    if (elements.micBtn) {
+        elements.micBtn.addEventListener('pointerdown', startRecording);
+        elements.micBtn.addEventListener('pointerup', stopRecording);
+        elements.micBtn.addEventListener('pointerleave', stopRecording);
+    }
+
     // Command input - Enter key
     if (elements.commandInput) {
         elements.commandInput.addEventListener('keypress', (e) => {
@@ -562,6 +975,12 @@ function setupEventListeners() {
                 sendCommand();
             }
         });
+        // Escape stops the running reply and drops queued commands
+        elements.commandInput.addEventListener('keydown', (e) => {
+            if (e.key === 'Escape' && ws && ws.readyState === WebSocket.OPEN) {
+                ws.send(JSON.stringify({ type: 'cancel', payload: { session: sessionId } }));
+            }
+        });
     }
 
     // History toggle
@@ -570,12 +989,9 @@ function setupEventListeners() {
             if (elements.historySidebar) {
                 elements.historySidebar.classList.add('open');
 
-                // Request history from backend
-                if (ws && ws.readyState === WebSocket.OPEN) {
-                    ws.send(JSON.stringify({
-                        type: 'get_history',
-                        payload: {}
-                    }));
+                // The subscription keeps the list current; only load if nothing is there yet
+                if (historyItems.length === 0) {
+                    requestHistory(true);
                 }
             }
         });
@@ -593,34 +1009,12 @@ function setupEventListeners() {
     // History search
     if (elements.historySearch) {
         elements.historySearch.addEventListener('input', (e) => {
-            const query = e.target.value.toLowerCase();
-            const items = elements.historyList.querySelectorAll('.history-item');
-            const folders = elements.historyList.querySelectorAll('.history-date-folder');
-
-            items.forEach(item => {
-                const text = item.textContent.toLowerCase();
-                const matches = text.includes(query);
-                item.style.display = matches ? 'block' : 'none';
-
-                // If item matches, expand its parent folder
-                if (matches && query) {
-                    const parentFolder = item.closest('.history-date-items');
-                    if (parentFolder && !parentFolder.classList.contains('open')) {
-                        parentFolder.classList.add('open');
-                        const icon = parentFolder.previousElementSibling.querySelector('.history-date-icon');
-                        if (icon) icon.textContent = '▼';
-                    }
-                }
-            });
-
-            // Hide folders with no visible items
-            folders.forEach(folder => {
-                const itemsContainer = folder.querySelector('.history-date-items');
-                const visibleItems = Array.from(itemsContainer.querySelectorAll('.history-item'))
-                    .filter(item => item.style.display !== 'none');
-
-                folder.style.display = visibleItems.length > 0 ? 'block' : 'none';
-            });
+            // Search runs on the server; debounce so typing doesn't flood it
+            clearTimeout(historySearchTimer);
+            historySearchTimer = setTimeout(() => {
+                historyQuery = e.target.value.trim();
+                requestHistory(true);
+            }, 300);
         });
     }
 
@@ -1,5 +1,7 @@
 import speech_recognition as sr
 import config
+import metrics_engine
+import trace_engine
 
 def listen_for_wake_word():
     """
@@ -10,26 +12,34 @@ def listen_for_wake_word():
     
     with sr.Microphone() as source:
         # Only adjust for noise occasionally or with shorter duration
-        recognizer.adjust_for_ambient_noise(source, duration=0.3)
+        with trace_engine.span("wake.calibrate"):
+            recognizer.adjust_for_ambient_noise(source, duration=0.3)
         
         try:
             print("👂 Listening for 'Jarvis'...")
-            audio = recognizer.listen(source, timeout=5, phrase_time_limit=3)
+            with trace_engine.span("wake.listen"):
+                audio = recognizer.listen(source, timeout=5, phrase_time_limit=3)
             print("⏳ Processing wake word...")
-            text = recognizer.recognize_google(audio).lower()
+            with metrics_engine.timer("wake_recognize_seconds"), trace_engine.span("wake.recognize"):
+                text = recognizer.recognize_google(audio).lower()
             print(f"🎤 Heard: '{text}'")
             
             if "jarvis" in text:
                 print("✨ Wake word detected!")
+                metrics_engine.inc("wake_checks_total", result="detected")
                 return text
+            metrics_engine.inc("wake_checks_total", result="other_speech")
         except sr.WaitTimeoutError:
+            metrics_engine.inc("wake_checks_total", result="silence")
             return False
         except sr.UnknownValueError:
             # This means it heard something but couldn't understand it
             # print("❓ Could not understand audio")
+            metrics_engine.inc("wake_checks_total", result="unclear")
             return False
         except Exception as e:
             print(f"⚠️ Wake word error: {e}")
+            metrics_engine.inc("wake_checks_total", result="error")
             return False
             
     return False
@@ -5,16 +5,17 @@ Provides real-time communication between the web interface and Jarvis backend
 """
 
 import asyncio
+import collections
 import websockets
-import json
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 import time
 import threading
 import sys
 import os
-import queue
+from concurrent.futures import ThreadPoolExecutor
 
-# Global command queue for text input
-command_queue = queue.Queue()
+# Voice events, awaited by jarvis_loop: ('wake', transcript) from the wake word listener thread
+command_queue = asyncio.Queue()
 
 # Fix Windows console encoding for emojis
 if sys.platform == 'win32':
@@ -22,13 +23,18 @@ if sys.platform == 'win32':
     sys.stderr.reconfigure(encoding='utf-8')
 
 from datetime import datetime
-from typing import Set, Dict, Any
-
-# Import existing Jarvis modules
-from wake_engine import listen_for_wake_word
-from speech_engine import listen_for_command, tts_speak, play_audio_blocking
-from ai_engine import get_ai_response
-from actions_engine import execute_action
+from typing import Set, Dict, Any, Tuple
+
+# Import existing Jarvis modules (the wake engine is loaded by jarvis_loop: --fake-ai runs without it)
+from summary_engine import SessionSummarizer
+from turn_pipeline import TurnPipeline, FakeBackends, bind_cancel
+from command_scheduler import Command, CommandQueue, TurnSlots
+import history_store
+import background_writer
+import semantic_memory
+import metrics_engine
+import wire_codec
+import trace_engine
 import os
 import re
 
@@ -39,8 +45,54 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 AUDIO_DIR = os.path.join(BASE_DIR, "audio")
 LOGS_DIR = os.path.join(BASE_DIR, "logs")
 
+# History pagination
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 500
+HISTORY_MAX_TEXT = 4000  # Long imported answers are cut so one page stays small
+HISTORY_DELTA_CHUNK = 200  # Entries per history_delta frame when a client catches up
+HISTORY_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history")
+
+# Typed conversations: turns in flight across all sessions, and how long an
+# abandoned session (no clients, no commands) is kept before it is closed
+MAX_CONCURRENT_TURNS = 4
+EXIT_COMMANDS = ["exit", "quit", "shutdown", "stop", "bye"]
+SESSION_IDLE_TIMEOUT = 600
+
+# Per-client outbox: messages queued before a client is dropped as too slow, and
+# how long one send may stall. state_change/status messages are coalesced per session instead
+CLIENT_QUEUE_DEPTH = 256
+CLIENT_SEND_TIMEOUT = 10
+COALESCED_TYPES = {'state_change', 'status'}
+
+# Binary frames carry audio: one type byte, then the data.
+# Mic frames are 16-bit mono PCM at the rate given in audio_start; TTS frames are MP3
+FRAME_MIC_PCM = 0x01    # client → server
+FRAME_TTS_AUDIO = 0x02  # server → client, between tts_start and tts_end
+MAX_UTTERANCE_SECONDS = 30
+
+# permessage-deflate: small windows keep per-connection zlib memory low, and
+# level 1 roughly halves the CPU of a history page for ~10% more bytes
+# (most other frames are small, and MP3 frames don't compress at all)
+DEFLATE_WINDOW_BITS = 12
+DEFLATE_MEM_LEVEL = 5
+DEFLATE_LEVEL = 1
+
+# Prometheus text endpoint (metrics_engine), served on HOST only
+METRICS_PORT = 8766
+
+# Event loop lag: how late a LOOP_LAG_INTERVAL sleep wakes up (blocking calls on the loop show here)
+LOOP_LAG_INTERVAL = 0.5
+
+# --fake-ai: canned replies (FakeBackends) and no mic, for load_test.py. History
+# goes to a scratch copy of the database; logs, traces and session files to a temp dir
+FAKE_AI = False
+FAKE_AI_LATENCY = 0.05
+
 # Connected clients
-connected_clients: Set[websockets.WebSocketServerProtocol] = set()
+connected_clients: Set['ClientConnection'] = set()
+
+# Clients following live history: client -> {'syncing': bool, 'buffer': [entries]}
+history_subscribers: Dict[Any, Dict[str, Any]] = {}
 
 # Global state
 jarvis_state = {
@@ -48,352 +100,800 @@ jarvis_state = {
     'is_running': False
 }
 
+IDLE_STATUS = {
+    'voiceRecognition': 'Standby',
+    'audioOutput': 'Ready',
+    'processing': 'Idle'
+}
 
-async def broadcast_message(message: Dict[str, Any]):
-    """Broadcast a message to all connected clients"""
-    if connected_clients:
-        message_json = json.dumps(message)
-        await asyncio.gather(
-            *[client.send(message_json) for client in connected_clients],
-            return_exceptions=True
-        )
-
-
-async def send_status_update(status: Dict[str, str]):
-    """Send system status update to all clients"""
-    await broadcast_message({
-        'type': 'status',
-        'payload': status
-    })
+# Last status of the voice session sent to clients; only changed keys are broadcast
+jarvis_status = dict(IDLE_STATUS)
+
+# Turn stages (capture, STT, LLM, actions, TTS, playback); created when the server starts
+pipeline: TurnPipeline = None
+
+
+class ClientConnection:
+    """
+    A connected UI client with its own bounded outbox, drained by a sender task,
+    so a slow browser only ever delays itself. Pending state_change and status
+    messages are coalesced per session (only the latest state, merged status
+    fields), so one session's updates never overwrite another's. A
+    client whose outbox overflows or whose send stalls for CLIENT_SEND_TIMEOUT
+    is disconnected; the UI reconnects and catches up through subscribe_history.
+    """
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.id = id(websocket)
+        self.outbox = collections.deque()  # (type, encoded message), or ((type, session), None) when coalesced
+        self.coalesced: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.closed = False
+        self.codec = wire_codec.DEFAULT_CODEC  # Switched by the client's hello message
+        self.audio_output = False  # Client plays its session's replies itself (audio_output message)
+        self.utterance = None      # Mic audio being streamed: {'session', 'rate', 'pcm'}
+        self.sender = asyncio.create_task(self.run())
+
+    def _has_room(self):
+        if len(self.outbox) < CLIENT_QUEUE_DEPTH:
+            return True
+        metrics_engine.inc('ws_messages_dropped_total', reason='overflow')
+        self.disconnect("send queue full")
+        return False
+
+    def encode(self, message: Dict[str, Any], cache: Dict[str, Any] = None):
+        """Message in this client's encoding (cache: encodings shared across a broadcast)"""
+        if cache is not None and self.codec.name in cache:
+            return cache[self.codec.name]
+        start = time.perf_counter()
+        encoded = wire_codec.encode(self.codec, message, cache)
+        metrics_engine.inc('ws_encode_seconds_total', time.perf_counter() - start, encoding=self.codec.name)
+        return encoded
+
+    def send(self, message: Dict[str, Any], cache: Dict[str, Any] = None):
+        """Queue a message without waiting"""
+        if self.closed:
+            return
+        kind = message['type']
+        if kind in COALESCED_TYPES:
+            key = (kind, message['payload'].get('session'))
+            if key in self.coalesced:
+                metrics_engine.inc('ws_messages_coalesced_total', type=kind)
+                if kind == 'status':
+                    self.coalesced[key].update(message['payload'])
+                else:
+                    self.coalesced[key] = dict(message['payload'])
+                return
+            self.coalesced[key] = dict(message['payload'])
+            kind, encoded = key, None  # Encoded when it is sent, with whatever was merged into it
+        elif not self._has_room():
+            return
+        else:
+            encoded = self.encode(message, cache)
+        self.outbox.append((kind, encoded))
+        self.ready.set()
+
+    def send_binary(self, frame: bytes):
+        """Queue a binary (audio) frame"""
+        if not self.closed and self._has_room():
+            self.outbox.append(('binary', frame))
+            self.ready.set()
+
+    async def put(self, message: Dict[str, Any]):
+        """Queue a reply to this client's own request, waiting while its outbox is over half full"""
+        while len(self.outbox) >= CLIENT_QUEUE_DEPTH // 2 and not self.closed:
+            self.drained.clear()
+            await self.drained.wait()
+        self.send(message)
+
+    async def run(self):
+        """Sender task: one message at a time, in order"""
+        try:
+            while True:
+                while not self.outbox:
+                    self.ready.clear()
+                    await self.ready.wait()
+                kind, encoded = self.outbox.popleft()
+                if encoded is None:
+                    encoded = self.encode({'type': kind[0], 'payload': self.coalesced.pop(kind)})
+                if len(self.outbox) < CLIENT_QUEUE_DEPTH // 2:
+                    self.drained.set()
+                try:
+                    await asyncio.wait_for(self.websocket.send(encoded), CLIENT_SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.disconnect(f"send stalled for {CLIENT_SEND_TIMEOUT}s")
+                    return
+                metrics_engine.inc('ws_messages_sent_total')
+                metrics_engine.inc('ws_bytes_sent_total', len(encoded), encoding=self.codec.name if kind != 'binary' else 'audio')
+        except websockets.exceptions.ConnectionClosed:
+            self.closed = True
+
+    def disconnect(self, reason: str):
+        """Drop a client that can't keep up"""
+        if self.closed:
+            return
+        self.closed = True
+        self.drained.set()
+        metrics_engine.inc('ws_slow_clients_disconnected_total')
+        metrics_engine.inc('ws_messages_dropped_total', len(self.outbox), reason='disconnected')
+        self.outbox.clear()
+        print(f"🐢 Disconnecting slow client {self.id}: {reason}")
+        asyncio.create_task(self.websocket.close(code=1013, reason="client too slow"))
 
+    def close(self):
+        self.closed = True
+        self.drained.set()
+        self.sender.cancel()
+
+
+def outbox_depths():
+    return [len(client.outbox) for client in connected_clients]
 
-async def send_state_change(state: str):
-    """Send state change notification to all clients"""
-    jarvis_state['current_state'] = state
-    await broadcast_message({
-        'type': 'state_change',
-        'payload': {'state': state}
-    })
 
+metrics_engine.gauge_fn('ws_clients', lambda: len(connected_clients))
+metrics_engine.gauge_fn('ws_send_queue_depth_total', lambda: sum(outbox_depths()))
+metrics_engine.gauge_fn('ws_send_queue_depth_max', lambda: max(outbox_depths(), default=0))
 
-async def send_user_speech(text: str):
-    """Send user speech to all clients"""
-    await broadcast_message({
+
+def send_to(clients, message: Dict[str, Any]):
+    """Queue a message for the given clients (encoded once per encoding in use)"""
+    if clients:
+        cache = {}
+        for client in list(clients):
+            client.send(message, cache)
+
+
+def send_audio(clients, frame_type: int, data: bytes):
+    """Queue one binary audio frame for the given clients"""
+    frame = bytes([frame_type]) + data
+    for client in list(clients):
+        client.send_binary(frame)
+
+
+def broadcast_message(message: Dict[str, Any]):
+    """Broadcast a message to all connected clients"""
+    send_to(connected_clients, message)
+
+
+def send_user_speech(clients, text: str, history_id: int = None):
+    """Send user speech to a session's clients"""
+    send_to(clients, {
         'type': 'user_speech',
         'payload': {
             'text': text,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': datetime.now().isoformat(),
+            'id': history_id
         }
     })
 
 
-async def send_jarvis_response(text: str, response_time: int = None):
-    """Send Jarvis response to all clients"""
-    await broadcast_message({
+def send_jarvis_response(clients, text: str, response_time: int = None, history_id: int = None):
+    """Send Jarvis response to a session's clients"""
+    send_to(clients, {
         'type': 'jarvis_response',
         'payload': {
             'text': text,
             'timestamp': datetime.now().isoformat(),
-            'responseTime': response_time
+            'responseTime': response_time,
+            'id': history_id
         }
     })
 
 
-async def send_error(message: str):
-    """Send error message to all clients"""
-    await broadcast_message({
+def send_error(clients, message: str):
+    """Send error message to a session's clients"""
+    send_to(clients, {
         'type': 'error',
         'payload': {'message': message}
     })
 
 
-async def handle_get_history(websocket):
-    """Handle request for conversation history"""
+def trim_history_items(items):
+    """Cut very long texts so history frames stay small"""
+    for item in items:
+        if len(item['text']) > HISTORY_MAX_TEXT:
+            item['text'] = item['text'][:HISTORY_MAX_TEXT]
+            item['truncated'] = True
+    return items
+
+
+async def handle_get_history(client, request: Dict[str, Any] = None):
+    """
+    Handle request for one page of conversation history (newest first).
+    Request payload: cursor, limit, since, until, query - all optional.
+    """
+    request = request or {}
     try:
-        history_file = os.path.join(BASE_DIR, "memory", "history.jsonl")
+        limit = max(1, min(int(request.get('limit') or HISTORY_PAGE_SIZE), HISTORY_MAX_PAGE_SIZE))
+        cursor = request.get('cursor')
         
-        if not os.path.exists(history_file):
-            await websocket.send(json.dumps({
-                'type': 'history_data',
-                'payload': {'history': [], 'error': 'No history file found'}
-            }))
-            return
+        def load_page():
+            store = history_store.get_store()
+            # Read before the page: a row saved in between comes again as a delta rather than never
+            last_id = store.last_id()
+            return store.page(
+                cursor=cursor,
+                limit=limit,
+                since=request.get('since'),
+                until=request.get('until'),
+                query=request.get('query'),
+            ) + (last_id,)
         
-        history_items = []
-        with open(history_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    try:
-                        item = json.loads(line)
-                        history_items.append(item)
-                    except json.JSONDecodeError:
-                        continue
+        # SQLite work runs off the event loop so other clients aren't blocked
+        loop = asyncio.get_running_loop()
+        history_items, next_cursor, last_id = await loop.run_in_executor(HISTORY_EXECUTOR, load_page)
+        trim_history_items(history_items)
         
-        # Send history data to client
-        await websocket.send(json.dumps({
+        # Send history data to client; last_id is where a subscription should start
+        # (pages are in time order, so the first item needn't have the newest id)
+        await client.put({
             'type': 'history_data',
-            'payload': {'history': history_items}
-        }))
+            'payload': {
+                'history': history_items,
+                'cursor': cursor,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None,
+                'last_id': last_id,
+                'query': request.get('query') or ''
+            }
+        })
         
         print(f"📚 Sent {len(history_items)} history items to client")
         
     except Exception as e:
         print(f"❌ Error loading history: {e}")
-        await websocket.send(json.dumps({
+        await client.put({
             'type': 'history_data',
-            'payload': {'history': [], 'error': str(e)}
-        }))
-
-
-def save_to_history(role: str, text: str, timestamp: str):
-    """Save conversation item to history file"""
+            'payload': {'history': [], 'has_more': False, 'error': str(e)}
+        })
+
+
+async def handle_subscribe_history(client, request: Dict[str, Any] = None):
+    """
+    Follow history from a given id: send what the client missed as history_delta
+    frames, then every new entry as a history_append event.
+    Request payload: last_id (omit to follow from now on).
+    """
+    request = request or {}
+    subscription = {'syncing': True, 'buffer': []}
+    history_subscribers[client] = subscription
     try:
-        history_file = os.path.join(BASE_DIR, "memory", "history.jsonl")
+        loop = asyncio.get_running_loop()
+        store = history_store.get_store()
+        last_id = request.get('last_id')
+        if last_id is None:
+            last_id = await loop.run_in_executor(HISTORY_EXECUTOR, store.last_id)
+        last_id = int(last_id)
         
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(history_file), exist_ok=True)
+        # Catch up in bounded chunks
+        sent = 0
+        while True:
+            items = await loop.run_in_executor(HISTORY_EXECUTOR, store.entries_after, last_id, HISTORY_DELTA_CHUNK)
+            complete = len(items) < HISTORY_DELTA_CHUNK
+            if items:
+                last_id = items[-1]['id']
+            await client.put({
+                'type': 'history_delta',
+                'payload': {'history': trim_history_items(items), 'last_id': last_id, 'complete': complete}
+            })
+            sent += len(items)
+            if complete:
+                break
         
-        entry = {
-            "role": role,
-            "text": text,
-            "timestamp": timestamp
-        }
+        # Entries saved while we were catching up were buffered; send the ones not covered above
+        while subscription['buffer']:
+            entry = subscription['buffer'].pop(0)
+            if entry['id'] > last_id:
+                last_id = entry['id']
+                await client.put({'type': 'history_append', 'payload': entry})
+        subscription['syncing'] = False
+        
+        print(f"📡 Client subscribed to history from id {last_id} ({sent} missed items sent)")
         
-        with open(history_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry) + "\n")
-            
     except Exception as e:
-        print(f"❌ Error saving history: {e}")
+        print(f"❌ Error subscribing to history: {e}")
+        history_subscribers.pop(client, None)
 
 
-# Global event loop reference
-MAIN_LOOP = None
+def broadcast_history_append(entry: Dict[str, Any]):
+    """Send a newly saved history entry to subscribed clients"""
+    targets = []
+    for client, subscription in list(history_subscribers.items()):
+        if subscription['syncing']:
+            subscription['buffer'].append(entry)
+        else:
+            targets.append(client)
+    send_to(targets, {'type': 'history_append', 'payload': trim_history_items([dict(entry)])[0]})
 
-def run_async(coro):
-    """Run an async coroutine from a different thread safely"""
-    if MAIN_LOOP and MAIN_LOOP.is_running():
-        try:
-            future = asyncio.run_coroutine_threadsafe(coro, MAIN_LOOP)
-            return future.result()
-        except Exception as e:
-            print(f"❌ Error running async: {e}")
-            coro.close()
-            return None
-    else:
-        # Loop not ready yet, just clean up
-        coro.close()
+
+async def save_to_history(role: str, text: str, timestamp: str, session: str = None):
+    """Save conversation item to the history database and return its id"""
+    try:
+        loop = asyncio.get_running_loop()
+        with trace_engine.span("history.save", role=role):
+            history_id = await loop.run_in_executor(HISTORY_EXECUTOR, history_store.append, role, text, timestamp, session)
+        entry = {'id': history_id, 'role': role, 'text': text, 'timestamp': timestamp}
+        if session:
+            entry['session'] = session
+        broadcast_history_append(entry)
+        
+        # Embed the new row on the background job thread, off the conversation path
+        if not FAKE_AI:
+            background_writer.run_coalesced(semantic_memory.refresh)
+        return history_id
+            
+    except Exception as e:
+        print(f"❌ Error saving history: {e}")
         return None
 
-# Event for wake word detection
-wake_word_event = threading.Event()
 
-# Queue for passing wake word text to jarvis_loop
-wake_word_result_queue = queue.Queue()
+# Event loop the server runs on (the wake word thread hands events to it)
+MAIN_LOOP = None
 
-def wake_word_listener():
+# Set while Jarvis is idle - the wake word listener blocks on it instead of polling
+wake_armed = threading.Event()
+wake_armed.set()
+
+def wake_word_listener(listen_for_wake_word):
     """Run wake word detection in a separate thread"""
     print("👂 Wake word listener thread started")
     while jarvis_state['is_running']:
         try:
-            # Only listen if we are in idle state (allow headless)
-            if jarvis_state['current_state'] == 'idle':
-                # listen_for_wake_word now returns either False or the transcript string
+            wake_armed.wait()
+            if not jarvis_state['is_running']:
+                break
+            # listen_for_wake_word returns either False or the transcript string
+            with trace_engine.trace("wake") as wake_trace:
                 wake_text = listen_for_wake_word()
-                if wake_text:
-                    print(f"🟢 Wake word detected (Thread): '{wake_text}'")
-                    wake_word_result_queue.put(wake_text)
-                    wake_word_event.set()
-                    # Wait for state to change before checking again
-                    while jarvis_state['current_state'] == 'idle' and jarvis_state['is_running'] and wake_word_event.is_set():
-                        time.sleep(0.1)
-            else:
-                time.sleep(0.5)
+                # A text command may have started a conversation while we were listening
+                detected = bool(wake_text) and wake_armed.is_set()
+                if not detected:
+                    wake_trace.discard()  # Only attempts that woke Jarvis are kept
+            if detected:
+                print(f"🟢 Wake word detected (Thread): '{wake_text}'")
+                wake_armed.clear()  # Re-armed when Jarvis goes back to idle
+                MAIN_LOOP.call_soon_threadsafe(command_queue.put_nowait, ('wake', wake_text, wake_trace.id))
         except Exception as e:
             print(f"❌ Error in wake word listener: {e}")
             time.sleep(1)
 
-def jarvis_loop():
-    """Main Jarvis loop running in a separate thread"""
+
+def extract_wake_command(wake_text: str):
+    """Command spoken in the same breath as the wake word ("Jarvis, what time is it")"""
+    match = re.search(r'jarvis\s*(.*)', wake_text.lower())
+    if match and match.group(1).strip():
+        command = match.group(1).strip()
+        print(f"💬 Extracted command from wake word: '{command}'")
+        return command
+    return None
+
+class ConversationSession:
+    """
+    One conversation: its context, the clients that see its replies and its
+    queue of commands (typed, or utterances streamed from a client's mic). Turns within a session run one at a time,
+    by priority; a newer command supersedes older ones (see command_scheduler). Different
+    sessions run side by side, at most MAX_CONCURRENT_TURNS at a time.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.clients: Set[Any] = set()
+        self.state = 'idle'
+        self.status = dict(IDLE_STATUS)
+        self.commands = CommandQueue()
+        self.worker = None
+        self.reset()
+
+    def reset(self):
+        """Start a fresh conversation (new context, new session id in history)"""
+        self.started = time.strftime("%Y%m%d-%H%M%S")
+        self.name = f"{self.started}-{self.key}"
+        self.history = []
+        self.summarizer = SessionSummarizer(self.name)
+
+    def recipients(self):
+        return self.clients
+
+    def send(self, send_fn, *args):
+        """send_* call addressed to this session's clients"""
+        send_fn(self.recipients(), *args)
+
+    def set_state(self, state: str):
+        """Change the session's state; its clients are only notified when it actually changes"""
+        if self.state == state:
+            return
+        self.state = state
+        update_wake_gate()
+        self.send(send_to, {'type': 'state_change', 'payload': {'state': state, 'session': self.key}})
+
+    def set_status(self, **changes):
+        """Update status fields; only the ones that changed are sent"""
+        changed = {key: value for key, value in changes.items() if self.status.get(key) != value}
+        self.status.update(changed)
+        if changed:
+            self.send(send_to, {'type': 'status', 'payload': dict(changed, session=self.key)})
+
+    def finish(self):
+        """Save the conversation (file + digest, in the background) and start a new one"""
+        if not FAKE_AI:
+            from memory_engine import save_session_history
+            save_session_history(self.history, self.name)
+        self.summarizer.finish(self.history, self.started)
+        self.reset()
+
+    def audio_clients(self):
+        """Clients that play this session's replies themselves (TTS is streamed to them)"""
+        return [client for client in self.recipients() if client.audio_output]
+
+    def submit(self, text: str = None, audio=None):
+        """Queue a typed command or a (pcm, sample_rate) utterance"""
+        if audio is not None:
+            kind = 'voice'
+        elif text.strip().lower() in EXIT_COMMANDS:
+            kind = 'system'  # "stop" cuts off whatever is running
+        else:
+            kind = 'typed'
+        superseded = self.commands.put(Command(kind, text, audio))
+        if superseded is None:
+            print(f"🔁 Duplicate command coalesced ({self.key}): {text}")
+        else:
+            self.notify_cancelled(superseded, 'superseded')
+        self.start()
+
+    def start(self):
+        """Start the worker if it isn't running; it also closes the session once idle with no clients"""
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.run())
+
+    def cancel(self):
+        """Drop the queued commands and stop the running turn (the UI's stop button)"""
+        self.notify_cancelled(self.commands.cancel_all(), 'cancelled')
+
+    def notify_cancelled(self, commands, reason: str):
+        for command in commands:
+            print(f"⏹️ Command {reason} ({self.key}): {command.text or 'voice'}")
+            self.send(send_to, {'type': 'turn_cancelled', 'payload': {'text': command.text, 'reason': reason}})
+
+    async def run(self):
+        """Worker: this session's turns by priority, until it has been idle with no clients"""
+        while True:
+            try:
+                command = await asyncio.wait_for(self.commands.get(), SESSION_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if self.clients:
+                    continue
+                print(f"💤 Closing idle session {self.key}")
+                sessions.pop(self.key, None)
+                if self.history:
+                    self.finish()
+                return
+            
+            # A task of its own, so a newer command can cancel it
+            command.task = asyncio.ensure_future(self.execute(command))
+            await asyncio.wait([command.task])
+            self.commands.done(command)
+            self.set_state('idle')
+            self.set_status(**IDLE_STATUS)
+
+    async def execute(self, command: Command):
+        """Run one command as a turn"""
+        bind_cancel(command.cancelled)
+        source = 'audio' if command.audio is not None else 'text'
+        with trace_engine.trace("turn", session=self.key, source=source, kind=command.kind):
+            try:
+                async with turn_slots.slot(command.priority):
+                    text = command.text
+                    if command.audio is not None:
+                        self.set_state('processing')
+                        text = await pipeline.transcribe_pcm(*command.audio)
+                        if not text:
+                            print(f"❓ Didn't catch that ({self.key})")
+                            self.send(send_error, "Didn't catch that.")
+                    if text:
+                        print(f"📨 Processing command ({self.key}): {text}")
+                        await run_turn(self, text)
+            except Exception as e:
+                print(f"❌ Error in session {self.key}: {e}")
+                self.send(send_error, str(e))
+
+
+class VoiceSession(ConversationSession):
+    """The local mic/speaker conversation: shown to every client, drives jarvis_state and the wake word"""
+
+    def __init__(self):
+        super().__init__('voice')
+        self.state = jarvis_state['current_state']
+        self.status = jarvis_status
+
+    def reset(self):
+        super().reset()
+        self.name = self.started  # Voice sessions keep the plain timestamp id
+
+    def recipients(self):
+        return connected_clients
+
+    def set_state(self, state: str):
+        jarvis_state['current_state'] = state
+        super().set_state(state)
+
+
+# Sessions by key: typed conversations per client (or client-chosen session id)
+sessions: Dict[str, ConversationSession] = {}
+voice_session = VoiceSession()
+turn_slots = TurnSlots(MAX_CONCURRENT_TURNS)
+
+metrics_engine.gauge_fn('sessions', lambda: len(sessions))
+metrics_engine.gauge_fn('sessions_busy', lambda: sum(1 for s in sessions.values() if s.state != 'idle'))
+metrics_engine.gauge_fn('session_commands_queued', lambda: sum(s.commands.qsize() for s in sessions.values()))
+metrics_engine.gauge_fn('turn_slots_waiting', turn_slots.waiting)
+
+
+def get_session(key: str) -> ConversationSession:
+    """The session for key, created with its worker running so the idle reaper always covers it"""
+    if key not in sessions:
+        sessions[key] = ConversationSession(key)
+        sessions[key].start()
+        print(f"🧵 New conversation session {key}")
+    return sessions[key]
+
+
+def update_wake_gate():
+    """The wake word listener only has the mic while nothing is listening or speaking"""
+    busy = voice_session.state != 'idle' or any(
+        s.state == 'speaking' and not s.audio_clients() for s in sessions.values()
+    )
+    if busy:
+        wake_armed.clear()
+    else:
+        wake_armed.set()
+
+
+async def stream_reply(clients, text: str):
+    """Send synthesized speech to clients as tts_start, binary MP3 frames, tts_end"""
+    send_to(clients, {'type': 'tts_start', 'payload': {'format': 'audio/mpeg'}})
+    sent = 0
+    try:
+        with trace_engine.span("ws.stream_reply", clients=len(clients)) as span:
+            sent = span["bytes"] = await pipeline.stream_speech(text, lambda chunk: send_audio(clients, FRAME_TTS_AUDIO, chunk))
+    finally:
+        send_to(clients, {'type': 'tts_end', 'payload': {'bytes': sent}})
+    return sent
+
+
+def report_action(session: ConversationSession, future):
+    """Tell the session's clients how one of a reply's actions went and how long it took"""
+    if not future.cancelled():
+        session.send(send_to, {'type': 'action_result', 'payload': future.result()})
+
+
+async def run_turn(session: ConversationSession, user_text: str):
+    """One command → reply turn of a session; returns False when the user ended the conversation"""
+    turn_start = time.perf_counter()
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    trace_engine.annotate(text=user_text[:80])
+    print(f"📝 You said: {user_text}")
+    history_id = await save_to_history("user", user_text, timestamp, session.name)
+    session.send(send_user_speech, user_text, history_id)
+    
+    # Check for exit commands
+    if user_text.strip().lower() in EXIT_COMMANDS:
+        print("👋 Exiting conversation mode...")
+        session.finish()
+        return False
+    
+    # Process with AI (with session context)
+    session.set_state('processing')
+    session.set_status(processing='Active')
+    
+    start_time = time.time()
+    ai_text, actions = await pipeline.think(user_text, session.history, session.summarizer.summary)
+    response_time = int((time.time() - start_time) * 1000)
+    print(f"🤖 Jarvis: {ai_text}")
+    
+    # Actions all start now, side by side; each is reported when it finishes. The turn
+    # doesn't wait for them (an app launch can take a while) and a newer command doesn't cancel them
+    for future in pipeline.dispatch_actions(actions):
+        future.add_done_callback(lambda done: report_action(session, done))
+    
+    # Speech synthesis and playback run while the reply is saved and shown
+    session.set_state('speaking')
+    session.set_status(audioOutput='Playing')
+    listeners = session.audio_clients() if session is not voice_session else []
+    if listeners:
+        # The client plays the reply: stream it down as it is synthesized, no file
+        tasks = [asyncio.ensure_future(stream_reply(listeners, ai_text))]
+    else:
+        suffix = "" if session is voice_session else f"-{session.key}"
+        response_audio = os.path.join(AUDIO_DIR, f"response_{timestamp}{suffix}.mp3")
+        tasks = [asyncio.ensure_future(pipeline.speak(ai_text, response_audio))]
+    
+    try:
+        history_id = await save_to_history("jarvis", ai_text, timestamp, session.name)
+        session.send(send_jarvis_response, ai_text, response_time, history_id)
+        
+        # Update session history
+        session.history.append(("User", user_text))
+        session.history.append(("Jarvis", ai_text))
+        session.summarizer.update(session.history)
+        
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"❌ Error in turn stage: {result}")
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()  # Stops TTS and playback (stage calls see the turn's cancel flag)
+        raise
+    metrics_engine.observe('turn_seconds', time.perf_counter() - turn_start,
+                           session='voice' if session is voice_session else 'typed')
+    
+    # Log interaction (written in the background)
+    log_file = os.path.join(LOGS_DIR, "jarvis_logs.txt")
+    background_writer.append(
+        log_file,
+        f"[{timestamp}] You: {user_text}\n[{timestamp}] Jarvis: {ai_text}\n\n"
+    )
+    return True
+
+
+async def jarvis_loop():
+    """Voice conversation loop: wake word, then spoken turns until the user says stop"""
+    # Imported here rather than at the top: the wake engine needs the speech SDKs
+    # and config.py, which the fake-AI load test runs without
+    try:
+        from wake_engine import listen_for_wake_word
+    except ImportError as e:
+        print(f"❌ Voice loop unavailable: {e}")
+        return
     print("🤖 Jarvis is online!")
     
     # Start wake word listener thread
-    wake_thread = threading.Thread(target=wake_word_listener, daemon=True)
+    wake_thread = threading.Thread(target=wake_word_listener, args=(listen_for_wake_word,), daemon=True)
     wake_thread.start()
     
+    session = voice_session
     while jarvis_state['is_running']:
         try:
-            # Check for text command first (Non-blocking)
-            try:
-                user_text = command_queue.get_nowait()
-                print(f"📨 Processing text command: {user_text}")
-                wake_word_detected = True
-            except queue.Empty:
-                user_text = None
-                wake_word_detected = False
-
-            # Check for wake word event (Non-blocking)
-            if not wake_word_detected and wake_word_event.is_set():
-                print("🟢 Wake word event received!")
-                wake_word_event.clear()
-                wake_word_detected = True
-                
-                # Check if there's trailing text after "Jarvis"
-                try:
-                    full_wake_text = wake_word_result_queue.get_nowait()
-                    # Try to find "jarvis" and take everything after it
-                    match = re.search(r'jarvis\s*(.*)', full_wake_text.lower())
-                    if match:
-                        potential_command = match.group(1).strip()
-                        if potential_command:
-                            print(f"💬 Extracted command from wake word: '{potential_command}'")
-                            user_text = potential_command
-                except queue.Empty:
-                    pass
+            session.set_state('idle')
+            session.set_status(**IDLE_STATUS)
             
-            # If nothing detected, loop again (short sleep to prevent CPU hogging)
-            if not wake_word_detected:
-                run_async(send_state_change('idle'))
-                run_async(send_status_update({
-                    'voiceRecognition': 'Standby',
-                    'processing': 'Idle'
-                }))
-                time.sleep(0.1)
-                continue
+            # Wait for the wake word
+            kind, value, wake_trace = await command_queue.get()
+            print("🟢 Wake word event received!")
+            user_text = extract_wake_command(value)
             
             # === CONVERSATION MODE ===
-            if wake_word_detected:
-                print("🟢 Entering conversation mode...")
-                session_start_time = time.strftime("%Y%m%d-%H%M%S")
-                session_history = []  # Initialize session context
-                
-                # Continuous conversation loop
-                while jarvis_state['is_running']:
-                    # Enter conversation mode
-                    run_async(send_state_change('listening'))
-                    run_async(send_status_update({
-                        'voiceRecognition': 'Active'
-                    }))
-                    
-                    timestamp = time.strftime("%Y%m%d-%H%M%S")
+            print("🟢 Entering conversation mode...")
+            session.reset()
+            
+            # Continuous conversation loop
+            while jarvis_state['is_running']:
+                with trace_engine.trace("turn", session=session.key, wake_trace=wake_trace) as turn_trace:
+                    session.set_state('listening')
+                    session.set_status(voiceRecognition='Active')
                     
-                    # If we already have text (from queue), use it. Otherwise listen.
+                    # Use the command spoken with the wake word, otherwise listen
                     if not user_text:
-                        # Check for new text commands from queue (non-blocking)
-                        try:
-                            user_text = command_queue.get_nowait()
-                            print(f"📨 Processing text command: {user_text}")
-                        except queue.Empty:
-                            # Listen for voice command
-                            jarvis_state['current_state'] = 'listening'
-                            user_text = listen_for_command()
+                        user_text = await pipeline.listen()
                     
                     if not user_text:
                         print("❓ Didn't catch that. Still listening... (say 'stop' to exit)")
-                        user_text = None  # Reset for next iteration
+                        turn_trace.discard()
                         continue  # Keep listening instead of breaking
                     
-                    print(f"📝 You said: {user_text}")
-                    run_async(send_user_speech(user_text))
-                    save_to_history("user", user_text, timestamp)
-                    
-                    # Check for exit commands
-                    if user_text.lower() in ["exit", "quit", "shutdown", "stop", "bye"]:
-                        print("👋 Exiting conversation mode...")
-                        # Save session to file before exiting
-                        from memory_engine import save_session_history
-                        save_session_history(session_history, session_start_time)
-                        jarvis_state['current_state'] = 'idle'
-                        user_text = None  # Reset
+                    if not await run_turn(session, user_text):
                         break  # Exit conversation loop
-                    
-                    # Process with AI (with session context)
-                    run_async(send_state_change('processing'))
-                    run_async(send_status_update({
-                        'processing': 'Active'
-                    }))
-                    
-                    start_time = time.time()
-                    ai_text = get_ai_response(user_text, session_history)
-                    response_time = int((time.time() - start_time) * 1000)
-                    
-                    # Check for action triggers
-                    if "[[" in ai_text and "]]" in ai_text:
-                        actions = re.findall(r'\[\[ACTION:.*?\]\]', ai_text)
-                        for action in actions:
-                            action_result = execute_action(action)
-                            print(f"⚙️ Action: {action_result}")
-                        # Clean up the text by removing all action tags for UI and TTS
-                        ai_text = re.sub(r'\[\[ACTION:.*?\]\]', '', ai_text).strip()
-
-                    print(f"🤖 Jarvis: {ai_text}")
-                    run_async(send_jarvis_response(ai_text, response_time))
-                    save_to_history("jarvis", ai_text, timestamp)
-                    
-                    # Update session history
-                    session_history.append(("User", user_text))
-                    session_history.append(("Jarvis", ai_text))
-                    
-                    # Generate and play speech
-                    run_async(send_state_change('speaking'))
-                    run_async(send_status_update({
-                        'audioOutput': 'Playing'
-                    }))
-                    
-                    response_audio = os.path.join(AUDIO_DIR, f"response_{timestamp}.mp3")
-                    tts_speak(ai_text, filename=response_audio)
-                    play_audio_blocking(response_audio)
-                    
-                    # Log interaction
-                    log_file = os.path.join(LOGS_DIR, "jarvis_logs.txt")
-                    with open(log_file, "a", encoding="utf-8") as f:
-                        f.write(f"[{timestamp}] You: {user_text}\n")
-                        f.write(f"[{timestamp}] Jarvis: {ai_text}\n\n")
-                    
-                    # Reset user_text for next iteration
-                    user_text = None
-                    # DO NOT reset state to idle - keep in conversation mode!
-                    
+                
+                # Reset user_text for next iteration
+                user_text = None
+                wake_trace = None
+                # DO NOT reset state to idle - keep in conversation mode!
+                
         except Exception as e:
             print(f"❌ Error in Jarvis loop: {e}")
-            run_async(send_error(str(e)))
-            jarvis_state['current_state'] = 'idle'
-            time.sleep(1)
+            session.send(send_error, str(e))
+            await asyncio.sleep(1)
 
 
 
-async def handle_client_message(websocket, message: str):
+def handle_binary_frame(client: ClientConnection, frame: bytes):
+    """Binary frames from clients: mic audio for the utterance in progress"""
+    if not frame:
+        return
+    if frame[0] == FRAME_MIC_PCM:
+        utterance = client.utterance
+        if utterance is None:
+            return  # No audio_start, or the utterance already ended
+        room = MAX_UTTERANCE_SECONDS * utterance['rate'] * 2 - len(utterance['pcm'])
+        utterance['pcm'] += frame[1:1 + max(room, 0)]
+    else:
+        print(f"❌ Unknown binary frame type {frame[0]} from client {client.id}")
+
+
+async def handle_client_message(client: ClientConnection, message):
     """Handle incoming messages from clients"""
+    if not wire_codec.is_message_frame(message):
+        handle_binary_frame(client, message)
+        return
     try:
-        data = json.loads(message)
+        data = wire_codec.decode(message)
         message_type = data.get('type')
         
-        if message_type == 'manual_trigger':
+        if message_type == 'hello':
+            # Encoding negotiation: the reply goes out in JSON, later messages in the chosen encoding
+            codec = wire_codec.negotiate((data.get('payload') or {}).get('encodings'))
+            client.send({'type': 'hello', 'payload': {'encoding': codec.name, 'types': wire_codec.MESSAGE_TYPES}})
+            client.codec = codec
+            print(f"🔤 Client {client.id} uses {codec.name} encoding")
+            
+        elif message_type == 'manual_trigger':
             # Manual voice command trigger from UI
             print("🎤 Manual voice command triggered from UI")
             # You could implement manual trigger logic here
             
         elif message_type == 'text_command':
             # Text command from UI
-            text = data.get('payload', {}).get('text')
+            # Each connection is its own conversation unless the client names a shared session
+            payload = data.get('payload') or {}
+            text = payload.get('text')
             if text:
                 print(f"📩 Received text command: {text}")
-                command_queue.put(text)
+                session = get_session(str(payload.get('session') or f"client-{client.id}"))
+                session.clients.add(client)
+                session.submit(text)
+            
+        elif message_type == 'cancel':
+            # Stop button: drop the session's queued commands and cut off its running turn
+            payload = data.get('payload') or {}
+            session = sessions.get(str(payload.get('session') or f"client-{client.id}"))
+            if session:
+                session.cancel()
+            
+        elif message_type == 'audio_start':
+            # Client starts streaming a mic utterance as FRAME_MIC_PCM frames
+            payload = data.get('payload') or {}
+            client.utterance = {
+                'session': str(payload.get('session') or f"client-{client.id}"),
+                'rate': int(payload.get('sampleRate') or 16000),
+                'pcm': bytearray(),
+            }
+            
+        elif message_type == 'audio_end':
+            # Utterance complete: transcribe it and run it as a turn of the client's session
+            utterance, client.utterance = client.utterance, None
+            if utterance and utterance['pcm']:
+                seconds = len(utterance['pcm']) / (2 * utterance['rate'])
+                print(f"🎙️ Received {seconds:.1f}s of audio from client {client.id}")
+                session = get_session(utterance['session'])
+                session.clients.add(client)
+                session.submit(audio=(bytes(utterance['pcm']), utterance['rate']))
+            
+        elif message_type == 'audio_output':
+            # Client wants its session's replies streamed to it instead of played on the server
+            payload = data.get('payload') or {}
+            client.audio_output = bool(payload.get('enabled', True))
+            if payload.get('session'):
+                get_session(str(payload['session'])).clients.add(client)
             
         elif message_type == 'get_status':
             # Send current status
-            await send_status_update({
-                'voiceRecognition': 'Standby' if jarvis_state['current_state'] == 'idle' else 'Active',
-                'audioOutput': 'Playing' if jarvis_state['current_state'] == 'speaking' else 'Ready',
-                'processing': 'Active' if jarvis_state['current_state'] == 'processing' else 'Idle'
-            })
+            client.send({'type': 'status', 'payload': dict(jarvis_status, session=voice_session.key)})
+            
+        elif message_type == 'get_metrics':
+            # Counters, gauges and latency percentiles (also on the Prometheus endpoint)
+            client.send({'type': 'metrics', 'payload': metrics_engine.snapshot()})
             
         elif message_type == 'get_history':
-            # Send conversation history
-            await handle_get_history(websocket)
+            # Send one page of conversation history
+            await handle_get_history(client, data.get('payload') or {})
+            
+        elif message_type == 'subscribe_history':
+            # Send missed history entries, then live appends
+            await handle_subscribe_history(client, data.get('payload') or {})
             
-    except json.JSONDecodeError:
-        print(f"❌ Invalid JSON received: {message}")
+    except ValueError:
+        print(f"❌ Invalid message received: {message[:200]!r}")
     except Exception as e:
         print(f"❌ Error handling message: {e}")
 
@@ -401,58 +901,106 @@ async def handle_client_message(websocket, message: str):
 async def websocket_handler(websocket, path=None):
     """Handle WebSocket connections"""
     # Register client
-    connected_clients.add(websocket)
-    client_id = id(websocket)
-    print(f"✅ Client connected: {client_id}")
+    client = ClientConnection(websocket)
+    connected_clients.add(client)
+    print(f"✅ Client connected: {client.id}")
     
     try:
         # Send initial status
-        await websocket.send(json.dumps({
+        client.send({
             'type': 'status',
-            'payload': {
-                'voiceRecognition': 'Standby',
-                'audioOutput': 'Ready',
-                'processing': 'Idle'
-            }
-        }))
+            'payload': dict(jarvis_status, session=voice_session.key)
+        })
         
-        await websocket.send(json.dumps({
+        client.send({
             'type': 'state_change',
-            'payload': {'state': jarvis_state['current_state']}
-        }))
+            'payload': {'state': jarvis_state['current_state'], 'session': voice_session.key}
+        })
         
         # Listen for messages
         async for message in websocket:
-            await handle_client_message(websocket, message)
+            await handle_client_message(client, message)
             
     except websockets.exceptions.ConnectionClosed:
-        print(f"❌ Client disconnected: {client_id}")
+        print(f"❌ Client disconnected: {client.id}")
     finally:
-        connected_clients.discard(websocket)
+        client.close()
+        connected_clients.discard(client)
+        history_subscribers.pop(client, None)
+        for session in sessions.values():
+            session.clients.discard(client)
+
+
+async def monitor_loop_lag():
+    """Record how late the event loop wakes from a short sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics_engine.observe('event_loop_lag_seconds', max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+def enter_fake_ai_mode():
+    """Keep a load test's writes away from the real history, logs and memory files"""
+    global LOGS_DIR
+    import tempfile
+    import summary_engine
+    scratch = tempfile.mkdtemp(prefix="jarvis-load-")
+    history_store.use_scratch_copy(os.path.join(scratch, "history.db"))
+    summary_engine.USE_PROVIDERS = False
+    LOGS_DIR = scratch
+    trace_engine.TRACE_DIR = os.path.join(scratch, "traces")
+    trace_engine.TRACE_FILE = os.path.join(trace_engine.TRACE_DIR, "trace.json")
+    print(f"🧪 Fake AI ({FAKE_AI_LATENCY * 1000:.0f} ms replies), scratch data in {scratch}")
 
 
 async def start_server():
     """Start the WebSocket server"""
-    global MAIN_LOOP
+    global MAIN_LOOP, pipeline
     MAIN_LOOP = asyncio.get_running_loop()
+    if FAKE_AI:
+        enter_fake_ai_mode()
+        pipeline = TurnPipeline(FakeBackends(FAKE_AI_LATENCY))
+    else:
+        pipeline = TurnPipeline()
+    metrics_engine.serve(HOST, METRICS_PORT)
+    lag_task = asyncio.create_task(monitor_loop_lag())
     print(f"🚀 Starting WebSocket server on ws://{HOST}:{PORT}")
     
-    async with websockets.serve(websocket_handler, HOST, PORT):
+    deflate = ServerPerMessageDeflateFactory(
+        server_max_window_bits=DEFLATE_WINDOW_BITS,
+        client_max_window_bits=DEFLATE_WINDOW_BITS,
+        compress_settings={'level': DEFLATE_LEVEL, 'memLevel': DEFLATE_MEM_LEVEL},
+    )
+    async with websockets.serve(websocket_handler, HOST, PORT, compression=None, extensions=[deflate]):
         print(f"✅ WebSocket server running on ws://{HOST}:{PORT}")
         print(f"🌐 Open ui/index.html in your browser to access the UI")
         
-        # Start Jarvis loop in a separate thread AFTER loop is ready
-        if not jarvis_state['is_running']:
-            jarvis_state['is_running'] = True
-            jarvis_thread = threading.Thread(target=jarvis_loop, daemon=True)
-            jarvis_thread.start()
-            print("🤖 Jarvis logic thread started")
+        # Jarvis runs as a task on the same loop as the server (no voice loop without a real AI)
+        jarvis_state['is_running'] = True
+        jarvis_task = None
+        if not FAKE_AI:
+            jarvis_task = asyncio.create_task(jarvis_loop())
+            print("🤖 Jarvis loop started")
 
-        await asyncio.Future()  # Run forever
+        try:
+            await asyncio.Future()  # Run forever
+        finally:
+            jarvis_state['is_running'] = False
+            lag_task.cancel()
+            if jarvis_task:
+                jarvis_task.cancel()
 
 
 def main():
-    """Main entry point"""
+    """Main entry point (--fake-ai [reply ms] for load tests)"""
+    global FAKE_AI, FAKE_AI_LATENCY
+    if "--fake-ai" in sys.argv:
+        FAKE_AI = True
+        index = sys.argv.index("--fake-ai") + 1
+        if index < len(sys.argv) and sys.argv[index].isdigit():
+            FAKE_AI_LATENCY = int(sys.argv[index]) / 1000
+
     # Create necessary directories
     for folder in [LOGS_DIR, AUDIO_DIR]:
         if not os.path.exists(folder):
@@ -465,6 +1013,8 @@ def main():
     except KeyboardInterrupt:
         print("\n👋 Shutting down...")
         jarvis_state['is_running'] = False
+        wake_armed.set()  # Let the listener thread see the shutdown
+        background_writer.close()
 
 
 if __name__ == "__main__":
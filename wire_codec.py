@@ -0,0 +1,106 @@
+# wire_codec.py
+"""
+Message encodings for the WebSocket protocol.
+JSON text frames of {"type", "payload"} are the default. A client can ask for
+a more compact encoding by sending a hello message listing the ones it reads:
+- "compact": JSON text [type code, payload]
+- "msgpack": binary frame of FRAME_MESSAGE + MessagePack [type code, payload]
+  (needs the optional msgpack package)
+The server replies (in JSON) with the chosen encoding and the type codes.
+Every frame is self-describing, so messages from either side can use any
+encoding at any time.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# First byte of a binary MessagePack message; audio frames use the other values
+FRAME_MESSAGE = 0x00
+
+# Code = position; append only, clients get the table in the hello reply
+MESSAGE_TYPES = [
+    'hello', 'status', 'state_change', 'user_speech', 'jarvis_response', 'error',
+    'history_data', 'history_delta', 'history_append', 'tts_start', 'tts_end',
+    'text_command', 'get_status', 'get_history', 'subscribe_history',
+    'audio_start', 'audio_end', 'audio_output', 'get_metrics', 'metrics',
+    'cancel', 'turn_cancelled', 'action_result',
+]
+TYPE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+
+
+def _compact(message):
+    """[code, payload]; types without a code keep their name"""
+    kind = message['type']
+    return [TYPE_CODES.get(kind, kind), message.get('payload')]
+
+
+def _expand(item):
+    kind, payload = item[0], item[1] if len(item) > 1 else None
+    if isinstance(kind, int):
+        kind = MESSAGE_TYPES[kind] if kind < len(MESSAGE_TYPES) else None
+    return {'type': kind, 'payload': payload}
+
+
+class JsonCodec:
+    name = 'json'
+
+    def encode(self, message):
+        return json.dumps(message)
+
+
+class CompactCodec:
+    name = 'compact'
+
+    def encode(self, message):
+        return json.dumps(_compact(message), separators=(',', ':'), ensure_ascii=False)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    def encode(self, message):
+        return bytes([FRAME_MESSAGE]) + msgpack.packb(_compact(message), use_bin_type=True)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), CompactCodec())}
+if msgpack is not None:
+    CODECS['msgpack'] = MsgpackCodec()
+DEFAULT_CODEC = CODECS['json']
+
+
+def negotiate(requested):
+    """First encoding in the client's preference list that we support (JSON otherwise)"""
+    for name in requested or []:
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
+
+
+def encode(codec, message, cache=None):
+    """Encode a message, reusing cache[codec name] when a broadcast encodes it for many clients"""
+    if cache is None:
+        return codec.encode(message)
+    if codec.name not in cache:
+        cache[codec.name] = codec.encode(message)
+    return cache[codec.name]
+
+
+def is_message_frame(frame):
+    return isinstance(frame, str) or frame[:1] == bytes([FRAME_MESSAGE])
+
+
+def decode(frame):
+    """{'type', 'payload'} from a text frame (either JSON form) or a MessagePack frame"""
+    if isinstance(frame, str):
+        data = json.loads(frame)
+    else:
+        if msgpack is None:
+            raise ValueError("MessagePack frame received but msgpack is not installed")
+        data = msgpack.unpackb(frame[1:], raw=False)
+    if isinstance(data, list):
+        return _expand(data)
+    return data